@@ -0,0 +1,231 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules import logging_cfg
+from modules.logging_cfg import setup_logger, set_level, LEVELS
+
+# Machine types of the App dropdown
+MACHINE_TYPES = ["FCM One | 1.5", "FCM Oil 2b"]
+# Plot types: file prefix and plot function name in modules.plots
+PLOT_TYPES = {'overlap': ('ov_CO', 'change_over_overlap'),
+              'separate': ('sp_CO', 'change_over_divided')}
+
+def render_co(task):
+    # Executed in the worker processes: save html plots and Excel file of one changeover
+    # task: dict with the DataFrames of the changeover window and the data of the import
+    from modules import data_analysis as fcm_da
+    from modules import plots as fcm_plt
+
+    # Worker processes do not share the globals of the main process
+    fcm_da.DATA = task['data']
+    fcm_da.MT = task['mch_type']
+    # index.html shows every plot in an iframe: browsers only keep about 16 WebGL contexts, the report plots stay SVG
+    fcm_plt.RENDER_MODE = 'svg'
+
+    start = time.perf_counter()
+    files = []
+    images = [] # (fig dict, file path, format) saved by static_export in the main process
+    name = str(task['index']) + "_" + str(task['CO']['Start'].date())
+
+    for plot_type in task['plots']:
+        prefix, plot_function = PLOT_TYPES[plot_type]
+        fig = getattr(fcm_plt, plot_function)(task['df'], task['alarms'], task['events'], task['mch_info'])
+        if fig is None:
+            raise RuntimeError(f"{plot_function} failed for changeover {task['index']}, see log file")
+
+        file_path = os.path.join(task['dest_folder'], prefix + name + ".html")
+        fcm_plt.save_html(fig, file_path, task['plotlyjs'])
+        files.append(file_path)
+
+        if task['images']:
+            fig_dict = fig.to_dict()
+            images.extend((fig_dict, file_path[:-len(".html")] + "." + format, format) for format in task['images'])
+
+    if task['excel']:
+        df = task['df']
+        all_co_cols = [col for category in task['data']['change_over_vars'].values() for col in category]
+        file_path = os.path.join(task['dest_folder'], "CO" + name + ".xlsx")
+        fcm_da.write_excel(file_path, [df, task['alarms'], task['events']], ['Standard', 'Alarms', 'Events'],
+                           df['DateTime'].min(), df['DateTime'].max(), all_co_cols)
+        files.append(file_path)
+
+    return files, images, len(task['df']), time.perf_counter() - start
+
+def detect_machine(folder, fcm_da):
+    # Machine type with all its standard columns in the header (4th row) of the first S file of the folder
+    s_files = sorted(filename for filename in os.listdir(folder) if filename.startswith('S') and filename.lower().endswith('.csv'))
+    if not s_files:
+        return None
+
+    with open(os.path.join(folder, s_files[0]), 'r', encoding='unicode_escape') as csv_file:
+        header = [csv_file.readline() for _ in range(4)][-1].strip().split(';')
+
+    for mch_type in MACHINE_TYPES:
+        fcm_da.load_data(mch_type)
+        if set(fcm_da.DATA['std_cols']).issubset(header):
+            return mch_type
+    return None
+
+def co_tasks(folder, dest_folder, mch_type, plots, excel, plotlyjs, images, fcm_da):
+    # Import the logs of a folder and return one render task per changeover
+    file_list = [filename for filename in os.listdir(folder) if filename.lower().endswith('.csv')]
+    result = fcm_da.import_data(folder, file_list, mch_type)
+    if result is None or result[0] != 1:
+        code = None if result is None else result[0]
+        print(f"  Import failed (code {code}): {folder}" + (f" - {result[1]}" if code == 0 else ""))
+        return [], len(file_list), 0
+
+    _, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents = result
+    os.makedirs(dest_folder, exist_ok=True)
+    if plotlyjs == 'shared' and plots:
+        # Saved once before the worker processes save the html files
+        from modules import plots as fcm_plt
+        fcm_plt.plotlyjs_file(dest_folder)
+
+    tasks = []
+    for index, CO in enumerate(COs, start=1):
+        df = fcm_da.ChangeOverToDF(CO, LogsStandard)
+        first, last = df['DateTime'].iat[0], df['DateTime'].iat[-1]
+        # Only the rows of the changeover window are sent to the worker processes
+        tasks.append({'index': index, 'CO': CO, 'df': df,
+                      'alarms': fcm_da.time_slice(LogsAlarms, first, last),
+                      'events': fcm_da.time_slice(LogsEvents, first, last),
+                      'mch_info': mch_info, 'data': fcm_da.DATA, 'mch_type': mch_type,
+                      'plots': plots, 'excel': excel, 'plotlyjs': plotlyjs, 'images': images, 'dest_folder': dest_folder})
+
+    rows = len(LogsStandard) + len(LogsAlarms) + len(LogsEvents)
+    fcm_da.release(LogsStandard)
+    return tasks, len(file_list), rows
+
+def main():
+    parser = argparse.ArgumentParser(description="VisuaLite batch report: changeover plots and Excel files of one or more folders of log files")
+    parser.add_argument('folders', nargs='+', help="folders with the .csv log files of one machine each")
+    parser.add_argument('-m', '--machine', default=None, choices=MACHINE_TYPES, help="machine type of the logs (default: detected from the S files of each folder)")
+    parser.add_argument('-o', '--output', default=None, help="output folder (default: 'VisuaLite_report' inside each folder)")
+    parser.add_argument('-p', '--plots', nargs='*', default=list(PLOT_TYPES), choices=list(PLOT_TYPES), help="plot types to save")
+    parser.add_argument('--no-excel', action='store_true', help="do not save the Excel files")
+    parser.add_argument('--embed-plotlyjs', action='store_true', help="embed Plotly.js in each html file instead of one shared plotly-<version>.min.js per output folder")
+    parser.add_argument('-i', '--images', nargs='*', default=[], choices=['png', 'svg', 'pdf'], help="also save the plots as static images (needs kaleido)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="processes used to save the reports (default: one per CPU core)")
+    parser.add_argument('--log-level', default=None, choices=LEVELS, help="level of the log file __vl.log/visualite_debug.log (default: DEBUG)")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    if args.log_level:
+        set_level(args.log_level)
+    logger.info("Visualite batch launched")
+
+    from modules import data_analysis as fcm_da
+    from modules import static_export
+
+    if args.images and not static_export.available():
+        parser.error("--images needs the kaleido package: pip install kaleido")
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or cpus
+    start = time.perf_counter()
+    plotlyjs = 'embed' if args.embed_plotlyjs else 'shared'
+    reports = {} # {dest_folder: (folder, [html files])}, for the index pages
+    stats = {'folders': 0, 'files': 0, 'rows': 0, 'COs': 0, 'outputs': 0, 'bytes': 0, 'import': 0.0, 'render': 0.0, 'images': 0.0}
+    image_jobs = []
+
+    def save_images():
+        # Static images of the plots rendered so far, in parallel in the renderer processes kept running
+        image_start = time.perf_counter()
+        for (_, file_path, _), (saved, error) in zip(image_jobs, static_export.export(image_jobs)):
+            if saved is None:
+                print(f"  Error saving {file_path}: {error}")
+                continue
+            stats['outputs'] += 1
+            stats['bytes'] += os.path.getsize(saved)
+        stats['images'] += time.perf_counter() - image_start
+        image_jobs.clear()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=logging_cfg.worker_init, initargs=(logging_cfg.LOG_QUEUE,)) as executor:
+            futures = {}
+            for folder in args.folders:
+                print(f"Importing {folder}")
+                if args.output is None:
+                    dest_folder = os.path.join(folder, 'VisuaLite_report')
+                else:
+                    dest_folder = os.path.join(args.output, os.path.basename(os.path.normpath(folder)))
+
+                mch_type = args.machine or detect_machine(folder, fcm_da)
+                if mch_type is None:
+                    print("  Machine type not found, use --machine")
+                    continue
+                print(f"  {mch_type}")
+
+                # Import processes and render processes share the cores: while reports of the previous folders are saved
+                # the import only uses the cores left by the render processes (1: serial import in the main process)
+                rendering = any(not future.done() for future in futures)
+                fcm_da.WORKERS = max(1, cpus - workers) if rendering else cpus
+                import_start = time.perf_counter()
+                tasks, n_files, rows = co_tasks(folder, dest_folder, mch_type, args.plots, not args.no_excel, plotlyjs, args.images, fcm_da)
+                stats['import'] += time.perf_counter() - import_start
+                # Import processes are stopped before the render processes start working on this folder
+                fcm_da.shutdown_pool()
+                stats['folders'] += 1
+                stats['files'] += n_files
+                stats['rows'] += rows
+                print(f"  {n_files} files, {len(tasks)} changeovers")
+
+                # Reports of this folder are saved while the next folder is imported
+                for task in tasks:
+                    futures[executor.submit(render_co, task)] = (folder, task['index'], dest_folder)
+
+            for future in as_completed(futures):
+                folder, index, dest_folder = futures[future]
+                try:
+                    files, images, _, seconds = future.result()
+                except Exception as e:
+                    logger.error("--- Error saving changeover %s of %s", index, folder)
+                    logger.error(e, exc_info=True)
+                    print(f"  Error saving changeover {index} of {folder}: {e}")
+                    continue
+
+                stats['COs'] += 1
+                stats['outputs'] += len(files)
+                stats['bytes'] += sum(os.path.getsize(file) for file in files)
+                stats['render'] += seconds
+                reports.setdefault(dest_folder, (folder, []))[1].extend(file for file in files if file.endswith('.html'))
+
+                # Figures are kept in memory until saved, in groups of a few images per renderer
+                image_jobs.extend(images)
+                if len(image_jobs) >= 4 * static_export.WORKERS:
+                    save_images()
+
+            if image_jobs:
+                save_images()
+    finally:
+        fcm_da.shutdown_pool()
+        static_export.shutdown()
+
+    if reports:
+        from modules import plots as fcm_plt
+        for dest_folder, (folder, files) in reports.items():
+            index = fcm_plt.write_index(dest_folder, sorted(files), "VisuaLite report - " + os.path.abspath(folder))
+            print(f"Index:        {index}")
+
+    elapsed = time.perf_counter() - start
+    print()
+    print(f"Folders:      {stats['folders']}")
+    print(f"Log files:    {stats['files']} ({stats['rows']} rows) imported in {stats['import']:.1f} s")
+    print(f"Changeovers:  {stats['COs']} -> {stats['outputs']} files, {stats['bytes']/1e6:.1f} MB")
+    print(f"Render time:  {stats['render']:.1f} s in {workers} processes")
+    if args.images:
+        print(f"Image time:   {stats['images']:.1f} s in {static_export.WORKERS} renderer processes")
+    print(f"Total time:   {elapsed:.1f} s")
+    if elapsed > 0:
+        print(f"Throughput:   {stats['COs']/elapsed:.2f} changeovers/s, {stats['outputs']/elapsed:.2f} files/s, {stats['rows']/elapsed:.0f} rows/s")
+
+    logger.info("Batch finished: %s", stats)
+
+if __name__ == "__main__":
+    # Needed by the process pools in the PyInstaller executable
+    multiprocessing.freeze_support()
+    main()
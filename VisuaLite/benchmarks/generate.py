@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Run from any folder: modules of VisuaLite
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import data_analysis as fcm_da
+
+# Increase if the generated logs change, folders of an older version are generated again
+GENERATOR_VERSION = 1
+# Machines: schema file, machine info (first 3 rows of the files) and short name of the folders
+MACHINES = {'FCM One | 1.5': {'schema': fcm_da.FCM_ONE, 'info': ['F60', 'FM 18 M 6996', 'V3.00.09'], 'short': 'one'},
+            'FCM Oil 2b': {'schema': fcm_da.FCM_BASIC, 'info': ['FCM Oil 2', 'FM22A0454', 'V01.00.17'], 'short': 'basic'}}
+# Days of logs at scale 1 (10x: 20 days, 100x: 200 days)
+DAYS = 2
+# Seconds between rows of the Standard Logs and hours of logs in each S file
+PERIOD = 10
+FILE_HOURS = 8
+# Days of logs in each A and E file
+ALARM_FILE_DAYS = 7
+# First row of the logs
+START = datetime.datetime(2023, 1, 2, 6, 0, 0)
+# Hours between changeovers and minutes of each changeover
+CO_EVERY_HOURS = (6, 30)
+CO_MINUTES = (15, 60)
+# Alarm bursts per day out of changeovers, share of changeovers with an alarm burst, alarms in a burst
+BURSTS_PER_DAY = 3
+CO_BURSTS = 0.5
+BURST_ALARMS = (3, 25)
+# Fuels the machine changes between: heavy fuel oil (viscosity control) and marine gas oil (temperature control)
+FUELS = [{'temperature': 130.0, 'viscosity': 13.0, 'density': 985.0, 'flow': 2400.0},
+         {'temperature': 40.0, 'viscosity': 4.0, 'density': 850.0, 'flow': 2600.0}]
+
+def file_name(prefix, date):
+    # Log file name of the machine: S_2023_1_2__6_0_0.csv
+    return f"{prefix}_{date.year}_{date.month}_{date.day}__{date.hour}_{date.minute}_{date.second}.csv"
+
+def changeovers(n, rng):
+    # (first row, last row) of the changeovers of n rows
+    COs = []
+    row = int(rng.uniform(1, CO_EVERY_HOURS[0]) * 3600 / PERIOD)
+    while True:
+        length = int(rng.uniform(*CO_MINUTES) * 60 / PERIOD)
+        if row + length >= n:
+            return COs
+        COs.append((row, row + length))
+        row += length + int(rng.uniform(*CO_EVERY_HOURS) * 3600 / PERIOD)
+
+def ramp(values, COs, before, after):
+    # Values of each row, during changeovers a linear ramp from the value of the previous fuel to the next one
+    for (first, last), old, new in zip(COs, before, after):
+        values[first:last] = np.linspace(old, new, last - first, endpoint=False)
+    return values
+
+def standard_logs(schema, dates, COs, rng):
+    # Standard Logs following the columns and units of the schema
+    n = len(dates)
+    starts = np.zeros(n, dtype=np.int64)
+    starts[[first for first, _ in COs]] = 1
+    # Fuel of each row, the next fuel from the start of a changeover
+    fuel = np.cumsum(starts) % 2
+    in_co = np.zeros(n, dtype=np.int8)
+    for first, last in COs:
+        in_co[first:last] = 1
+    old_fuels = [(k % 2) for k in range(len(COs))]
+    new_fuels = [((k + 1) % 2) for k in range(len(COs))]
+
+    def fuel_value(name, noise):
+        # Value of the fuel of each row, ramp during changeovers, gaussian noise
+        target = np.array([FUEL[name] for FUEL in FUELS])[fuel]
+        values = ramp(target.astype(np.float64), COs, [FUELS[k][name] for k in old_fuels], [FUELS[k][name] for k in new_fuels])
+        return values + rng.normal(0, noise, n)
+
+    temperature = fuel_value('temperature', 0.4)
+    viscosity = fuel_value('viscosity', 0.15)
+    target_temperature = np.array([FUEL['temperature'] for FUEL in FUELS])[fuel]
+    target_viscosity = np.array([FUEL['viscosity'] for FUEL in FUELS])[fuel]
+    # Heavy fuel in viscosity control, gas oil in temperature control
+    viscosity_control = (fuel == 0).astype(np.int8)
+    # Machine stopped (manual mode) some hours a week
+    auto = (np.sin(np.arange(n) * 2 * np.pi * PERIOD / (7 * 86400)) < 0.95).astype(np.int8)
+    # Fuel valves move (no limit switch activated) during changeovers
+    fuel_valves = [np.where(fuel == k, 1, 3).astype(np.int8) for k in (0, 1)]
+    for valve in fuel_valves:
+        valve[in_co == 1] = 2
+
+    # Columns of the changeover plots (both machine types), other columns from their unit
+    signals = {'ChangeOverInProgress': in_co, 'ChangeoverInProgress': in_co,
+               'CurrentControl': viscosity_control, 'ControlType': 1 - viscosity_control,
+               'MachineStatus': np.where(in_co == 1, 20, np.where(auto == 1, 5, 61)).astype(np.int16),
+               'CV1_Position': fuel_valves[0], 'CV2_Position': fuel_valves[1],
+               'TT1': temperature, 'TT2': temperature + rng.normal(0, 0.3, n), 'Temperature': temperature,
+               'TargetTemperature': target_temperature, 'TemperatureSetPoint': target_temperature,
+               'TemperatureLowLimit': target_temperature - 10, 'TemperatureHighLimit': target_temperature + 10,
+               'VT': viscosity, 'Viscosity': viscosity,
+               'TargetViscosity': target_viscosity, 'ViscositySetPoint': target_viscosity,
+               'ViscosityLowLimit': target_viscosity - 2, 'ViscosityHighLimit': target_viscosity + 2,
+               'ActualSetpoint': np.where(viscosity_control == 1, target_viscosity, target_temperature),
+               'PID_OutputError': rng.normal(0, 0.5, n)}
+
+    columns = {}
+    for col in schema['std_cols']:
+        unit = schema['units'][col]
+        if col in signals:
+            values = signals[col]
+        elif unit == 'datetime':
+            values = dates
+        elif unit == 'gps':
+            values = np.full(n, 'No valid data', dtype=object)
+        elif unit == 'bool':
+            values = auto
+        elif unit == 'valve_pos':
+            values = np.full(n, rng.choice([1, 3]), dtype=np.int8)
+        elif unit == 'int':
+            # Pumps and filters in use, changed once a day
+            values = (1 + (np.arange(n) * PERIOD // 86400) % 2).astype(np.int8)
+        elif unit == 'degreesC':
+            values = temperature - rng.uniform(0, 5) + rng.normal(0, 0.3, n)
+        elif unit == 'cSt':
+            values = viscosity + rng.normal(0, 0.1, n)
+        elif unit == 'density':
+            values = fuel_value('density', 1.0)
+        elif unit in ('kg/h', 'l/h', 'l/h | kg/h'):
+            values = fuel_value('flow', 20.0) * rng.uniform(0.5, 1.0)
+        elif unit == 'bar':
+            values = rng.uniform(0.5, 14.0) + rng.normal(0, 0.1, n) + np.sin(np.arange(n) / 500.0) * 0.2
+        else:
+            values = np.abs(rng.normal(rng.uniform(0, 10), 0.5, n))
+
+        if values.dtype.kind == 'f':
+            values = np.round(values, 3 if unit in ('bar', 'cSt') else 1)
+        columns[col] = values
+
+    return pd.DataFrame(columns)
+
+def alarm_logs(schema, dates, COs, rng):
+    # Alarm bursts (some alarms in a few minutes) at changeovers and at random times, 5% of unknown codes
+    codes = np.array([int(code) for code in schema['alarm_labels']])
+    starts = [dates[first] for first, _ in COs if rng.random() < CO_BURSTS]
+    days = (dates[-1] - dates[0]) / np.timedelta64(1, 'D')
+    starts += list(dates[0] + (rng.uniform(0, days, int(days * BURSTS_PER_DAY)) * 86400).astype(np.int64).astype('timedelta64[s]'))
+
+    times, numbers = [], []
+    for start in starts:
+        k = rng.integers(*BURST_ALARMS)
+        times.append(start + np.sort(rng.integers(0, 120, k)).astype('timedelta64[s]'))
+        burst = rng.choice(codes, k)
+        burst[rng.random(k) < 0.05] = codes.max() + 1
+        numbers.append(burst)
+
+    alarms = pd.DataFrame({'DateTime': np.concatenate(times) if times else np.array([], dtype='datetime64[s]'),
+                           'AlarmNumber': np.concatenate(numbers) if numbers else np.array([], dtype=np.int64)})
+    return alarms.sort_values('DateTime', kind='stable').reset_index(drop=True)
+
+def event_logs(schema, dates, COs, rng):
+    # Events of the changeovers (initiated / finished), auto mode and pump changes with their value in Data
+    if not schema['eve_cols']:
+        return pd.DataFrame()
+    times = [dates[first] for first, _ in COs] + [dates[last] for _, last in COs]
+    numbers = [2] * len(COs) + [3] * len(COs)
+    days = int((dates[-1] - dates[0]) / np.timedelta64(1, 'D'))
+    for day in range(days):
+        moment = dates[0] + np.timedelta64(day * 86400 + int(rng.integers(0, 86400)), 's')
+        times += [moment, moment, moment + np.timedelta64(5, 's')]
+        numbers += [5, 31, int(rng.choice([6, 7, 8]))]
+
+    events = pd.DataFrame({'DateTime': times, 'GpsPos': 'No valid data', 'EventNumber': numbers})
+    events['Data'] = np.where(events['EventNumber'].isin([6, 7, 8]), rng.integers(1, 3, len(events)), 1)
+    return events.sort_values('DateTime', kind='stable').reset_index(drop=True)
+
+def write_logs(folder, prefix, df, info, rows_per_file=None, days_per_file=None):
+    # Save df in log files of the machine: 3 rows of machine info, header, ';' separated values with decimal ','
+    if df.empty:
+        return []
+    if days_per_file is not None:
+        groups = ((df['DateTime'] - df['DateTime'].iloc[0]) // pd.Timedelta(days=days_per_file)).to_numpy()
+        splits = np.flatnonzero(np.diff(groups)) + 1
+    else:
+        splits = np.arange(rows_per_file, len(df), rows_per_file)
+
+    files = []
+    columns = list(df.columns)
+    for part in np.split(np.arange(len(df)), splits):
+        chunk = df.iloc[part].copy()
+        chunk[''] = '' # the machine ends each row with ';'
+        date = chunk['DateTime'].iloc[0]
+        path = os.path.join(folder, file_name(prefix, date))
+        with open(path, 'w', newline='') as log_file:
+            log_file.write(''.join(row + ';' * len(columns) + '\r\n' for row in info))
+            log_file.write(';'.join(columns) + ';\r\n')
+            chunk.to_csv(log_file, sep=';', decimal=',', header=False, index=False, date_format='%Y-%m-%d %H:%M:%S', lineterminator='\r\n')
+        files.append(path)
+    return files
+
+def generate(folder, mch_type, scale=1, seed=0):
+    # Folder of synthetic log files of mch_type, DAYS * scale days, same logs for the same seed
+    # returns the description saved in generator.json (files, rows, changeovers)
+    machine = MACHINES[mch_type]
+    with open(machine['schema'], 'r') as schema_file:
+        schema = json.load(schema_file)
+    rng = np.random.default_rng(seed)
+
+    n = int(DAYS * scale * 86400 / PERIOD)
+    dates = np.datetime64(START) + (np.arange(n) * PERIOD).astype('timedelta64[s]')
+    COs = changeovers(n, rng)
+
+    os.makedirs(folder, exist_ok=True)
+    standard = standard_logs(schema, dates, COs, rng)
+    alarms = alarm_logs(schema, dates, COs, rng)
+    events = event_logs(schema, dates, COs, rng)
+    files = write_logs(folder, 'S', standard, machine['info'], rows_per_file=int(FILE_HOURS * 3600 / PERIOD))
+    files += write_logs(folder, 'A', alarms, machine['info'], days_per_file=ALARM_FILE_DAYS)
+    files += write_logs(folder, 'E', events, machine['info'], days_per_file=ALARM_FILE_DAYS)
+
+    description = {'version': GENERATOR_VERSION, 'mch_type': mch_type, 'scale': scale, 'seed': seed,
+                   'files': [os.path.basename(file) for file in files],
+                   'rows': {'S': len(standard), 'A': len(alarms), 'E': len(events)}, 'changeovers': len(COs)}
+    with open(os.path.join(folder, 'generator.json'), 'w') as description_file:
+        json.dump(description, description_file, indent=1)
+    return description
+
+def get_folder(data_dir, mch_type, scale=1, seed=0):
+    # Folder of generated logs in data_dir, generated only if it does not exist yet (or is from another version)
+    folder = os.path.join(data_dir, f"{MACHINES[mch_type]['short']}_{scale}x_seed{seed}")
+    try:
+        with open(os.path.join(folder, 'generator.json'), 'r') as description_file:
+            description = json.load(description_file)
+        if description['version'] == GENERATOR_VERSION:
+            return folder, description
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if os.path.isdir(folder):
+        for file in os.listdir(folder):
+            os.remove(os.path.join(folder, file))
+    return folder, generate(folder, mch_type, scale, seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate folders of synthetic FCM log files (S_, A_ and E_ .csv files)")
+    parser.add_argument('folder', help="output folder, one subfolder per machine type and scale")
+    parser.add_argument('-m', '--machines', nargs='*', default=list(MACHINES), choices=list(MACHINES), help="machine types")
+    parser.add_argument('-s', '--scales', nargs='*', type=int, default=[1, 10, 100], help=f"sizes of the logs, 1 = {DAYS} days")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed generates the same logs")
+    args = parser.parse_args()
+
+    for mch_type in args.machines:
+        for scale in args.scales:
+            folder, description = get_folder(args.folder, mch_type, scale, args.seed)
+            print(f"{folder}: {len(description['files'])} files, {description['rows']} rows, {description['changeovers']} changeovers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+# Run from any folder: modules of VisuaLite
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import data_analysis as fcm_da
+from modules import log_cache
+from modules import plots as fcm_plt
+
+import generate
+
+# Folder of this script: generated logs and baseline are saved next to it
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_PATH, 'data')
+BASELINE = os.path.join(BENCH_PATH, 'baseline.json')
+# A benchmark is slower than the baseline if it takes more than TOLERANCE times the baseline time
+TOLERANCE = 1.25
+# Benchmarks shorter than this (seconds) are not compared, their times are mostly noise
+MIN_SECONDS = 0.01
+
+def best_time(func, repeat):
+    # Minimum time of repeat calls of func and the result of the last call
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def raw_logs(files):
+    # Log files read as by read_log_file, before Format_DF_*
+    return pd.concat([pd.read_csv(file, sep=';', skiprows=3, decimal=',', encoding='unicode_escape') for file in files], ignore_index=True)
+
+def benchmarks(folder, mch_type):
+    # {name: (function, result summary)} of one folder of logs, data shared by the benchmarks is prepared first
+    fcm_da.MT = mch_type
+    fcm_da.load_data(mch_type)
+    files = sorted(os.path.join(folder, file) for file in os.listdir(folder) if file.endswith('.csv'))
+    files = [file.replace('\\', '/') for file in files]
+    by_type = {prefix: [file for file in files if os.path.basename(file).startswith(prefix)] for prefix in 'SAE'}
+
+    raw = {prefix: raw_logs(by_type[prefix]) for prefix in 'SAE' if by_type[prefix]}
+    flag, mch_info, parsed = fcm_da.check_files(by_type['S'])
+    logs = fcm_da.concat_files(parsed)
+    alarms = fcm_da.Format_DF_ALogs(raw['A']) if 'A' in raw else pd.DataFrame()
+    events = fcm_da.Format_DF_ELogs(raw['E']) if 'E' in raw else pd.DataFrame()
+    COs = fcm_da.index_COs(fcm_da.IdentifyCOs(logs), logs)
+    fcm_da.get_pyramid(logs)
+    co_df = fcm_da.ChangeOverToDF(COs[0], logs)
+    cols = [col for category in list(fcm_da.DATA['change_over_vars'].values())[:2] for col in category]
+    first, last = fcm_da.first_last(logs)
+    # Excel export of the whole logs, at most the rows of one sheet
+    export_last = logs['DateTime'].iat[min(len(logs), fcm_da.EXCEL_MAX_ROWS - 2) - 1]
+    excel_file = os.path.join(tempfile.gettempdir(), 'visualite_benchmark.xlsx')
+
+    def traces(fig):
+        return None if fig is None else len(fig.data)
+
+    tests = {
+        'check_files': (lambda: fcm_da.check_files(files), lambda r: [r[0], sum(len(df) for df in r[2])]),
+        'concat_files': (lambda: fcm_da.concat_files(parsed), len),
+        'Format_DF_SLogs': (lambda: fcm_da.Format_DF_SLogs(raw['S']), len),
+        'Format_DF_ALogs': (lambda: fcm_da.Format_DF_ALogs(raw['A']), len),
+        'IdentifyCOs': (lambda: fcm_da.IdentifyCOs(logs), len),
+        'change_over_overlap': (lambda: fcm_plt.change_over_overlap(co_df, alarms, events, mch_info), traces),
+        'change_over_divided': (lambda: fcm_plt.change_over_divided(co_df, alarms, events, mch_info), traces),
+        'custom_plot_divided': (lambda: fcm_plt.custom_plot_divided(logs, alarms, events, cols, first, last, 'benchmark'), traces),
+        'change_over_preview': (lambda: fcm_plt.change_over_preview(co_df), lambda fig: fcm_plt.plt.close(fig) or 1),
+        'write_excel': (lambda: fcm_da.write_excel(excel_file, [logs, alarms, events], ['Standard', 'Alarms', 'Events'], first, export_last, cols),
+                        lambda r: len(fcm_da.time_slice(logs, first, export_last))),
+    }
+    if 'E' in raw:
+        tests['Format_DF_ELogs'] = (lambda: fcm_da.Format_DF_ELogs(raw['E']), len)
+    return tests
+
+def run(machines, scales, seed=0, repeat=3, data_dir=DATA_DIR, only=None):
+    # Generate the folders if needed and time the benchmarks: {dataset: {benchmark: {'seconds':, 'result':}}}
+    results = {}
+    for mch_type in machines:
+        for scale in scales:
+            folder, description = generate.get_folder(data_dir, mch_type, scale, seed)
+            dataset = os.path.basename(folder)
+            print(f"{dataset}: {len(description['files'])} files, {description['rows']['S']} rows, {description['changeovers']} changeovers")
+            results[dataset] = {}
+            for name, (func, summary) in benchmarks(folder, mch_type).items():
+                if only and name not in only:
+                    continue
+                seconds, result = best_time(func, repeat if scale < 100 else 1)
+                results[dataset][name] = {'seconds': round(seconds, 4), 'result': summary(result)}
+                print(f"  {name:<22} {seconds:8.3f} s")
+    fcm_da.shutdown_pool()
+    return results
+
+def machine():
+    # Computer and python of the results, times are only comparable on the same computer
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Print the times against the baseline, returns the benchmarks slower than the baseline or with other results
+    regressions = []
+    print(f"\n{'benchmark':<42} {'seconds':>9} {'baseline':>9} {'ratio':>6}")
+    for dataset, tests in results.items():
+        for name, result in tests.items():
+            base = baseline.get(dataset, {}).get(name)
+            if base is None:
+                print(f"{dataset + ' ' + name:<42} {result['seconds']:9.3f} {'-':>9} {'-':>6}  new")
+                continue
+            ratio = result['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+            status = ''
+            if result['result'] != base['result']:
+                status = f"RESULT CHANGED ({base['result']} -> {result['result']})"
+            elif ratio > tolerance and max(result['seconds'], base['seconds']) >= MIN_SECONDS:
+                status = 'SLOWER'
+            elif ratio < 1 / tolerance and max(result['seconds'], base['seconds']) >= MIN_SECONDS:
+                status = 'faster'
+            if status and status != 'faster':
+                regressions.append((dataset, name, status))
+            print(f"{dataset + ' ' + name:<42} {result['seconds']:9.3f} {base['seconds']:9.3f} {ratio:6.2f}  {status}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the import, plot and export functions over synthetic log folders and compare with a baseline")
+    parser.add_argument('-m', '--machines', nargs='*', default=list(generate.MACHINES), choices=list(generate.MACHINES), help="machine types")
+    parser.add_argument('-s', '--scales', nargs='*', type=int, default=[1, 10], help=f"sizes of the logs, 1 = {generate.DAYS} days (100 takes some minutes)")
+    parser.add_argument('-b', '--benchmarks', nargs='*', default=None, help="only these benchmarks (function names)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="calls of each benchmark, the fastest one is kept (scale 100: 1 call)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the generated logs")
+    parser.add_argument('--data', default=DATA_DIR, help="folder of the generated logs (generated once)")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('-o', '--output', default=None, help="also save the results of this run in a JSON file")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="slower if time > tolerance x baseline time")
+    args = parser.parse_args()
+
+    # Formatted files are not loaded from the cache, every run parses the csv files
+    log_cache.ENABLED = False
+
+    results = run(args.machines, args.scales, args.seed, args.repeat, args.data, args.benchmarks)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(dict(results, machine=machine()), output_file, indent=1)
+        print(f"\nResults saved: {args.output}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as baseline_file:
+                baseline = json.load(baseline_file)
+        for dataset, tests in results.items():
+            baseline.setdefault(dataset, {}).update(tests)
+        baseline['machine'] = machine()
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=1)
+        print(f"\nBaseline saved: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline in {args.baseline}, save one with --save-baseline")
+        return 0
+
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nBaseline of {baseline.get('machine', {}).get('date')} ({baseline.get('machine', {}).get('platform')})")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmarks slower than the baseline or with other results")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
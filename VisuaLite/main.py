@@ -1,13 +1,28 @@
-from modules.logging_cfg import setup_logger, backup_log
-# Backup the previous log before starting the application
-backup_log()
-# Create new log file
-logger = setup_logger()
-logger.info("Visualite Launched")
+import time
+# Start of the application, for the startup times report
+START = time.perf_counter()
 
-from modules import gui
+import multiprocessing
+
+from modules.logging_cfg import setup_logger
 
 if __name__ == "__main__":
+    # Needed by the import process pool in the PyInstaller executable
+    multiprocessing.freeze_support()
+
+    # Create new log file, the logs of previous executions are rotated
+    logger = setup_logger()
+    logger.info("Visualite Launched")
+
+    from modules import startup
+    startup.START = START
+
+    # New stage timeline for this execution (__vl.log/visualite_timeline.jsonl)
+    from modules import profiling
+    profiling.start()
+
+    from modules import gui
+    startup.mark("gui imported")
 
     logger.debug("--- Start ---")
 
@@ -20,4 +35,4 @@ if __name__ == "__main__":
         logger.error(e, exc_info=True)
     
     finally:
-        logger.debug("--- End ---")
\ No newline at end of file
+        logger.debug("--- End ---")
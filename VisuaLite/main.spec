@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('resources/*', 'resources/')],
-    hiddenimports=['babel.numbers', 'pandas'],
+    hiddenimports=['babel.numbers', 'pandas', 'modules.data_analysis', 'modules.plots', 'matplotlib.backends.backend_tkagg'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -1,9 +1,23 @@
 import pandas as pd
+import numpy as np
 import datetime
+import sys
 import os
 from csv import reader
 import json
 import re
+import gzip
+import io
+import time
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from modules import log_cache
+from modules import logging_cfg
+from modules import log_store
+from modules import profiling
+from modules import xlsx_stream
 
 from modules.logging_cfg import setup_logger
 logger = setup_logger()
@@ -20,6 +34,58 @@ FCM_ONE = os.path.join(SCRIPT_PATH, '..', 'resources', 'fcm_one.txt')
 DATA = None
 # Empty variable to save Machine Type
 MT = None
+# Columns to check in each type of log file
+FILE_COLS = {'S': 'std_cols', 'A': 'alm_cols', 'E': 'eve_cols'}
+# Number of processes used to parse log files (None: one per CPU core, 1: serial import)
+WORKERS = None
+# Minimum number of files to use the process pool, below it the serial import is faster
+MIN_FILES_PARALLEL = 8
+# Process pool kept alive between imports to avoid the start-up cost of the workers
+POOL = None
+POOL_WORKERS = None
+# Units (DATA['units']) of columns stored as small integers, the rest of numeric columns as float32
+INT_UNITS = ['bool', 'int', 'valve_pos', 'alarms', 'events']
+# Label columns stored as pandas category
+LABEL_COLS = ['CV1_Label', 'CV2_Label', 'CV3_Label', 'CV4_Label', 'CV5_Label', 'CC_Label', 'STS_Label',
+              'Label', 'Alm_Code_Label', 'Evn_Code_Label', 'GpsPos']
+# Rows logged in more than one file: 'first', 'last' (file order) or 'none' to remove all copies
+DUPLICATES_KEEP = 'first'
+# Standard logs bigger than this (bytes of csv files) are imported in chunks to a LogStore on disk
+STREAM_MIN_BYTES = 1024**3
+# Bytes of csv files parsed in each batch of the chunked import, limits the memory used
+STREAM_BATCH_BYTES = 128 * 1024**2
+# Queue to send the progress of the import to the GUI, None: progress not reported
+PROGRESS_QUEUE = None
+# Progress of the running import
+PROGRESS = {'files': 0, 'total_files': 0, 'bytes': 0, 'total_bytes': 0, 'start': 0.0}
+# Set by the GUI to cancel the running import
+CANCEL = threading.Event()
+# Aggregation levels of Standard Logs for long custom plots (pandas frequencies), finest first
+PYRAMID_LEVELS = ['1min', '10min', '1h']
+# Custom plots of more rows than this use the aggregation levels (one week of logs at one row every 10 s)
+# shorter windows are plotted from the raw logs, reduced to POINT_BUDGET points per trace by plots.reduce_points
+PYRAMID_MIN_ROWS = 7 * 24 * 360
+# Units of step columns: the aggregation levels keep the time and value of their first and last change in each bucket
+# (col_t1, col_v1, col_t2), not only the last value
+STEP_UNITS = ['bool', 'int', 'valve_pos']
+# Columns added to each bucket by the aggregation levels
+LEVEL_SUFFIXES = ('_min', '_max', '_t1', '_v1', '_t2')
+# Levels kept in memory for Standard Logs saved in a LogStore
+STORE_PYRAMID_LEVELS = ['10min', '1h']
+# Aggregation levels of the imported DataFrames: {id(df): (weakref to df, {level: DataFrame})}
+PYRAMIDS = {}
+# Maximum rows of an Excel sheet (header included), write_excel continues longer sheets in <name>_2, <name>_3...
+EXCEL_MAX_ROWS = xlsx_stream.MAX_ROWS
+# Export formats: {name: file extension}, CSV.gz and Parquet save one file per sheet
+EXPORT_FORMATS = {'Excel': '.xlsx', 'CSV.gz': '.csv.gz', 'Parquet': '.parquet'}
+# Rows converted (restore_floats) and written at once by the CSV.gz and Parquet exports (Excel: xlsx_stream.CHUNK_ROWS)
+EXPORT_CHUNK_ROWS = 20000
+# Time shown before and after a changeover in previews, plots and exports
+CO_PADDING = datetime.timedelta(minutes = 20)
+# Compiled code -> label lookups: {(MT, DATA key): (table, offset, categories, unknown)}
+LOOKUPS = {}
+# Memory of the last import: {DataFrame name: (bytes with default dtypes, bytes with compact dtypes)}
+MEMORY_REPORT = {}
 
 #----------------------------------------------------------- DECORATORS
 def custom_callback(func):
@@ -31,19 +97,21 @@ def custom_callback(func):
             logger.error(e, exc_info=True)
     return wrapper
 
-#----------------------------------------------------------- FUNCTIONS
-# Check csv files
-def read_mch_info(file):
-    with open(file, 'r') as csv_file:
-        csv_reader = reader(csv_file, delimiter=';')
-        mch_info = []
-        for i, row in enumerate(csv_reader):
-            # row variable is a list that represents a row in csv
-            mch_info.append(row[0])
-            if i == 2:
-                break          
-    return(mch_info)
+class ImportCancelled(Exception):
+    # Raised when CANCEL is set while files are read
+    pass
 
+def cancellable(func):
+    # Import functions return 3 if the user cancelled the import
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except ImportCancelled:
+            logger.debug("--- import cancelled by the user")
+            return 3, None, None, None, None, None
+    return wrapper
+
+#----------------------------------------------------------- FUNCTIONS
 def load_data(mch_type):
     logger.debug("load_data started ---")
     
@@ -57,10 +125,56 @@ def load_data(mch_type):
     with open(txt_file, 'r') as file:
         DATA = json.load(file)
 
-    logger.debug(DATA)
+    logger.debug("%s loaded: %s", txt_file, list(DATA))
     logger.debug("--- load_data finsihed")
 
-def check_files (files):
+# Check and import csv files
+def read_log_file(Filename, file_type, data, mch_type, key=None, mch_info_check=None):
+    # Single pass over one log file, executed in the worker processes:
+    # read the file once, check the machine info and header, parse and format the data from the same bytes
+    # returns machine info (first 3 rows), missing columns and the DataFrame (None if columns are missing or the machine is another one)
+
+    # Worker processes do not share the globals of the App
+    global DATA, MT
+    DATA = data
+    MT = mch_type
+
+    with open(Filename, 'rb') as csv_file:
+        content = csv_file.read()
+
+    first_rows = [line.decode('unicode_escape').rstrip('\r') for line in content.split(b'\n', 4)[:4]]
+    rows = list(reader(first_rows, delimiter=';'))
+
+    mch_info = [row[0] if row else '' for row in rows[:3]]
+    header = rows[3] if len(rows) > 3 else []
+
+    # Files of another machine are not parsed
+    if mch_info_check is not None and mch_info != mch_info_check:
+        return mch_info, [], None
+
+    # Check cols of row4 are from fcm logs
+    check_cols = DATA[FILE_COLS[file_type]]
+    missing_cols = [col for col in check_cols if col not in header]
+    if missing_cols:
+        return mch_info, missing_cols, None
+
+    df = pd.read_csv(io.BytesIO(content), sep=';', skiprows=3, decimal=',', encoding='unicode_escape')
+
+    if file_type == 'S':
+        df = Format_DF_SLogs(df)
+    elif file_type == 'A':
+        df = Format_DF_ALogs(df)
+    elif file_type == 'E':
+        df = Format_DF_ELogs(df)
+
+    # Save formatted file for next imports
+    if key is not None:
+        log_cache.save(key, mch_info, df)
+
+    return mch_info, missing_cols, df
+
+@profiling.timed # stage of the profiling timeline
+def check_files (files, mch_info_check=None):
     logger.debug("check_files started ---")
 
     #Standard file name pattern
@@ -75,96 +189,240 @@ def check_files (files):
     $: End of the string
     """
 
-    #Retrieve sample Machine information
-    mch_info_check = read_mch_info(files[0])
-    logger.debug(f"{mch_info_check=}")
-
     for file in (files):
         #Check file name
         file_name = file.split('/')[-1] #get file name from path
         if re.match(pattern, file_name) is None: #re library
             logger.error('--- File name does not correspond to FCM structure')
             logger.error(file)
-            return 0, file
-
-        with open(file, 'r') as csv_file:
-            csv_reader = reader(csv_file, delimiter=';')
-            mch_info = []
-            for i, row in enumerate(csv_reader):
-                if i < 3:
-                    #Save first three rows
-                    mch_info.append(row[0])
-                elif i == 3:
-                    # Compare it with sample machine info
-                    if mch_info != mch_info_check:
-                        logger.error('--- File does not correspond to the same machine')
-                        logger.error(file)
-                        return 0, file
-
-                    #Standard columns
-                    if file_name[0] == 'S':
-                        check_cols = DATA['std_cols']
-                        
-                    elif file_name[0] == 'A':
-                        check_cols = DATA['alm_cols']
-
-                    elif file_name[0] == 'E':
-                        check_cols = DATA['eve_cols']
-
-                    # Iterate row4 and check cols are from fcm logs
-                    for col in check_cols:
-                        if not (col in row):
-                            logger.debug(row)
-                            logger.error("Column not found in std_cols: " + col)
-                            logger.debug(check_cols)
-                            logger.error(file)
-                            logger.error('--- File does not match with FCM One/1.5 log file structure')
-                            return 0, file
+            return 0, file, None
+
+    # Formatted files of previous imports are loaded from the cache, the rest are parsed
+    results = [None] * len(files)
+    parse_idx = []
+    keys = []
+    for i, file in enumerate(files):
+        key = log_cache.cache_key(file, MT)
+        cached = log_cache.load(key)
+        if cached is not None:
+            results[i] = (cached[0], [], cached[1])
+            progress_step(file)
+        else:
+            parse_idx.append(i)
+            keys.append(key)
+    logger.debug("%s files loaded from cache, %s files to parse", len(files) - len(parse_idx), len(parse_idx))
+    n_parsed = len(parse_idx)
+
+    # Machine info the files must have: of the logs already imported, of a cached file or of the first file parsed
+    if mch_info_check is None and len(parse_idx) < len(files):
+        mch_info_check = next(result[0] for result in results if result is not None)
+    if mch_info_check is None and parse_idx:
+        results[parse_idx[0]] = read_files([files[parse_idx[0]]], keys[:1])[0]
+        mch_info_check = results[parse_idx[0]][0]
+        parse_idx, keys = parse_idx[1:], keys[1:]
+
+    # Read, check and parse new files in one pass, files of another machine are only read up to the machine info
+    parsed = read_files([files[i] for i in parse_idx], keys, mch_info_check)
+    for i, result in zip(parse_idx, parsed):
+        results[i] = result
+
+    if n_parsed:
+        log_cache.evict()
+
+    logger.debug("mch_info_check=%r", mch_info_check)
+
+    ListDataframe = []
+    for file, (mch_info, missing_cols, df) in zip(files, results):
+        # Compare it with sample machine info
+        if mch_info != mch_info_check:
+            logger.error('--- File does not correspond to the same machine')
+            logger.error(file)
+            return 0, file, None
+
+        if missing_cols:
+            logger.error("Columns not found in log file: %s", missing_cols)
+            logger.error(file)
+            logger.error('--- File does not match with FCM One/1.5 log file structure')
+            return 0, file, None
+
+        ListDataframe.append(df)
 
     logger.debug('--- All files correspond to the same machine and FCM One/1.5 log file structure')
-    return 1, mch_info_check
+    return 1, mch_info_check, ListDataframe
+
+def get_pool(workers):
+    # Return the process pool, create it again if the number of workers changed
+    global POOL, POOL_WORKERS
+    if POOL is not None and POOL_WORKERS != workers:
+        POOL.shutdown(wait=False)
+        POOL = None
+    if POOL is None:
+        logger.debug("Process pool started with workers=%r", workers)
+        # Records of the worker processes are written by the log listener of the App
+        POOL = ProcessPoolExecutor(max_workers=workers, initializer=logging_cfg.worker_init, initargs=(logging_cfg.LOG_QUEUE,))
+        POOL_WORKERS = workers
+    return POOL
+
+def shutdown_pool():
+    # Stop the worker processes, called when the App is closed
+    global POOL, POOL_WORKERS
+    if POOL is not None:
+        POOL.shutdown(wait=False, cancel_futures=True)
+        POOL = None
+        POOL_WORKERS = None
+
+@profiling.timed # stage of the profiling timeline
+def read_files(AllFilesNames, keys, mch_info_check=None, workers=None):
+    # Read all files with read_log_file in a process pool, keeping the order of AllFilesNames
+    # workers=1 or few files: serial import in the main process
+    if not AllFilesNames:
+        return []
+
+    if workers is None:
+        workers = WORKERS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(AllFilesNames))
+
+    # File type from file name: S, A or E
+    file_types = [Filename.split('/')[-1][0] for Filename in AllFilesNames]
+    n = len(AllFilesNames)
+
+    if workers > 1 and n >= MIN_FILES_PARALLEL:
+        try:
+            chunksize = max(1, n // (workers * 4))
+            results = []
+            # Stages of the worker processes (Format_DF_*) are returned with the result and added to read_files
+            for Filename, (result, stages) in zip(AllFilesNames, get_pool(workers).map(profiling.run_in_worker, [read_log_file] * n, AllFilesNames, file_types,
+                                                                                         [DATA] * n, [MT] * n, keys, [mch_info_check] * n, chunksize=chunksize)):
+                results.append(result)
+                profiling.add_worker_stages(stages)
+                progress_step(Filename)
+            return results
+
+        except ImportCancelled:
+            # Files already sent to the workers are not waited for
+            shutdown_pool()
+            raise
 
-# Import data
-def concat_files(AllFilesNames):
+        except Exception as e:
+            # Pool could not be started or a worker died -> serial import
+            logger.error("--- Parallel import failed, files are imported one by one")
+            logger.error(e, exc_info=True)
+            shutdown_pool()
+
+    results = []
+    for Filename, file_type, key in zip(AllFilesNames, file_types, keys):
+        results.append(read_log_file(Filename, file_type, DATA, MT, key, mch_info_check))
+        progress_step(Filename)
+    return results
+
+def progress_start(files):
+    # Reset the progress for a new import of files
+    PROGRESS.update(files=0, total_files=len(files), bytes=0,
+                    total_bytes=sum(os.path.getsize(file) for file in files), start=time.perf_counter())
+
+def progress_step(Filename):
+    # One more file read: send files, bytes and estimated time left to the GUI
+    # and stop the import if it was cancelled
+    PROGRESS['files'] += 1
+    PROGRESS['bytes'] += os.path.getsize(Filename)
+
+    if PROGRESS_QUEUE is not None:
+        elapsed = time.perf_counter() - PROGRESS['start']
+        left = PROGRESS['total_bytes'] - PROGRESS['bytes']
+        eta = elapsed * left / PROGRESS['bytes'] if PROGRESS['bytes'] else None
+        PROGRESS_QUEUE.put(('progress', dict(PROGRESS, eta=eta)))
+
+    if CANCEL.is_set():
+        raise ImportCancelled()
+
+@profiling.timed # stage of the profiling timeline
+def concat_files(ListDataframe, keep=None):
     logger.debug("concat_files started ---")
-   # Create an empty list to store the dataframes
-    ListDataframe = list()
 
-    # For each file in the specified directory import the data and add it in the list
-    for Filename in AllFilesNames:
-        ListDataframe.append(pd.read_csv(Filename, sep=';', skiprows=3, decimal=',', encoding='unicode_escape'))
+    if keep is None:
+        keep = DUPLICATES_KEEP
+
+    # Files in chronological order, rows of each file sorted by DateTime
+    frames = [df if df['DateTime'].is_monotonic_increasing else df.sort_values(by='DateTime', kind='stable')
+              for df in ListDataframe if not df.empty]
+    frames.sort(key=lambda df: df['DateTime'].iat[0])
+    if not frames:
+        frames = ListDataframe
 
     # Concatenate the files in the list in unique dataframe
-    DF_Data = pd.concat(ListDataframe, axis=0, ignore_index=True)
+    DF_Data = categorize(pd.concat(frames, axis=0, ignore_index=True))
 
-    # DateTime
-    DF_Data['DateTime'] = pd.to_datetime(DF_Data['DateTime'], format="%Y-%m-%d %H:%M:%S")
-    # ordering ascending
-    DF_Data = DF_Data.sort_values(by='DateTime', ascending=True).reset_index(drop=True)
+    windows = overlap_windows(frames)
+    if windows:
+        # ordering ascending, only needed if files overlap
+        DF_Data = DF_Data.sort_values(by='DateTime', ascending=True, kind='stable').reset_index(drop=True)
 
-    #Remove duplicates
-    DF_Data.drop_duplicates(keep=False, inplace=True)
-    
-    logger.debug("--- raw data imported:")
-    logger.debug(DF_Data.shape)
-    logger.debug(DF_Data.columns.tolist())
+        #Remove duplicates of the overlapping time spans
+        DF_Data = drop_overlap_duplicates(DF_Data, windows, keep)
+
+    # Columns and dtypes are only formatted if the level is DEBUG
+    logger.debug("--- raw data imported: %s rows, columns and dtypes:\n%s", len(DF_Data), DF_Data.dtypes)
 
     return(DF_Data)
 
+def overlap_windows(frames):
+    # Time spans shared by consecutive files (e.g. rows logged again after a restart of the FCM)
+    # frames ordered by first DateTime, returns [(date1, date2), ...] without overlaps between them
+    windows = []
+    last = None
+    for df in frames:
+        if df.empty:
+            continue
+        first_date, last_date = df['DateTime'].iat[0], df['DateTime'].iat[-1]
+
+        if last is not None and first_date <= last:
+            end = min(last_date, last)
+            if windows and first_date <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+            else:
+                windows.append((first_date, end))
+
+        last = last_date if last is None else max(last, last_date)
+
+    return windows
+
+def drop_overlap_duplicates(df, windows, keep):
+    # Remove repeated rows inside the overlapping windows of a sorted DataFrame
+    # keep: 'first' / 'last' row of the duplicates (file order), 'none' to remove all of them
+    keep = False if keep == 'none' else keep
+
+    drop = []
+    for date1, date2 in windows:
+        window = time_slice(df, date1, date2)
+        duplicated = window.duplicated(keep=keep).to_numpy()
+        drop.append(window.index.to_numpy()[duplicated])
+
+    drop = np.concatenate(drop)
+    logger.debug("%s overlapping time spans, %s duplicated rows removed", len(windows), len(drop))
+
+    if len(drop) == 0:
+        return df
+    return df.drop(index=drop).reset_index(drop=True)
+
 @custom_callback # wrapper to catch errors
+@cancellable # return code 3 if cancelled
+@profiling.timed # stage of the profiling timeline
 def import_data(dirname, file_list, mch_type):
     logger.debug("--- import_data started ---")
     
     # Save machine type
     global MT
     MT = mch_type
-    logger.debug(f"{mch_type=}")
+    logger.debug("mch_type=%r", mch_type)
 
     # Load data from txt files
     load_data(MT)
 
     #Init variables
     mch_info = None
+    MEMORY_REPORT.clear()
     LogsStandard = pd.DataFrame()
     COs = []
     LogsAlarms = pd.DataFrame()
@@ -184,198 +442,698 @@ def import_data(dirname, file_list, mch_type):
         logger.debug("no .csv files starting with S*, A* or E* --> Stop")
         return 2, None, None, None, None, None 
 
+    progress_start(DataFiles + AlarmFiles + EventFiles)
+
+    # Big folders: Standard Logs are imported in chunks to disk, the rest in memory
+    stream = sum(os.path.getsize(file) for file in DataFiles) >= STREAM_MIN_BYTES
+
     #Check if all files are from the same machine and corrispond to csv log file structure / flag_files=1 if all good
-    files = DataFiles + AlarmFiles + EventFiles
-    flag_files, mch_info = check_files(files)
+    #Files are parsed in the same pass, one DataFrame per file
+    files = (AlarmFiles + EventFiles) if stream else (DataFiles + AlarmFiles + EventFiles)
+    flag_files, mch_info, ListDataframe = check_files(files) if files else (1, None, [])
 
     # Import data and creat DataFrames
     if flag_files == 1:
+        nS = 0 if stream else len(DataFiles)
+        nA = len(AlarmFiles)
 
         # LOGS STANDARD
-        if DataFiles:
+        if DataFiles and stream:
+            logger.debug("Importing Standard Logs in chunks ---")
+
+            LogsStandard = log_store.LogStore()
+            try:
+                flag_files, info = stream_files(DataFiles, LogsStandard, mch_info)
+            except ImportCancelled:
+                LogsStandard.close()
+                raise
+            if flag_files != 1:
+                LogsStandard.close()
+                logger.debug("--- import_data aborted")
+                return 0, info, None, None, None, None
+            mch_info = info
+
+            COs = IdentifyCOs(store_edges(LogsStandard))
+            logger.info("LogsStandard stored on disk: %.1f MB in %s chunks", LogsStandard.nbytes/1e6, len(LogsStandard.chunks))
+
+        elif DataFiles:
             logger.debug("Importing Standard Logs ---")
 
-            LogsStandard = Format_DF_SLogs(DataFiles)
-            COs = IdentifyCOs(LogsStandard)
+            LogsStandard = concat_files(ListDataframe[:nS])
+
+            # Identify when Change Over Started and Finished
+            # ChangeOverInProgress = 0 : no change
+            # ChangeOverInProgress = 1 : started
+            # ChangeOverInProgress = -1 : finished
+
+            # Create column with value change
+            LogsStandard['ChangeoverCMDchange'] = LogsStandard[changeover_col()].diff()
+            COs = index_COs(IdentifyCOs(LogsStandard), LogsStandard)
+            memory_report(LogsStandard, 'LogsStandard')
+
+            # Aggregation levels for long custom plots
+            get_pyramid(LogsStandard)
 
         # ALARMS
         if AlarmFiles:
             logger.debug("Importing Alarm Logs ---")
-            LogsAlarms = Format_DF_ALogs(AlarmFiles)
+            LogsAlarms = concat_files(ListDataframe[nS:nS+nA])
+            memory_report(LogsAlarms, 'LogsAlarms')
 
         # EVENTS
         if EventFiles:
             logger.debug("Importing Event Logs ---")
-            LogsEvents = Format_DF_ELogs(EventFiles)
+            LogsEvents = concat_files(ListDataframe[nS+nA:])
+            memory_report(LogsEvents, 'LogsEvents')
 
         logger.debug("--- import_data success")
+        profiling.add_rows(len(LogsStandard) + len(LogsAlarms) + len(LogsEvents))
         return 1, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents
     
     else:
         logger.debug("--- import_data aborted")
         return 0, mch_info, None, None, None, None  
 
-# Formatting of DataFrames
-def Format_DF_SLogs(list_files):
+def merge_files(Logs, ListDataframe):
+    # Merge DataFrames of new files into an imported (sorted) DataFrame
+    logger.debug("merge_files started ---")
 
-    LogsStandard = concat_files(list_files)
-    
-    logger.debug("Formatting Standard Logs ---")
+    New = concat_files(ListDataframe)
+    if Logs.empty:
+        return New
+    if New.empty:
+        return Logs
 
-    # Format LogsStandard
-    LogsStandard = LogsStandard[DATA['std_cols']]
+    if New['DateTime'].iloc[0] > Logs['DateTime'].iloc[-1]:
+        # New files after the imported ones (usual case): only append
+        # (new labels turn the category columns into object columns, categorize as concat_files)
+        Merged = categorize(pd.concat([Logs, New], axis=0, ignore_index=True))
+    else:
+        # New files overlap the imported ones: sort and remove duplicates again
+        Merged = concat_files([Logs, New])
 
-    if MT == "FCM One | 1.5":
-        # Columns as float
-        LogsStandard.iloc[:,13:] = LogsStandard.iloc[:,13:].astype(float)
+    logger.debug("--- merge_files finished")
+    logger.debug(Merged.shape)
+    return Merged
 
-        # Create labels for CV positions
-        LogsStandard[['CV1_Label','CV2_Label','CV3_Label','CV4_Label','CV5_Label']] = LogsStandard[['CV1_Position','CV2_Position','CV3_Position','CV4_Position','CV5_Position']].astype(str)
+def update_COs(LogsStandard, COs, seam):
+    # Identify changeovers again only from the first new row (seam) on
+    # if a changeover was in progress at the seam, start from the row where it started
+    rows = LogsStandard['DateTime'].searchsorted(seam)
+    cmd = LogsStandard['ChangeoverCMDchange'].to_numpy()
 
-        LogsStandard[['CV1_Label']] = LogsStandard[['CV1_Label']].replace(DATA['cv1_labels']).fillna('Unknown')
+    start = rows
+    if rows > 0 and LogsStandard[changeover_col()].iat[rows-1] == 1:
+        starts = (cmd[:rows] == 1).nonzero()[0]
+        start = starts[-1] if len(starts) else 0
 
-        LogsStandard[['CV2_Label']] = LogsStandard[['CV2_Label']].replace(DATA['cv2_labels']).fillna('Unknown')
+    start_time = LogsStandard['DateTime'].iat[start] if start < len(LogsStandard) else seam
+    kept_COs = [CO for CO in COs if CO['Start'] < start_time]
+    new_COs = IdentifyCOs(LogsStandard.iloc[start:])
 
-        LogsStandard[['CV3_Label']] = LogsStandard[['CV3_Label']].replace(DATA['cv3_labels']).fillna('Unknown')
+    logger.debug("%s changeovers kept, %s changeovers identified in new logs", len(kept_COs), len(new_COs))
+    return kept_COs + new_COs
 
-        LogsStandard[['CV4_Label']] = LogsStandard[['CV4_Label']].replace(DATA['cv4_labels']).fillna('Unknown')
+@custom_callback # wrapper to catch errors
+@cancellable # return code 3 if cancelled
+@profiling.timed # stage of the profiling timeline
+def append_data(dirname, file_list, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents):
+    # Import only new files of a folder and merge them with the imported DataFrames
+    # machine type and DATA of the previous import are kept
+    logger.debug("--- append_data started ---")
 
-        LogsStandard[['CV5_Label']] = LogsStandard[['CV5_Label']].replace(DATA['cv5_labels']).fillna('Unknown')
+    DataFiles = [dirname + '/' + x for x in file_list if x.startswith('S')]
+    AlarmFiles = [dirname + '/' + x for x in file_list if x.startswith('A')]
+    EventFiles = [dirname + '/' + x for x in file_list if x.startswith('E')]
+
+    if len(DataFiles + AlarmFiles + EventFiles) == 0:
+        logger.debug("no new .csv files starting with S*, A* or E* --> Stop")
+        return 2, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents
+
+    progress_start(DataFiles + AlarmFiles + EventFiles)
+
+    # Standard Logs imported in chunks: new files are added to the store
+    stream = isinstance(LogsStandard, log_store.LogStore)
+
+    files = DataFiles + AlarmFiles + EventFiles
+    checked = (AlarmFiles + EventFiles) if stream else files
+    flag_files, new_mch_info, ListDataframe = check_files(checked, mch_info) if checked else (1, mch_info, [])
 
-        LogsStandard['CC_Label'] = LogsStandard['CurrentControl'].astype(str)
-        LogsStandard['CC_Label'] = LogsStandard['CC_Label'].replace(DATA['current_ctrl_label']).fillna('Unknown')
+    if flag_files != 1:
+        logger.debug("--- append_data aborted")
+        return 0, new_mch_info, COs, LogsStandard, LogsAlarms, LogsEvents
 
-        # Identify when Change Over Started and Finished
-        # ChangeOverInProgress = O : no change
-        # ChangeOverInProgress = 1 : started
-        # ChangeOverInProgress = -1 : finished
+    # New files must be from the machine already imported
+    if mch_info is not None and new_mch_info != mch_info:
+        logger.error('--- New files do not correspond to the same machine')
+        logger.error("new_mch_info=%r", new_mch_info)
+        return 0, files[0], COs, LogsStandard, LogsAlarms, LogsEvents
+
+    nS = 0 if stream else len(DataFiles)
+    nA = len(AlarmFiles)
+
+    # LOGS STANDARD
+    if DataFiles and stream:
+        logger.debug("Appending Standard Logs in chunks ---")
+        flag_files, info = stream_files(DataFiles, LogsStandard, mch_info)
+        if flag_files != 1:
+            logger.debug("--- append_data aborted")
+            return 0, info, COs, LogsStandard, LogsAlarms, LogsEvents
+
+        COs = IdentifyCOs(store_edges(LogsStandard))
+
+    elif DataFiles:
+        logger.debug("Appending Standard Logs ---")
+        seam = min(df['DateTime'].min() for df in ListDataframe[:nS])
+
+        if not LogsStandard.empty:
+            LogsStandard = LogsStandard.drop(columns='ChangeoverCMDchange')
+        LogsStandard = merge_files(LogsStandard, ListDataframe[:nS])
 
         # Create column with value change
-        LogsStandard['ChangeoverCMDchange'] = LogsStandard['ChangeOverInProgress'].diff()
+        LogsStandard['ChangeoverCMDchange'] = LogsStandard[changeover_col()].diff()
+        COs = update_COs(LogsStandard, COs if COs else [], seam)
+        # Rows of the changeovers windows change if new rows were inserted
+        COs = index_COs(COs, LogsStandard)
+        get_pyramid(LogsStandard)
+
+    # ALARMS
+    if AlarmFiles:
+        logger.debug("Appending Alarm Logs ---")
+        LogsAlarms = merge_files(LogsAlarms, ListDataframe[nS:nS+nA])
+
+    # EVENTS
+    if EventFiles:
+        logger.debug("Appending Event Logs ---")
+        LogsEvents = merge_files(LogsEvents, ListDataframe[nS+nA:])
+
+    logger.debug("--- append_data success")
+    return 1, new_mch_info, COs, LogsStandard, LogsAlarms, LogsEvents
+
+# Chunked import of Standard Logs
+def file_datetime(file):
+    # Start time of a log file from its name: S_2024_1_31__13_5_9.csv
+    numbers = [int(n) for n in re.findall(r'\d+', os.path.basename(file))]
+    return datetime.datetime(*numbers[:6])
+
+@profiling.timed # stage of the profiling timeline
+def stream_files(files, store, mch_info=None):
+    # Import standard log files in DateTime order, in batches of STREAM_BATCH_BYTES, each batch is saved in the store
+    # Only one batch (and the rows kept for the next one) is in memory
+    # returns (1, mch_info) or (0, file with errors)
+    logger.debug("stream_files started ---")
+
+    batches = [[]]
+    size = 0
+    for file in sorted(files, key=file_datetime):
+        if size >= STREAM_BATCH_BYTES:
+            batches.append([])
+            size = 0
+        batches[-1].append(file)
+        size += os.path.getsize(file)
+    logger.debug("%s files in %s batches", len(files), len(batches))
+
+    col = changeover_col()
+    stored_last = store.last
+    previous = store.tail([col])[col].iat[0] if not store.empty else None
+    pending = None
+
+    # State of the store before the import, restored if files have errors or the import is cancelled
+    stored_chunks = len(store.chunks)
+    stored_edges = store.edges
+
+    for i, batch in enumerate(batches):
+        try:
+            flag_files, batch_info, ListDataframe = check_files(batch, mch_info)
+        except ImportCancelled:
+            store.truncate(stored_chunks)
+            store.edges = stored_edges
+            raise
+
+        if flag_files != 1:
+            store.truncate(stored_chunks)
+            store.edges = stored_edges
+            return 0, batch_info
+
+        if mch_info is None:
+            mch_info = batch_info
+        elif batch_info != mch_info:
+            logger.error('--- File does not correspond to the same machine')
+            logger.error(batch[0])
+            store.truncate(stored_chunks)
+            store.edges = stored_edges
+            return 0, batch[0]
+
+        df = concat_files(([pending] if pending is not None else []) + ListDataframe)
+        del ListDataframe
+
+        if stored_last is not None and not df.empty and df['DateTime'].iat[0] <= stored_last:
+            # Files overlapping rows already saved: remove those rows
+            df = drop_stored_rows(store, df, stored_last)
+
+        # Rows after the start of the next batch can be logged again in its files, they are kept for the next batch
+        if i + 1 < len(batches):
+            split = df['DateTime'].searchsorted(file_datetime(batches[i+1][0]))
+            df, pending = df.iloc[:split], df.iloc[split:]
+        else:
+            pending = None
+
+        previous = write_chunk(store, df, previous)
+
+    logger.debug("--- stream_files finished")
+    profiling.add_rows(len(store))
+    return 1, mch_info
+
+def drop_stored_rows(store, df, stored_last):
+    # Remove rows of df up to stored_last that are already in the store
+    split = df['DateTime'].searchsorted(stored_last, side='right')
+    overlap = df.iloc[:split]
+    stored = store.read(overlap['DateTime'].iat[0], stored_last).drop(columns='ChangeoverCMDchange')
+
+    # Compare as strings, categories of both DataFrames can be different
+    keys = lambda x: pd.util.hash_pandas_object(x.astype(str), index=False)
+    new_rows = ~keys(overlap).isin(keys(stored)).to_numpy()
+    logger.debug("%s rows already saved in the store", (~new_rows).sum())
+
+    return pd.concat([overlap[new_rows], df.iloc[split:]], axis=0, ignore_index=True)
+
+def write_chunk(store, df, previous):
+    # Save a sorted chunk of Standard Logs with the change of the changeover column
+    # previous: last value of the changeover column in the store, to continue the diff
+    if df.empty:
+        return previous
+
+    values = df[changeover_col()]
+    change = values.diff()
+    if previous is not None:
+        change.iat[0] = values.iat[0] - previous
+    df = df.assign(ChangeoverCMDchange=change)
+
+    # Rows where the changeover status changed (and the first row), enough to identify the changeovers without reading the store
+    edges = df.loc[change.to_numpy() != 0, ['DateTime', changeover_col(), 'ChangeoverCMDchange']]
+    store.edges = pd.concat([store.edges, edges], axis=0, ignore_index=True) if not store.edges.empty else edges.reset_index(drop=True)
+
+    # Aggregation levels of the chunk, only the coarse levels are kept in memory
+    for level, level_df in build_pyramid(df).items():
+        if level in STORE_PYRAMID_LEVELS:
+            store.pyramid_parts.setdefault(level, []).append(level_df)
+
+    store.write(df)
+    return values.iat[-1]
+
+def store_edges(store):
+    # Changeover edges of the store in DateTime order, rows saved twice by appended files only once
+    return store.edges.drop_duplicates().sort_values(by='DateTime', kind='stable').reset_index(drop=True)
+
+def first_last(logs):
+    # First and last DateTime of a DataFrame or a LogStore
+    if isinstance(logs, log_store.LogStore):
+        return logs.first, logs.last
+    return logs['DateTime'].min(), logs['DateTime'].max()
+
+def overview(logs):
+    # Whole DataFrame, or reduced DataFrame of a LogStore
+    if isinstance(logs, log_store.LogStore):
+        return logs.overview()
+    return logs
+
+def release(logs):
+    # Delete the files of a LogStore
+    if isinstance(logs, log_store.LogStore):
+        logs.close()
+
+# Formatting of DataFrames, applied to each file before concat_files
+def changeover_col():
+    # Column with the changeover status according to machine type
+    if MT == "FCM Oil 2b":
+        return 'ChangeoverInProgress'
+    return 'ChangeOverInProgress'
+
+@profiling.timed # stage of the profiling timeline
+def Format_DF_SLogs(LogsStandard):
+
+    # Format LogsStandard
+    LogsStandard = LogsStandard[DATA['std_cols']].copy()
+
+    # DateTime
+    LogsStandard['DateTime'] = pd.to_datetime(LogsStandard['DateTime'], format="%Y-%m-%d %H:%M:%S")
+
+    if MT == "FCM One | 1.5":
+        # Columns as float
+        LogsStandard.iloc[:,13:] = LogsStandard.iloc[:,13:].astype(float)
+
+        # Create labels for CV positions
+        for i in range(1, 6):
+            LogsStandard[f'CV{i}_Label'] = map_labels(LogsStandard[f'CV{i}_Position'], f'cv{i}_labels')
+
+        LogsStandard['CC_Label'] = map_labels(LogsStandard['CurrentControl'], 'current_ctrl_label')
 
     elif MT == "FCM Oil 2b":
         # Columns as float
         LogsStandard.iloc[:,8:] = LogsStandard.iloc[:,8:].astype(float)
 
         # Create labels for CV positions
-        LogsStandard[['CV1_Label','CV2_Label','CV3_Label','CV4_Label']] = LogsStandard[['CV1_Position','CV2_Position','CV3_Position','CV4_Position']].astype(str)
+        for i in range(1, 5):
+            LogsStandard[f'CV{i}_Label'] = map_labels(LogsStandard[f'CV{i}_Position'], f'cv{i}_labels')
 
-        LogsStandard[['CV1_Label']] = LogsStandard[['CV1_Label']].replace(DATA['cv1_labels']).fillna('Unknown')
+        LogsStandard['STS_Label'] = map_labels(LogsStandard['MachineStatus'], 'machine_sts_label')
 
-        LogsStandard[['CV2_Label']] = LogsStandard[['CV2_Label']].replace(DATA['cv2_labels']).fillna('Unknown')
+        LogsStandard['CC_Label'] = map_labels(LogsStandard['ControlType'], 'current_ctrl_label')
 
-        LogsStandard[['CV3_Label']] = LogsStandard[['CV3_Label']].replace(DATA['cv3_labels']).fillna('Unknown')
+    return(compact_dtypes(LogsStandard))
 
-        LogsStandard[['CV4_Label']] = LogsStandard[['CV4_Label']].replace(DATA['cv4_labels']).fillna('Unknown')
+def Format_DF_ALogs(LogsAlarms):
 
-        LogsStandard['STS_Label'] = LogsStandard['MachineStatus'].astype(str)
-        LogsStandard['STS_Label'] = LogsStandard['STS_Label'].replace(DATA['machine_sts_label']).fillna('Unknown')
+    LogsAlarms = LogsAlarms[['DateTime', 'AlarmNumber']].copy()
 
-        LogsStandard['CC_Label'] = LogsStandard['ControlType'].astype(str)
-        LogsStandard['CC_Label'] = LogsStandard['CC_Label'].replace(DATA['current_ctrl_label']).fillna('Unknown')
+    # DateTime
+    LogsAlarms['DateTime'] = pd.to_datetime(LogsAlarms['DateTime'], format="%Y-%m-%d %H:%M:%S")
 
-        # Identify when Change Over Started and Finished
-        # ChangeOverInProgress = 0 : no change
-        # ChangeOverInProgress = 1 : started
-        # ChangeOverInProgress = -1 : finished
+    # Create Labels of the Alarms
+    LogsAlarms['Label'] = map_labels(LogsAlarms['AlarmNumber'], 'alarm_labels')
 
-        # Create column with value change
-        LogsStandard['ChangeoverCMDchange'] = LogsStandard['ChangeoverInProgress'].diff()
+    LogsAlarms['Alm_Code_Label'] = code_labels("A", LogsAlarms['AlarmNumber'], LogsAlarms['Label'])
 
-    logger.debug("--- Standard Logs formatted")
-    logger.debug(LogsStandard.shape)
-    logger.debug(LogsStandard.columns.tolist())
-    logger.debug(LogsStandard.dtypes)
+    return(compact_dtypes(LogsAlarms))
 
-    return(LogsStandard)
+def Format_DF_ELogs(LogsEvents):
 
-def Format_DF_ALogs(list_files):
+    LogsEvents = LogsEvents[['DateTime', 'GpsPos', 'EventNumber', 'Data']].copy()
 
-    LogsAlarms = concat_files(list_files)
-    logger.debug("Formatting Alarm Logs ---")
+    # DateTime
+    LogsEvents['DateTime'] = pd.to_datetime(LogsEvents['DateTime'], format="%Y-%m-%d %H:%M:%S")
 
-    LogsAlarms = LogsAlarms[['DateTime', 'AlarmNumber']]
+    #Create Labels of the Events
+    LogsEvents['Label'] = map_labels(LogsEvents['EventNumber'], 'event_labels')
 
-    # Create Labels of the Alarms
-    LogsAlarms['Label'] = LogsAlarms['AlarmNumber'].astype(str)
-    LogsAlarms[['Label']] = LogsAlarms[['Label']] .replace(DATA['alarm_labels']).fillna('Unknown')
+    # For events with relevant "Data", add it to label (e.g. parameter value)
+    data_events = LogsEvents['EventNumber'].isin([6, 7, 8])
+    if data_events.any():
+        LogsEvents['Label'] = LogsEvents['Label'].astype(object)
+        LogsEvents.loc[data_events, 'Label'] = LogsEvents.loc[data_events, 'Label'] + ": " + LogsEvents.loc[data_events, 'Data'].astype(str)
 
-    LogsAlarms['Alm_Code_Label'] = "A" + LogsAlarms['AlarmNumber'].astype(str) + "_" + LogsAlarms['Label'] 
-    
-    logger.debug("--- Alarm Logs formatted")
-    logger.debug(LogsAlarms.shape)
-    logger.debug(LogsAlarms.columns.tolist())
-    logger.debug(LogsAlarms.dtypes)
+    LogsEvents['Evn_Code_Label'] = code_labels("E", LogsEvents['EventNumber'], LogsEvents['Label'])
 
-    return(LogsAlarms)
+    return(compact_dtypes(LogsEvents))
 
-def Format_DF_ELogs(list_files):
-    LogsEvents = concat_files(list_files)
-    logger.debug("Formatting Event Logs ---")
+# Labels of codes
+def label_lookup(name):
+    # Compile DATA[name] ({"code": "label"}) in an array: table[code - offset] = position of the label in categories
+    key = (MT, name)
+    if key not in LOOKUPS:
+        labels = {int(code): label for code, label in DATA[name].items()}
 
-    LogsEvents = LogsEvents[['DateTime', 'GpsPos', 'EventNumber', 'Data']]
-    LogsEvents['Label'] = LogsEvents['EventNumber'].astype(str) 
+        categories = list(dict.fromkeys(labels.values()))
+        if 'Unknown' not in categories:
+            categories.append('Unknown')
+        position = {label: i for i, label in enumerate(categories)}
+        unknown = position['Unknown']
 
-    #Create Labels of the Events
-    LogsEvents[['Label']] = LogsEvents[['Label']].replace(DATA['event_labels']).fillna('Unknown')
+        offset = min(min(labels, default=0), 0)
+        table = np.full(max(labels, default=0) - offset + 1, unknown, dtype=np.int32)
+        for code, label in labels.items():
+            table[code - offset] = position[label]
 
-    # For events with relevant "Data", add it to label (e.g. parameter value)
-    LogsEvents.loc[(LogsEvents['EventNumber'] == 6) |
-                (LogsEvents['EventNumber'] == 7) | 
-                (LogsEvents['EventNumber'] == 8), 'Label'] = LogsEvents['Label'].astype(str) + ": " + LogsEvents['Data'].astype(str)
-    
-    LogsEvents['Evn_Code_Label'] = "E" + LogsEvents['EventNumber'].astype(str) + "_" + LogsEvents['Label'] 
+        LOOKUPS[key] = (table, offset, categories, unknown)
+
+    return LOOKUPS[key]
+
+def map_labels(codes, name):
+    # Categorical labels of a column of codes, codes not in DATA[name] (or NaN) are 'Unknown'
+    table, offset, categories, unknown = label_lookup(name)
 
-    logger.debug("--- Event Logs formatted")
-    logger.debug(LogsEvents.shape)
-    logger.debug(LogsEvents.columns.tolist())
-    logger.debug(LogsEvents.dtypes)
+    values = pd.to_numeric(codes, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan) - offset
+    valid = np.isfinite(values) & (values >= 0) & (values < len(table)) & (values == np.floor(values))
 
-    return(LogsEvents)
+    label_codes = np.full(len(values), unknown, dtype=np.int32)
+    label_codes[valid] = table[values[valid].astype(np.int64)]
 
+    return pd.Categorical.from_codes(label_codes, categories=categories)
+
+def code_labels(prefix, codes, labels):
+    # prefix + code + "_" + label, the string is built once for each distinct pair
+    pair_codes, pairs = pd.MultiIndex.from_arrays([codes, labels]).factorize()
+    categories = [f"{prefix}{code}_{label}" for code, label in pairs]
+    return pd.Categorical.from_codes(pair_codes, categories=categories)
+
+# dtype schema of DataFrames
+def compact_dtypes(df):
+    # Downcast columns according to their unit in DATA['units']:
+    # bool, int, valve_pos -> smallest integer (int8 usually), analog values -> float32, labels -> category
+    units = DATA['units']
+
+    dtypes = {}
+    for col in df.columns:
+        unit = units.get(col)
+
+        if col in LABEL_COLS:
+            dtypes[col] = 'category'
+
+        elif unit in INT_UNITS:
+            if df[col].isna().any(): # NaN can not be stored as integer
+                dtypes[col] = 'float32'
+            elif not (df[col] % 1 == 0).all(): # fractional or corrupt values are not truncated
+                logger.debug("Column %s (%s) has fractional values, kept as float32", col, unit)
+                dtypes[col] = 'float32'
+            else:
+                low, high = df[col].min(), df[col].max()
+                dtypes[col] = next((t for t in ('int8', 'int16', 'int32')
+                                    if np.iinfo(t).min <= low and high <= np.iinfo(t).max), 'int64')
+
+        elif (unit is not None) and (unit not in ('datetime', 'gps')):
+            # Also object columns, the float cast of Format_DF_SLogs keeps their dtype
+            dtypes[col] = 'float32'
+
+    # One astype for all columns
+    return df.astype(dtypes)
+
+def categorize(df):
+    # Concat of categories that are different in each file returns object columns, set category again
+    for col in df.columns:
+        if col in LABEL_COLS and df[col].dtype == object:
+            df[col] = df[col].astype('category')
+    return df
+
+def memory_report(df, name):
+    # Compare memory of df with the memory it would use with float64/int64 columns and python strings
+    after = df.memory_usage(index=True, deep=True).sum()
+
+    before = df.index.memory_usage()
+    for col in df.columns:
+        before += len(df) * 8 # 8 bytes per value, or per pointer to the python string
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            counts = df[col].value_counts(sort=False)
+            before += sum(count * sys.getsizeof(str(cat)) for cat, count in counts.items())
+
+    MEMORY_REPORT[name] = (before, after)
+    logger.info("%s memory: %.1f MB with default dtypes -> %.1f MB (%.1f MB saved)", name, before/1e6, after/1e6, (before-after)/1e6)
+
+def restore_floats(df):
+    # float32 -> float64 rounded to 7 significant digits, to export the values as they are in the csv files
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == np.float32:
+            values = df[col].to_numpy(dtype=np.float64)
+            magnitude = np.floor(np.log10(np.abs(values), where=(values != 0) & np.isfinite(values), out=np.zeros_like(values)))
+            scale = 10.0 ** (6 - magnitude)
+            df[col] = np.round(values * scale) / scale
+    return df
+
+# dtype of the changeovers found by detect_changeovers
+CO_DTYPE = np.dtype([('start', 'M8[ns]'), ('finish', 'M8[ns]'), ('duration', 'm8[ns]')])
+
+def detect_changeovers(dates, status, min_duration=datetime.timedelta(minutes = 1)):
+    # Changeovers from the sorted DateTime array and the changeover status array (0/1)
+    # Rising and falling edges of the status alternate, a finish before the first start (log starts during a
+    # changeover) and a start without finish (changeover in progress at the end) are discarded
+    # returns structured array with start, finish and duration of changeovers longer than min_duration
+    status = pd.Series(status).ffill().to_numpy() # missing values keep the previous status
+    in_progress = (status == 1).astype(np.int8)
+
+    change = np.diff(in_progress)
+    starts = np.flatnonzero(change == 1) + 1
+    finishes = np.flatnonzero(change == -1) + 1
+
+    if len(finishes) and (not len(starts) or finishes[0] < starts[0]):
+        finishes = finishes[1:]
+    starts = starts[:len(finishes)]
+
+    dates = np.asarray(dates, dtype='M8[ns]')
+    COs = np.empty(len(starts), dtype=CO_DTYPE)
+    COs['start'] = dates[starts]
+    COs['finish'] = dates[finishes]
+    COs['duration'] = COs['finish'] - COs['start']
+
+    return COs[COs['duration'] > np.timedelta64(min_duration)]
+
+@profiling.timed # stage of the profiling timeline
 def IdentifyCOs(logs):
     logger.debug("IdentifyCOs started ---")
 
-    # memorize starting DateTimes
-    COstart = logs[logs['ChangeoverCMDchange'] == 1]['DateTime'].tolist()
+    COs = [{'Start': pd.Timestamp(CO['start']), 'Finish': pd.Timestamp(CO['finish']), 'Duration': pd.Timedelta(CO['duration'])}
+           for CO in detect_changeovers(logs['DateTime'].to_numpy(), logs[changeover_col()].to_numpy())]
 
-    # memorize finishing DateTimes
-    COfinish = logs[(logs['ChangeoverCMDchange'] == -1)]['DateTime'].tolist()
+    logger.debug('In the logs imported there are %s changeovers', len(COs))
+    for CO in COs:
+        logger.debug('- From %s to %s. Duration: %s', CO['Start'], CO['Finish'], CO['Duration']) 
 
-    COs = []
-    for i in range(len(COfinish)):
-        duration = COfinish[i]-COstart[i]
-        if duration > datetime.timedelta(minutes = 1):
-            COs.append({'Start': COstart[i], 'Finish': COfinish[i], 'Duration': duration})
+    return COs
 
-    logger.debug('In the logs imported there are ' + str(len(COs)) + ' changeovers')
-    for CO in COs:
-        logger.debug('- From ' + str(CO['Start']) + ' to ' + str(CO['Finish']) + '. Duration: ' + str(CO['Duration'])) 
+def time_slice(df, date1, date2, include_start=True):
+    # Rows with date1 <= DateTime <= date2 (date1 < DateTime <= date2 if not include_start)
+    # DataFrames are sorted by DateTime (concat_files), binary search instead of a mask of the whole DataFrame
+    if isinstance(df, log_store.LogStore):
+        return df.read(date1, date2, include_start)
+    if df.empty:
+        return df
+
+    dates = df['DateTime'].to_numpy()
+    start = dates.searchsorted(np.datetime64(pd.Timestamp(date1)), side='left' if include_start else 'right')
+    stop = dates.searchsorted(np.datetime64(pd.Timestamp(date2)), side='right')
+    return df.iloc[start:stop]
+
+def index_COs(COs, logs, padding=None):
+    # Save in each changeover the rows of its window in logs, padding included: logs.iloc[CO['Rows'][0]:CO['Rows'][1]]
+    # If the padding changes only the rows are searched again, changeovers are not identified again
+    if padding is None:
+        padding = CO_PADDING
+    if not COs or isinstance(logs, log_store.LogStore) or logs.empty:
+        return COs
+
+    dates = logs['DateTime'].to_numpy()
+    starts = np.array([CO['Start'] for CO in COs], dtype='M8[ns]') - np.timedelta64(padding)
+    finishes = np.array([CO['Finish'] for CO in COs], dtype='M8[ns]') + np.timedelta64(padding)
+    first_rows = dates.searchsorted(starts, side='left')
+    last_rows = dates.searchsorted(finishes, side='right')
+
+    for CO, first_row, last_row in zip(COs, first_rows, last_rows):
+        CO['Rows'] = (int(first_row), int(last_row))
+        CO['Padding'] = padding
 
     return COs
 
+def set_co_padding(minutes, COs, logs):
+    # Change the time shown around the changeovers
+    global CO_PADDING
+    CO_PADDING = datetime.timedelta(minutes = minutes)
+    return index_COs(COs, logs)
+
 @custom_callback # wrapper to catch errors
+@profiling.timed # stage of the profiling timeline
 def ChangeOverToDF(CO, logs):
     logger.debug("ChangeOverToDF started ---")
     logger.debug(CO)
 
-    delta = datetime.timedelta(minutes = 20)
-    df = logs[(logs['DateTime'] >= CO['Start']-delta) & (logs['DateTime'] <= CO['Finish']+delta)]
+    if 'Rows' in CO and CO['Padding'] == CO_PADDING and not isinstance(logs, log_store.LogStore):
+        # Rows of the window saved by index_COs
+        df = logs.iloc[CO['Rows'][0]:CO['Rows'][1]]
+    else:
+        df = time_slice(logs, CO['Start']-CO_PADDING, CO['Finish']+CO_PADDING)
 
     logger.debug(df.shape)
     return(df)
 
+def export_frames(dfs, sheetNames, date1, date2, cols):
+    # (sheet name, DataFrame) with the rows between date1 and date2 of each DataFrame, empty DataFrames are skipped
+    # float32 columns are not converted here: the writers call restore_floats for each chunk of EXPORT_CHUNK_ROWS rows
+    # cols: columns of the Standard Logs to export, Alarms and Events are exported without the code labels
+    cols = [col for col in cols if col not in ('AlarmNumber', 'EventNumber', 'DateTime')]
+
+    for df, sheetName in zip(dfs, sheetNames):
+        if df.empty:
+            logger.debug('df empty')
+            continue
+        logger.debug(sheetName)
+
+        df_export = time_slice(df, date1, date2)
+
+        if set(cols).issubset(df_export.columns.tolist()):
+            df_export = df_export[['DateTime'] + cols]
+        elif 'Evn_Code_Label' in df_export.columns.tolist():
+            df_export = df_export.drop(columns='Evn_Code_Label')
+        elif 'Alm_Code_Label' in df_export.columns.tolist():
+            df_export = df_export.drop(columns='Alm_Code_Label')
+
+        profiling.add_rows(len(df_export))
+        yield sheetName, df_export
+
+def export_chunks(df):
+    # Chunks of EXPORT_CHUNK_ROWS rows of df with the float values of the csv files (one chunk, without rows, if df has no rows)
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        yield restore_floats(df.iloc[start:start + EXPORT_CHUNK_ROWS])
+
+@profiling.timed # stage of the profiling timeline
+def write_excel(file_path, dfs, sheetNames, date1, date2, cols):
+    # Save the rows between date1 and date2 of each DataFrame in one sheet of an Excel file
+    # sheets are streamed to the file in chunks, DateTime as Excel dates (serial numbers with date format)
+    logger.debug('write_excel started ---')
+    xlsx_stream.write_xlsx(file_path, export_frames(dfs, sheetNames, date1, date2, cols), convert=restore_floats)
+    logger.debug('--- write_excel finished')
+
+@profiling.timed # stage of the profiling timeline
+def write_csv_gz(file_path, dfs, sheetNames, date1, date2, cols):
+    # One gzip compressed csv file per sheet: file_path + _<sheet name>.csv.gz
+    files = []
+    for sheetName, df_export in export_frames(dfs, sheetNames, date1, date2, cols):
+        sheet_path = file_path + "_" + sheetName + EXPORT_FORMATS['CSV.gz']
+        with gzip.open(sheet_path, 'wt', compresslevel=6, encoding='utf-8', newline='') as csv_file:
+            for n, chunk in enumerate(export_chunks(df_export)):
+                chunk.to_csv(csv_file, index=False, header=(n == 0), sep=';', date_format='%Y-%m-%d %H:%M:%S')
+        files.append(sheet_path)
+    return files
+
+@profiling.timed # stage of the profiling timeline
+def write_parquet(file_path, dfs, sheetNames, date1, date2, cols):
+    # One parquet file per sheet: file_path + _<sheet name>.parquet
+    files = []
+    for sheetName, df_export in export_frames(dfs, sheetNames, date1, date2, cols):
+        sheet_path = file_path + "_" + sheetName + EXPORT_FORMATS['Parquet']
+        # One row group per chunk, pyarrow is only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in export_chunks(df_export):
+                table = pa.Table.from_pandas(chunk, preserve_index=False, schema=writer.schema if writer else None)
+                if writer is None:
+                    writer = pq.ParquetWriter(sheet_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        files.append(sheet_path)
+    return files
+
+@profiling.timed # stage of the profiling timeline
+def export_data(file_path, dfs, sheetNames, date1, date2, cols, export_format='Excel'):
+    # Save the sheets in export_format (EXPORT_FORMATS), file_path without extension, returns the files saved
+    logger.debug("export_data started --- %s", export_format)
+    start = time.perf_counter()
+
+    if export_format == 'Excel':
+        write_excel(file_path + EXPORT_FORMATS['Excel'], dfs, sheetNames, date1, date2, cols)
+        files = [file_path + EXPORT_FORMATS['Excel']]
+    elif export_format == 'CSV.gz':
+        files = write_csv_gz(file_path, dfs, sheetNames, date1, date2, cols)
+    elif export_format == 'Parquet':
+        files = write_parquet(file_path, dfs, sheetNames, date1, date2, cols)
+    else:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    logger.debug("--- export_data finished in %.1f s: %s", time.perf_counter() - start, files)
+    return files
+
 # custom plot funcions
 @custom_callback # wrapper to catch errors
 def classify_cols(selected):
     logger.debug("classify_cols started ---")
-    logger.debug(f"{selected=}")
+    logger.debug("selected=%r", selected)
 
     units = DATA['units']
 
     filter_unit_cols = {col : unit for col, unit in units.items() if col in selected}
     # {key_expression: value_expression for item in iterable if condition}
-    logger.debug(f"{filter_unit_cols=}")
+    logger.debug("filter_unit_cols=%r", filter_unit_cols)
 
     classified_cols = {}
     for col, unit in filter_unit_cols.items():
@@ -383,7 +1141,7 @@ def classify_cols(selected):
             classified_cols[unit] = [] #if first column of this unit, create key and an empty array as value
         classified_cols[unit].append(col)
     
-    logger.debug(f"{classified_cols=}")
+    logger.debug("classified_cols=%r", classified_cols)
     return classified_cols
 
 @custom_callback # wrapper to catch errors
@@ -418,48 +1176,169 @@ def date_limits (timestamp, lower, upper):
     
     return date1, date2
 
-def split_df(LogsStandard):
-    # Legacy function to divide dataframes in 5 days slices to minimize plot.html file size
-    mindate = LogsStandard['DateTime'].min()
-    maxdate = LogsStandard['DateTime'].max()
-    print(mindate,maxdate)
-
-    step = 5
-
-    limits = []
-    limits.append(mindate.date()-datetime.timedelta(days=1)) # first
-
-    interval = maxdate - mindate
-
-    while interval > datetime.timedelta(days=step):
-        limits.append(limits[-1] + datetime.timedelta(days=step))
-        interval = interval - datetime.timedelta(days=step)
-        
-    limits.append(maxdate.date()+datetime.timedelta(days=1)) # last
+# Multi-resolution pyramid of Standard Logs
+def analog_cols(df):
+    # Columns aggregated with mean/min/max, the rest of columns keep the last value of each bucket
+    units = DATA['units']
+    return [col for col in df.columns if col in units and units[col] not in INT_UNITS + ['datetime', 'gps']
+            and pd.api.types.is_numeric_dtype(df[col])]
 
-    import numpy as np
-    limits = np.array(limits, dtype='datetime64')
-    
-    # Show Results
-    for item in limits:
-        print (item)
-
-    # Divide all data in slices of 5 days
-    dfs = []
-    totalshape = 0
-
-    for i in range(len(limits)-1):
-        df = pd.DataFrame()
-        df = LogsStandard[(LogsStandard['DateTime'] > limits[i]) & (LogsStandard['DateTime'] <= limits[i+1])]
-        dfs.append(df)
-        
-        totalshape = totalshape + df.shape[0]
-        print(df.shape)
-        
-    print (totalshape)
-
-    for df in dfs:
-        mindate = df['DateTime'].min()
-        maxdate = df['DateTime'].max()
-        print(mindate, maxdate)
-        print('--')
+def step_cols(df):
+    # Numeric columns drawn as steps (bool, int, valve_pos)
+    units = DATA['units']
+    return [col for col in df.columns if units.get(col) in STEP_UNITS and pd.api.types.is_numeric_dtype(df[col])]
+
+def first_last_valid(valid, starts):
+    # Position of the first and last True of each block of valid beginning at starts, -1 if the block has none
+    positions = np.arange(len(valid))
+    first = np.minimum.reduceat(np.where(valid, positions, len(valid)), starts)
+    last = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+    return np.where(first < len(valid), first, -1), last
+
+def pyramid_level(df, freq):
+    # Aggregate raw logs or a finer level in buckets of freq, buckets without rows are not created
+    # analog columns: mean (col), minimum (col_min) and maximum (col_max), 'Count': rows of the bucket
+    # step columns: last value (col), time and value of the first change (col_t1, col_v1), time of the last change (col_t2)
+    raw = 'Count' not in df.columns
+    analog = analog_cols(df)
+    others = [col for col in df.columns if col not in analog and col != 'DateTime' and col != 'Count'
+              and not col.endswith(LEVEL_SUFFIXES)]
+    steps = step_cols(df)
+
+    if not df['DateTime'].is_monotonic_increasing:
+        df = df.sort_values(by='DateTime', kind='stable')
+    df = df.reset_index(drop=True)
+
+    # Rows are sorted, so each bucket is a block of consecutive rows: reduceat over the first row of each block
+    bucket = df['DateTime'].dt.floor(freq).to_numpy()
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    lasts = np.r_[starts[1:], len(df)] - 1
+    count = np.ones(len(df), dtype='int64') if raw else df['Count'].to_numpy(dtype='int64')
+
+    level = {'DateTime': bucket[starts]}
+    for col in analog:
+        values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        # Weighted mean: mean of a finer level counts as many rows as its bucket had
+        weights = np.where(np.isnan(values), 0, count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            level[col] = (np.add.reduceat(np.nan_to_num(values) * weights, starts) / np.add.reduceat(weights, starts)).astype('float32')
+        low = values if raw else df[col + '_min'].to_numpy(dtype='float64', na_value=np.nan)
+        high = values if raw else df[col + '_max'].to_numpy(dtype='float64', na_value=np.nan)
+        level[col + '_min'] = np.fmin.reduceat(low, starts).astype('float32')
+        level[col + '_max'] = np.fmax.reduceat(high, starts).astype('float32')
+
+    dates = df['DateTime'].to_numpy()
+    for col in steps:
+        if raw:
+            # Change: value different from the previous row (the first row of df is not a change)
+            values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+            previous = np.r_[values[:1], values[:-1]]
+            changed = (values != previous) & ~(np.isnan(values) & np.isnan(previous))
+            first, last = first_last_valid(changed, starts)
+            times1, values1, times2 = dates, values, dates
+        else:
+            times1 = df[col + '_t1'].to_numpy()
+            values1 = df[col + '_v1'].to_numpy(dtype='float64', na_value=np.nan)
+            times2 = df[col + '_t2'].to_numpy()
+            first, _ = first_last_valid(~np.isnat(times1), starts)
+            _, last = first_last_valid(~np.isnat(times2), starts)
+        level[col + '_t1'] = np.where(first >= 0, times1[first], np.datetime64('NaT'))
+        level[col + '_v1'] = np.where(first >= 0, values1[first], np.nan).astype('float32')
+        level[col + '_t2'] = np.where(last >= 0, times2[last], np.datetime64('NaT'))
+
+    level = pd.DataFrame(level)
+    for col in others:
+        level[col] = df[col].iloc[lasts].reset_index(drop=True)
+    level['Count'] = np.add.reduceat(count, starts)
+    return level
+
+def level_steps(level, col):
+    # x, y of a step column of an aggregation level: its first and last change in each bucket, at the time they happened
+    # a change not recorded (e.g. between two chunks of a LogStore) is drawn at the start of its bucket
+    n = len(level)
+    dates = level['DateTime'].to_numpy()
+    values = level[col].to_numpy(dtype='float64', na_value=np.nan)
+    times1 = level[col + '_t1'].to_numpy()
+    values1 = level[col + '_v1'].to_numpy(dtype='float64', na_value=np.nan)
+    times2 = level[col + '_t2'].to_numpy()
+
+    # Candidate points of each bucket in time order: start of the bucket, first change, last change
+    no_change = np.isnat(times1)
+    previous = np.r_[np.nan, values[:-1]]
+    start = no_change & ((np.arange(n) == 0) | ((values != previous) & ~(np.isnan(values) & np.isnan(previous))))
+    last_change = ~np.isnat(times2) & (times2 != times1)
+
+    x = np.stack([dates, times1, times2], axis=1).ravel()
+    y = np.stack([values, values1, values], axis=1).ravel()
+    keep = np.stack([start, ~no_change, last_change], axis=1).ravel()
+    x, y = x[keep], y[keep]
+    # Last bucket: the line goes on until its start
+    if n and (len(x) == 0 or x[-1] < dates[-1]):
+        x, y = np.r_[x, dates[-1:]], np.r_[y, values[-1:]]
+    return pd.Series(x), pd.Series(y)
+
+@profiling.timed # stage of the profiling timeline
+def build_pyramid(df, levels=None):
+    # Aggregation levels of df, each level is computed from the previous one
+    if levels is None:
+        levels = PYRAMID_LEVELS
+    logger.debug("build_pyramid started ---")
+
+    pyramid = {}
+    previous = df
+    for level in levels:
+        if previous.empty:
+            break
+        previous = pyramid_level(previous, level)
+        pyramid[level] = previous
+        logger.debug("%s: %s rows", level, len(previous))
+
+    return pyramid
+
+def get_pyramid(logs):
+    # Aggregation levels of Standard Logs (DataFrame or LogStore), computed once
+    if isinstance(logs, log_store.LogStore):
+        if logs.pyramid is None:
+            # Buckets split between chunks are aggregated again
+            logs.pyramid = {level: pyramid_level(pd.concat(parts, ignore_index=True), level)
+                            for level, parts in logs.pyramid_parts.items() if parts}
+        return logs.pyramid
+
+    if logs.empty:
+        return {}
+    ref, pyramid = PYRAMIDS.get(id(logs), (None, None))
+    if ref is None or ref() is not logs:
+        pyramid = build_pyramid(logs)
+        PYRAMIDS[id(logs)] = (weakref.ref(logs), pyramid)
+        # Entries of DataFrames that do not exist anymore
+        for key in [key for key, (ref, _) in PYRAMIDS.items() if ref() is None]:
+            del PYRAMIDS[key]
+    return pyramid
+
+def count_rows(logs, date1, date2):
+    # Rows of Standard Logs between date1 and date2 without reading them
+    if isinstance(logs, log_store.LogStore):
+        return len(logs.read(date1, date2, columns=['DateTime']))
+    if logs.empty:
+        return 0
+    dates = logs['DateTime'].to_numpy()
+    return int(dates.searchsorted(np.datetime64(pd.Timestamp(date2)), side='right') - dates.searchsorted(np.datetime64(pd.Timestamp(date1))))
+
+def plot_level(logs, date1, date2, budget):
+    # Rows of logs between date1 and date2 at the finest level with at most budget rows
+    # windows of at most PYRAMID_MIN_ROWS rows are not aggregated (their traces are reduced by plots.reduce_points)
+    # returns (level, DataFrame): level None for raw logs, coarsest level if all levels are bigger than budget
+    if count_rows(logs, date1, date2) <= max(budget, PYRAMID_MIN_ROWS):
+        return None, time_slice(logs, date1, date2)
+
+    pyramid = get_pyramid(logs)
+    level, df = None, None
+    for level, level_df in pyramid.items():
+        df = time_slice(level_df, pd.Timestamp(date1).floor(level), date2)
+        if len(df) <= budget:
+            break
+
+    if df is None:
+        return None, time_slice(logs, date1, date2)
+    logger.debug("Plot level %s: %s rows", level, len(df))
+    return level, df
@@ -1,30 +1,37 @@
-import pandas as pd
 import os
 import datetime
 import re
+import queue
+import threading
 from PIL import Image
 
 import tkinter as tk
 import tkinter.filedialog as fd
 import tkcalendar
 import customtkinter as ctk
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-from modules import data_analysis as fcm_da
 from modules import help_app
-from modules import plots as fcm_plt
+from modules import profiling
+from modules import startup
 
+from modules import logging_cfg
 from modules.logging_cfg import setup_logger
 logger = setup_logger()
 logger.info("gui.py imported")
 
+# Heavy modules (pandas, plotly, matplotlib) imported after the window is shown (startup.preload) or on first use
+pd = startup.LazyModule('pandas')
+fcm_da = startup.LazyModule('modules.data_analysis')
+fcm_plt = startup.LazyModule('modules.plots')
+backend_tkagg = startup.LazyModule('matplotlib.backends.backend_tkagg')
+
 VERSION = "V1.00.01"
 #Execution path
 PATH = os.getcwd()
-logger.info(f"{PATH=}")
+logger.info("PATH=%r", PATH)
 #Get the path to the current script
 SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
-logger.info(f"{SCRIPT_PATH=}")
+logger.info("SCRIPT_PATH=%r", SCRIPT_PATH)
 #App icon path
 APP_ICON = os.path.join(SCRIPT_PATH, '..', 'resources', 'ad_logo.ico')
 #Resources path
@@ -34,6 +41,8 @@ TIMES = ['00:00', '01:00', '02:00', '03:00', '04:00', '05:00',
          '06:00', '07:00', '08:00', '09:00', '10:00', '11:00',
          '12:00', '13:00', '14:00', '15:00', '16:00', '17:00',
          '18:00', '19:00', '20:00', '21:00', '22:00', '23:00']
+# Minutes shown before and after the changeovers (fcm_da.set_co_padding)
+PADDINGS = ['0 min', '5 min', '10 min', '20 min', '30 min', '60 min']
 
 #Custom Tkinter theme
 ctk.set_appearance_mode("dark")
@@ -185,6 +194,33 @@ class ProgressFrame(ctk.CTkFrame):
         self.progressbar_1.configure(mode="indeterminate")
         self.progressbar_1.start()
 
+        # Files read, MB read and time left
+        self.progress_label = ctk.CTkLabel(self, text="")
+        self.progress_label.grid(row=1, column=0, padx=20, pady=5)
+
+        # Cancel import
+        self.cancel_bt = ctk.CTkButton(self, text="Cancel", command=self.cancel)
+        self.cancel_bt.grid(row=2, column=0, padx=20, pady=(5, 20))
+
+    def show_progress(self, progress):
+        # Progress sent by fcm_da.progress_step
+        if self.progressbar_1.cget("mode") == "indeterminate":
+            self.progressbar_1.stop()
+            self.progressbar_1.configure(mode="determinate")
+
+        if progress['total_bytes']:
+            self.progressbar_1.set(progress['bytes'] / progress['total_bytes'])
+
+        text = f"{progress['files']}/{progress['total_files']} files  -  {progress['bytes']/1e6:.0f}/{progress['total_bytes']/1e6:.0f} MB"
+        if progress['eta'] is not None:
+            text += f"  -  {datetime.timedelta(seconds=round(progress['eta']))} left"
+        self.progress_label.configure(text=text)
+
+    def cancel(self):
+        logger.debug("Import cancelled by the user")
+        fcm_da.CANCEL.set()
+        self.cancel_bt.configure(state="disabled", text="Cancelling...")
+
 class NavFrame(ctk.CTkFrame):
     # Frame in the bottom of the app to go back and forward
 
@@ -216,15 +252,17 @@ class App(ctk.CTk):
 
     # Files selection
     dirname = None #folder with logs
-    csv_files_list = [] #list of imported files
+    csv_files_list = [] #list of csv files in folder
+    seen_files = [] #csv files of the folder at the last import/append (selected or not), Append only offers the other ones
     
     # Import data
     import_success = 0 # bool of import data result
     mch_info = None # First 3 rows of csv files
     COs = None # List of changeovers
-    LogsStandard = pd.DataFrame() #DataFrame with process logs
-    LogsAlarms = pd.DataFrame() #DataFrame with alarm logs
-    LogsEvents = pd.DataFrame() #DataFrame with event logs
+    LogsStandard = None #DataFrame with process logs (None until logs are imported)
+    LogsAlarms = None #DataFrame with alarm logs
+    LogsEvents = None #DataFrame with event logs
+    worker_running = False # bool, a worker thread is importing/appending/exporting data
 
     # ------------------------ Methods to change widgets properties
     def step_00_init(self):
@@ -334,7 +372,9 @@ class App(ctk.CTk):
         App.frames["NFrame"].bt_navigation1.grid(row=0, column=0, padx=20, pady=10, sticky="w")
         App.frames["NFrame"].bt_navigation1.configure(text= "Clear all and Go back")
         App.frames["NFrame"].bt_navigation1.configure(command= self.back_to_selectfolder)
-        App.frames["NFrame"].bt_navigation2.grid_forget()
+        App.frames["NFrame"].bt_navigation2.configure(text="Append new files", state="enabled")
+        App.frames["NFrame"].bt_navigation2.configure(command= self.append_data_cmd)
+        App.frames["NFrame"].bt_navigation2.grid(row=0, column=2, padx=20, pady=10, sticky="e")
 
     def left_side_widgets(self, parent):
         # Left side panel / does not change during App execution
@@ -376,14 +416,41 @@ class App(ctk.CTk):
         self.scaling_label = ctk.CTkLabel(parent, text="UI Scaling:", anchor="w")
         self.scaling_label.grid(row=7, column=0, padx=20, pady=(10, 0))
         self.scaling_optionemenu = ctk.CTkOptionMenu(parent, values=["80%", "90%", "100%", "110%", "120%"],command=self.change_scaling_event)
-        self.scaling_optionemenu.grid(row=8, column=0, padx=20, pady=(5, 20))
+        self.scaling_optionemenu.grid(row=8, column=0, padx=20, pady=(5, 10))
         self.scaling_optionemenu.set("100%")
 
+        # create dropdown of file format of exported data
+        self.export_format_label = ctk.CTkLabel(parent, text="Export format:", anchor="w")
+        self.export_format_label.grid(row=9, column=0, padx=20, pady=(10, 0))
+        self.export_format = ctk.CTkOptionMenu(parent, values=["Excel", "CSV.gz", "Parquet"]) # fcm_da.EXPORT_FORMATS
+        self.export_format.grid(row=10, column=0, padx=20, pady=(5, 10))
+        self.export_format.set("Excel")
+
+        # Time of each stage of the last import and export
+        self.btn_stage_times = ctk.CTkButton(parent, text="Stage times", font=ctk.CTkFont(size=12), height=30, width=110,
+            command=self.stage_times_cmd)
+        self.btn_stage_times.grid(row=11, column=0, padx=20, pady=(10, 10))
+
+        # create dropdown of level of the log file
+        self.log_level_label = ctk.CTkLabel(parent, text="Log level:", anchor="w")
+        self.log_level_label.grid(row=12, column=0, padx=20, pady=(10, 0))
+        self.log_level_optionemenu = ctk.CTkOptionMenu(parent, values=logging_cfg.LEVELS, command=self.change_log_level_event)
+        self.log_level_optionemenu.grid(row=13, column=0, padx=20, pady=(5, 20))
+        self.log_level_optionemenu.set(logging_cfg.get_level())
+
     def help_cmd(self):
         logger.info("help button pressed")
         self.app2 = help_app.App()
         self.app2.mainloop()
 
+    def stage_times_cmd(self):
+        logger.info("stage times button pressed")
+        text = []
+        for title, stages in [('Last import', ('import_data', 'append_data')), ('Last export', ('export_data',))]:
+            run = profiling.last_run(stages)
+            text.append(title + ':\n' + (profiling.summary(run) if run else 'no data yet'))
+        tk.messagebox.showinfo(title='Stage times', message='\n\n'.join(text) + '\n\nAll stages: ' + profiling.TIMELINE_FILE) # type: ignore
+
     def __init__(self):
         super().__init__()
         logger.debug("App init")
@@ -446,11 +513,17 @@ class App(ctk.CTk):
         # Init widgets
         self.step_00_init()    
 
+        # Draw the window, then import the data modules in the background while the disclaimer is shown
+        self.update()
+        startup.mark("first paint")
+        startup.report()
+        startup.preload([fcm_da, fcm_plt, backend_tkagg])
+
         #Disclaimer
         tk.messagebox.showinfo(title='DISCLAIMER', 
             message=f'Welcome to VisuaLite {self.version}\n\nThis tool is intended for INTERNAL USE of ALFA LAVAL employees. Please note this is a BETA Version, so it is currently not supported.\n\nHappy plotting!') # type: ignore
 
-    def before_close(self):
+    def close_figures(self):
         # Close matplotlib figures if they exist
         if "TFrame" in self.frames:
             if App.frames["TFrame"].fig1 is not None:
@@ -460,6 +533,16 @@ class App(ctk.CTk):
                 App.frames["TFrame"].close_plot(App.frames["TFrame"].plot_fig,
                                                 App.frames["TFrame"].plot_window)
 
+    def before_close(self):
+        # Close matplotlib figures if they exist
+        self.close_figures()
+
+        # Stop import thread and worker processes, delete Standard Logs saved on disk (nothing to do if data modules were not loaded)
+        if fcm_da.is_loaded():
+            fcm_da.CANCEL.set()
+            fcm_da.shutdown_pool()
+            fcm_da.release(self.LogsStandard)
+
         # Close App
         self.destroy()
 
@@ -476,27 +559,26 @@ class App(ctk.CTk):
         new_scaling_float = int(new_scaling.replace("%", "")) / 100
         ctk.set_widget_scaling(new_scaling_float)
 
+    def change_log_level_event(self, new_level: str):
+        logging_cfg.set_level(new_level)
+
     def clear_all(self):
         # Delete memory
         logger.debug("--- Clear memory ---")
         self.dirname = None
         self.csv_files_list = []
+        self.seen_files = []
         self.import_success = 0
         self.mch_info = None
         self.COs = None
+        fcm_da.release(self.LogsStandard)
         self.LogsStandard = pd.DataFrame()
         self.LogsAlarms = pd.DataFrame()
         self.LogsEvents = pd.DataFrame()
 
         # Close matplotlib figures if they exist
+        self.close_figures()
         if "TFrame" in self.frames:
-            if App.frames["TFrame"].fig1 is not None:
-                App.frames["TFrame"].clear_co_preview(App.frames["TFrame"].fig1)
-            
-            if App.frames["TFrame"].plot_fig is not None:
-                App.frames["TFrame"].close_plot(App.frames["TFrame"].plot_fig,
-                                                App.frames["TFrame"].plot_window)
-
             #if App.frames["TFrame"].preview is not None:
             #    App.frames["TFrame"].preview.destroy()
 
@@ -515,7 +597,10 @@ class App(ctk.CTk):
 
     def back_to_selectfolder (self):
         logger.debug("Step1 - Back button pressed")
-        
+        if self.worker_running:
+            logger.debug("worker thread running -> Stop")
+            return #Stop
+
         # Clear memory and upload widgets of init
         self.clear_all()
         self.step_00_init()
@@ -551,22 +636,72 @@ class App(ctk.CTk):
     def checkbox_frame_event(self):
         return self.frames['FilesUpload'].get_checked_items()
     
-    def importing_data(self):
+    def run_in_thread(self, func, args, on_finish):
+        # Run an import/export function of fcm_da in a worker thread, the Tk mainloop keeps running
+        # progress and result are received through a queue read by poll_thread
+        # each worker thread has its own queue, the result of a thread can not reach the on_finish of another one
+        fcm_da.CANCEL.clear()
+        thread_queue = queue.Queue()
+        fcm_da.PROGRESS_QUEUE = thread_queue
+        self.set_worker_running(True)
+
+        def worker():
+            result = None
+            try:
+                result = func(*args)
+            except Exception as e:
+                logger.error("--- Error in worker thread")
+                logger.error(e, exc_info=True)
+            thread_queue.put(('result', result))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(100, lambda: self.poll_thread(thread_queue, on_finish))
+
+    def poll_thread(self, thread_queue, on_finish):
+        # Show progress of the worker thread, call on_finish with the result when it ends
+        try:
+            while True:
+                kind, value = thread_queue.get_nowait()
+                if kind == 'progress' and "PFrame" in App.frames:
+                    App.frames["PFrame"].show_progress(value)
+                elif kind == 'result':
+                    if fcm_da.PROGRESS_QUEUE is thread_queue:
+                        fcm_da.PROGRESS_QUEUE = None
+                    self.set_worker_running(False)
+                    on_finish(value)
+                    return
+        except queue.Empty:
+            pass
+
+        self.after(100, lambda: self.poll_thread(thread_queue, on_finish))
+
+    def set_worker_running(self, running):
+        # Buttons that append data or clear the imported data are disabled while a worker thread uses it
+        # (the step_* methods called by on_finish configure them again)
+        self.worker_running = running
+        state = "disabled" if running else "enabled"
+        App.frames["NFrame"].bt_navigation1.configure(state=state)
+        App.frames["NFrame"].bt_navigation2.configure(state=state)
+
+    def importing_data(self, result):
         logger.debug("...continue")
 
-        # Call Data Analysis function and assign outputs to App variables
+        # Assign outputs of Data Analysis function to App variables
         try:
-            self.import_success, self.mch_info, self.COs,self.LogsStandard, self.LogsAlarms, self.LogsEvents = fcm_da.import_data(self.dirname, self.selected_files, self.mch_type.get())
-            logger.debug(f"{self.import_success=}")
+            self.import_success, self.mch_info, self.COs,self.LogsStandard, self.LogsAlarms, self.LogsEvents = result
+            logger.debug("self.import_success=%r", self.import_success)
 
         except Exception as e:
             logger.error("--- Error importing data")
             logger.error(e, exc_info=True)
-            self.import_success == 4
+            self.import_success = 4
     
         if self.import_success == 1: #success
+            self.seen_files = list(self.csv_files_list)
             self.step_30_dataImported()
-            tk.messagebox.showinfo(title='Information', message='Import procedure successful!') # type: ignore
+            before = sum(b for b, _ in fcm_da.MEMORY_REPORT.values()) / 1e6
+            after = sum(a for _, a in fcm_da.MEMORY_REPORT.values()) / 1e6
+            tk.messagebox.showinfo(title='Information', message=f'Import procedure successful!\nMemory used: {after:.1f} MB (saved {before - after:.1f} MB)') # type: ignore
 
             ## Save DataFrames to .pkl for debugging 
             #import pickle 
@@ -583,6 +718,10 @@ class App(ctk.CTk):
             self.step_10_folderSelected()
             tk.messagebox.showerror(title='Import failed', message='Visualite could not find log files in the .csv files selected') # type: ignore
 
+        elif self.import_success == 3: #cancelled by the user
+            self.step_10_folderSelected()
+            tk.messagebox.showinfo(title='Import cancelled', message='Import cancelled, no data was imported') # type: ignore
+
         else:
             self.step_10_folderSelected()
             tk.messagebox.showerror(title='Import failed', message='Unknown error. Please restart the application and try again') # type: ignore
@@ -601,8 +740,73 @@ class App(ctk.CTk):
         else:
             # Show progressBar Frame
             self.step_20_importingData()
-            logger.debug("wait 1000ms...")
-            self.after(1000, self.importing_data) #wait 1000ms to show frame and next step
+            # Import in a worker thread, importing_data is called with the result
+            self.run_in_thread(fcm_da.import_data, (self.dirname, self.selected_files, self.mch_type.get()), self.importing_data)
+
+    def appending_data(self, new_files, result):
+        logger.debug("...continue")
+
+        # Outputs of Data Analysis function, only new files were parsed
+        try:
+            append_success, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents = result
+            logger.debug("append_success=%r", append_success)
+
+        except Exception as e:
+            logger.error("--- Error appending data")
+            logger.error(e, exc_info=True)
+            append_success = 4
+
+        # Figures of the previous Data Analysis Frame
+        self.close_figures()
+
+        if append_success == 1: #success
+            self.COs, self.LogsStandard, self.LogsAlarms, self.LogsEvents = COs, LogsStandard, LogsAlarms, LogsEvents
+            self.seen_files = self.seen_files + new_files
+            self.step_30_dataImported()
+            tk.messagebox.showinfo(title='Information', message=str(len(new_files)) + ' new files imported successfully!') # type: ignore
+
+        # ERRORS: imported data is not modified
+        elif append_success == 0: #file from another machine / file wrong columns / file name not standard
+            self.step_30_dataImported()
+            tk.messagebox.showerror(title='Append failed', message='Wrong File: ' + str(mch_info)) # type: ignore
+
+        elif append_success == 2: #no file with standard name in new files
+            # not log files, they are not offered again
+            self.seen_files = self.seen_files + new_files
+            self.step_30_dataImported()
+            tk.messagebox.showerror(title='Append failed', message='Visualite could not find log files in the new .csv files') # type: ignore
+
+        elif append_success == 3: #cancelled by the user
+            self.step_30_dataImported()
+            tk.messagebox.showinfo(title='Append cancelled', message='Append cancelled. Imported data was not modified') # type: ignore
+
+        else:
+            self.step_30_dataImported()
+            tk.messagebox.showerror(title='Append failed', message='Unknown error. Imported data was not modified') # type: ignore
+
+    def append_data_cmd(self):
+        logger.debug("Step2 - Append new files started")
+        if self.worker_running:
+            logger.debug("worker thread running -> Stop")
+            return #Stop
+
+        # Look for csv files added to the folder since the last import
+        self.csv_files_list = [filename for filename in os.listdir(self.dirname) if filename.lower().endswith('.csv')]
+        new_files = [filename for filename in self.csv_files_list if filename not in self.seen_files]
+        logger.debug("New files found:")
+        logger.debug(new_files)
+
+        if new_files == []:
+            logger.debug("no new files -> Stop")
+            tk.messagebox.showinfo(title='Information', message='No new files found in the folder: ' + self.dirname) # type: ignore
+            return #Stop
+
+        # Show progressBar Frame
+        self.step_20_importingData()
+        # Append in a worker thread, appending_data is called with the result
+        self.run_in_thread(fcm_da.append_data, (self.dirname, new_files, self.mch_info, self.COs,
+                                                self.LogsStandard, self.LogsAlarms, self.LogsEvents),
+                           lambda result: self.appending_data(new_files, result))
 
 class TabsFrame(ctk.CTkFrame):
     # Data Analysis Frame with 3 Tabs, need to be after App 
@@ -647,6 +851,12 @@ class TabsFrame(ctk.CTkFrame):
         self.clear_btn = ctk.CTkButton(self.co_preview, text="Clear", command= lambda: self.clear_co_preview(self.fig1))
         self.clear_btn.grid(row=0, column=1, padx=20, pady=(20,10), sticky="w")
 
+        #Option menu with the time shown around the changeovers (previews, plots and exported data)
+        self.co_padding = ctk.CTkOptionMenu(self.co_preview, dynamic_resizing=False, width=100, values=PADDINGS,
+                                            command=self.change_co_padding)
+        self.co_padding.grid(row=0, column=2, padx=20, pady=(20,10), sticky="e")
+        self.co_padding.set(str(int(fcm_da.CO_PADDING.total_seconds() // 60)) + " min")
+
         #Plot declaration
         self.fig1 = None
         #Dummy img of plot
@@ -656,7 +866,7 @@ class TabsFrame(ctk.CTkFrame):
                                           dark_image=Image.open(dummy_plot_dark),
                                           size=(500, 375))
         self.dummy_plot = ctk.CTkLabel(self.co_preview, text="", image=self.dummy_plot_tk)
-        self.dummy_plot.grid(row=1, column=0, columnspan=2, sticky="nsew", padx=0, pady=10)
+        self.dummy_plot.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=0, pady=10)
 
         #Frame with list of Change overs
         self.results_t1 = ctk.CTkScrollableFrame(self.tabview.tab("Change Overs"))
@@ -886,8 +1096,7 @@ class TabsFrame(ctk.CTkFrame):
 
         #Information of date limits
         if not self.app.LogsStandard.empty:
-            mindateS = self.app.LogsStandard['DateTime'].min()
-            maxdateS = self.app.LogsStandard['DateTime'].max()
+            mindateS, maxdateS = fcm_da.first_last(self.app.LogsStandard)
             s_text = '  - Standard Logs:    ' + str(mindateS) + '  ---  ' + str(maxdateS) + '\n'
         else:
             s_text = '\n'
@@ -936,6 +1145,8 @@ class TabsFrame(ctk.CTkFrame):
 
     def export_excel_T1(self):
         logger.debug("Tab1 - export_excel_T1 started ---")
+        if self.export_running():
+            return #Stop
         self.show_progress_bar()
 
         index = self.sel_co.get()
@@ -961,7 +1172,6 @@ class TabsFrame(ctk.CTkFrame):
             cols = all_co_cols,
             fileName = self.name_file)
 
-        self.hide_progress_bar()
         logger.debug("--- Tab1 - export_excel_T1 finished")
 
     def plot_sel_COs(self):
@@ -989,7 +1199,7 @@ class TabsFrame(ctk.CTkFrame):
             return #Stop
 
         plot_type = self.plot_type.get()
-        logger.debug(f"{plot_type=}")
+        logger.debug("plot_type=%r", plot_type)
 
         df = fcm_da.ChangeOverToDF(self.app.COs[index-1], self.app.LogsStandard)
         
@@ -1006,7 +1216,7 @@ class TabsFrame(ctk.CTkFrame):
         logger.debug("File to save:")
         logger.debug(file_path)
         try:
-            fig.write_html(file_path, config={'displaylogo': False})
+            fcm_plt.save_html(fig, file_path)
             logger.debug("File saved successfully.")
             tk.messagebox.showinfo(title='Plot saved!', message="Plot saved in destination folder") # type: ignore
 
@@ -1040,12 +1250,24 @@ class TabsFrame(ctk.CTkFrame):
             self.fig1 = fcm_plt.change_over_preview(fcm_da.ChangeOverToDF(self.app.COs[i-1], self.app.LogsStandard))
 
             # Show plot in App
-            self.canvas1 = FigureCanvasTkAgg(self.fig1, master=self.co_preview)
+            self.canvas1 = backend_tkagg.FigureCanvasTkAgg(self.fig1, master=self.co_preview)
             self.canvas1.draw()
-            self.canvas1.get_tk_widget().grid(row=1, column=0, columnspan=2, sticky="nsew", padx=0, pady=10)
+            self.canvas1.get_tk_widget().grid(row=1, column=0, columnspan=3, sticky="nsew", padx=0, pady=10)
         
         logger.debug("--- preview_co finished")
 
+    def change_co_padding(self, padding):
+        logger.debug("change_co_padding started --- %s", padding)
+
+        # Only the rows of each changeover window are searched again
+        fcm_da.set_co_padding(int(padding.split()[0]), self.app.COs, self.app.LogsStandard)
+
+        # Preview shown again with the new window
+        if self.fig1 is not None:
+            self.preview_co(self.co_sel.get())
+
+        logger.debug("--- change_co_padding finished")
+
     def clear_co_preview(self, fig):
         logger.debug("clear_co_preview started ---")
 
@@ -1054,7 +1276,7 @@ class TabsFrame(ctk.CTkFrame):
         self.canvas1.get_tk_widget().grid_forget()
 
         #Show dummy plot
-        self.dummy_plot.grid(row=1, column=0, columnspan=2, sticky="nsew", padx=5, pady=10)
+        self.dummy_plot.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=5, pady=10)
 
         # init fig
         self.fig1 = None
@@ -1153,7 +1375,7 @@ class TabsFrame(ctk.CTkFrame):
         # from "1hour" type input to exact datetime
         date1, date2 = fcm_da.date_limits(self.timestamps[self.result_selection.get()],self.low_limit.get(), self.high_limit.get())
         logger.debug("Dates to filter:")
-        logger.debug(f"{date1=}, {date2=}")
+        logger.debug("date1=%r, date2=%r", date1, date2)
         
         cols = self.get_selected_vars_t2()
         logger.debug("Variables selected:")
@@ -1178,30 +1400,25 @@ class TabsFrame(ctk.CTkFrame):
         self.fig = fcm_plt.custom_plot_divided(self.app.LogsStandard, self.app.LogsAlarms, self.app.LogsEvents, cols, date1, date2, self.name_file)
         logger.debug("Tab2 - fig created")
 
-        # Save png preview
-        png_path = os.path.join(PATH, '__vl.log', 'preview.png')
+        # Preview image drawn in memory (downsampled)
         try:
-            logger.debug("saving image")
-            self.fig.write_image(png_path)
-            logger.debug("--- png saved")
-    
+            self.image_preview = ctk.CTkImage(fcm_plt.preview_image(self.fig), size=fcm_plt.PREVIEW_SIZE)
         except Exception as e:
-            logger.error("--- Error saving file")
+            logger.error("--- Error creating preview")
             logger.error(e, exc_info=True)
-            tk.messagebox.showwarning(title='Error creating preview png', message="Error creating preview png") # type: ignore
-            # Load an image for the popup
+            tk.messagebox.showwarning(title='Error creating preview', message="Error creating preview image") # type: ignore
+            self.hide_progress_bar()
+            return #Stop
 
-        # Load image file
-        self.image_preview = ctk.CTkImage(Image.open(png_path), size=(700, 500))
         # Create PopUp with preview / In popup save html or abort
-        self.create_preview_popup()        
-        # Delete image file
-        os.remove(png_path)
+        self.create_preview_popup()
 
         self.hide_progress_bar()
 
     def export_excel_T2(self):
         logger.debug("Tab2 - export_excel_T2 plot started ---")
+        if self.export_running():
+            return #Stop
         self.show_progress_bar() 
 
         logger.debug("Limits selected:")
@@ -1217,7 +1434,7 @@ class TabsFrame(ctk.CTkFrame):
         # from "1hour" type input to exact datetime
         date1, date2 = fcm_da.date_limits(self.timestamps[self.result_selection.get()],self.low_limit.get(), self.high_limit.get())
         logger.debug("Dates to filter:")
-        logger.debug(f"{date1=}, {date2=}")
+        logger.debug("date1=%r, date2=%r", date1, date2)
         
         cols = self.get_selected_vars_t2()
         logger.debug("Variables selected:")
@@ -1246,13 +1463,11 @@ class TabsFrame(ctk.CTkFrame):
             cols = cols,
             fileName = self.name_file)
 
-        self.hide_progress_bar()
-
     #TAB3 functions
     def show_plot(self):
         #Create aux plot if it does not exit
         if self.plot_fig is None:
-            self.plot_fig = fcm_plt.create_aux_plot(self.app.LogsStandard, self.app.LogsAlarms, self.app.LogsEvents)
+            self.plot_fig = fcm_plt.create_aux_plot(fcm_da.overview(self.app.LogsStandard), self.app.LogsAlarms, self.app.LogsEvents)
             
             #Create popup
             self.plot_window = ctk.CTkToplevel(self.app)
@@ -1262,7 +1477,7 @@ class TabsFrame(ctk.CTkFrame):
             self.plot_window.wm_transient(self.app)
             
             #Place plot in popup
-            self.canvas = FigureCanvasTkAgg(self.plot_fig, master=self.plot_window)
+            self.canvas = backend_tkagg.FigureCanvasTkAgg(self.plot_fig, master=self.plot_window)
             self.canvas.draw()
             self.canvas.get_tk_widget().pack()
 
@@ -1298,7 +1513,7 @@ class TabsFrame(ctk.CTkFrame):
         time2 = self.cal2t.get() 
 
         logger.debug("User selections:")
-        logger.debug(f"{date1=}, {time1=}, {date2=}, {time2=}")
+        logger.debug("date1=%r, time1=%r, date2=%r, time2=%r", date1, time1, date2, time2)
         
         # Convert inputs to exact datetimes
         datetime1 = datetime.datetime(int(date1.split('/')[0]), int(date1.split('/')[1]), int(date1.split('/')[2]),
@@ -1314,11 +1529,6 @@ class TabsFrame(ctk.CTkFrame):
             tk.messagebox.showwarning(title='Incorrect dates', message='"From:" date is bigger than "To:" date') # type: ignore
             self.hide_progress_bar()
             return #Stop
-        elif (time_difference.days > 5):
-            logger.debug("date range bigger than 5 days -> Stop")
-            tk.messagebox.showwarning(title='Date range too big', message='Please select a date range smaller than 5 days') # type: ignore
-            self.hide_progress_bar()
-            return #Stop
         elif time_difference.days == 0 and time_difference.seconds // 3600 == 0: #//integer division
             logger.debug("date range = 0 hours -> Stop")
             tk.messagebox.showwarning(title='Date range = 0', message='Please select a valid date range') # type: ignore
@@ -1326,7 +1536,7 @@ class TabsFrame(ctk.CTkFrame):
             return #Stop
         
         cols = self.get_selected_vars_t3()
-        logger.debug(f"{cols=}")
+        logger.debug("cols=%r", cols)
 
         if cols == []:
             logger.debug("no variable selected -> Stop")
@@ -1340,25 +1550,18 @@ class TabsFrame(ctk.CTkFrame):
         self.fig = fcm_plt.custom_plot_divided(self.app.LogsStandard, self.app.LogsAlarms, self.app.LogsEvents, cols, datetime1, datetime2, self.name_file)
         logger.debug("Tab3 - fig created")
         
-        # Save png preview
-        png_path = os.path.join(PATH, '__vl.log', 'preview.png')
+        # Preview image drawn in memory (downsampled)
         try:
-            logger.debug("saving image")
-            self.fig.write_image(png_path)
-            logger.debug("--- png saved")
-    
+            self.image_preview = ctk.CTkImage(fcm_plt.preview_image(self.fig), size=fcm_plt.PREVIEW_SIZE)
         except Exception as e:
-            logger.error("--- Error saving file")
+            logger.error("--- Error creating preview")
             logger.error(e, exc_info=True)
-            tk.messagebox.showwarning(title='Error creating preview png', message="Error creating preview png") # type: ignore
-            # Load an image for the popup
-        
-        # Load image file
-        self.image_preview = ctk.CTkImage(Image.open(png_path), size=(700, 500))
+            tk.messagebox.showwarning(title='Error creating preview', message="Error creating preview image") # type: ignore
+            self.hide_progress_bar()
+            return #Stop
+
         # Create PopUp with preview / In popup save html or abort
-        self.create_preview_popup()        
-        # Delete image file
-        os.remove(png_path)
+        self.create_preview_popup()
 
         self.hide_progress_bar()
 
@@ -1406,7 +1609,7 @@ class TabsFrame(ctk.CTkFrame):
         logger.debug(file_path)
 
         try:
-            fig.write_html(file_path, config={'displaylogo': False})
+            fcm_plt.save_html(fig, file_path)
             logger.debug("--- save_html successful")
             tk.messagebox.showinfo(title='Plot saved!', message="Plot saved in destination folder") # type: ignore
             self.hide_progress_bar()
@@ -1472,6 +1675,8 @@ class TabsFrame(ctk.CTkFrame):
 
     def export_excel_T3(self):
         logger.debug("Tab3 - export_excel_T3 function started ---")
+        if self.export_running():
+            return #Stop
         self.show_progress_bar() 
 
         date1 = self.cal1d.get_date()
@@ -1480,7 +1685,7 @@ class TabsFrame(ctk.CTkFrame):
         time2 = self.cal2t.get() 
 
         logger.debug("User selections:")
-        logger.debug(f"{date1=}, {time1=}, {date2=}, {time2=}")
+        logger.debug("date1=%r, time1=%r, date2=%r, time2=%r", date1, time1, date2, time2)
         
         # Convert inputs to exact datetimes
         datetime1 = datetime.datetime(int(date1.split('/')[0]), int(date1.split('/')[1]), int(date1.split('/')[2]),
@@ -1496,11 +1701,6 @@ class TabsFrame(ctk.CTkFrame):
             tk.messagebox.showwarning(title='Incorrect dates', message='"From:" date is bigger than "To:" date') # type: ignore
             self.hide_progress_bar()
             return #Stop
-        elif (time_difference.days > 5):
-            logger.debug("date range bigger than 5 days -> Stop")
-            tk.messagebox.showwarning(title='Date range too big', message='Please select a date range smaller than 5 days') # type: ignore
-            self.hide_progress_bar()
-            return #Stop
         elif time_difference.days == 0 and time_difference.seconds // 3600 == 0: #//integer division
             logger.debug("date range = 0 hours -> Stop")
             tk.messagebox.showwarning(title='Date range = 0', message='Please select a valid date range') # type: ignore
@@ -1508,7 +1708,7 @@ class TabsFrame(ctk.CTkFrame):
             return #Stop
         
         cols = self.get_selected_vars_t3()
-        logger.debug(f"{cols=}")
+        logger.debug("cols=%r", cols)
 
         if cols == []:
             logger.debug("no variable selected -> Stop")
@@ -1528,7 +1728,13 @@ class TabsFrame(ctk.CTkFrame):
             cols = cols,
             fileName = name_file)
 
-        self.hide_progress_bar()
+    def export_running(self):
+        # Only one export at a time: the data of the running export must not change until it is saved
+        if self.app.worker_running:
+            logger.debug("export running -> Stop")
+            tk.messagebox.showinfo(title='Export running', message='Please wait until the current export is finished') # type: ignore
+            return True
+        return False
 
     def export_excel(self, dfs, sheetNames, date1, date2, cols, fileName):
         logger.debug('export_excel started ---')
@@ -1544,43 +1750,25 @@ class TabsFrame(ctk.CTkFrame):
         logger.debug("Folder selected:")
         logger.debug(dest_folder)
 
-        file_path = os.path.join(dest_folder, (fileName + ".xlsx"))
+        # Extension added by fcm_da.export_data depending on the format selected
+        file_path = os.path.join(dest_folder, fileName)
+        export_format = self.app.export_format.get()
         logger.debug("File to be saved:")
-        logger.debug(file_path)
+        logger.debug("file_path=%r, export_format=%r", file_path, export_format)
 
-        try:
-            with pd.ExcelWriter(file_path) as writer:  
-                for i, df in enumerate(dfs):
-                    if not df.empty:
-                        logger.debug(i)
-                        logger.debug(sheetNames[i])
-
-                        df_export = df[(df['DateTime'] >= date1) & (df['DateTime'] <= date2)]
-
-                        if 'AlarmNumber' in cols:
-                            cols.remove('AlarmNumber')
-                        if 'EventNumber' in cols:
-                            cols.remove('EventNumber')
-
-                        if set(cols).issubset(df_export.columns.tolist()):
-                            cols.insert(0, 'DateTime')
-                            df_export = df_export[cols]
-                        elif 'Evn_Code_Label' in df_export.columns.tolist():
-                            del df_export['Evn_Code_Label']
-                        elif 'Alm_Code_Label' in df_export.columns.tolist():
-                            del df_export['Alm_Code_Label']
-
-                        df_export.to_excel(writer, sheet_name=sheetNames[i], index=False)
-
-                    else:
-                        logger.debug('df empty')
-            
-            tk.messagebox.showinfo(title='Excel File saved!', message="Excel file saved in destination folder") # type: ignore
-            logger.debug('--- export_excel finished')
+        # Save in a worker thread, exported is called with the files saved
+        if self.export_running():
+            logger.debug("--- export_excel finished")
+            return
+        self.app.run_in_thread(fcm_da.export_data, (file_path, dfs, sheetNames, date1, date2, cols, export_format), self.exported)
 
-        except Exception as e:
-            logger.error("--- Error saving excel file")
-            logger.error(e, exc_info=True)
-            tk.messagebox.showwarning(title='Error creating excel file', message="Error creating excel file, check permissions") # type: ignore
-            self.hide_progress_bar()
+    def exported(self, files):
+        if files is None:
+            logger.error("--- Error saving exported files")
+            tk.messagebox.showwarning(title='Error exporting data', message="Error saving the exported files, check permissions") # type: ignore
+        else:
+            logger.debug("Files saved: %s", files)
+            tk.messagebox.showinfo(title='Data exported!', message=f"{len(files)} file(s) saved in destination folder") # type: ignore
+        self.hide_progress_bar()
+        logger.debug('--- export_excel finished')
 
@@ -516,7 +516,7 @@ class App(ctk.CTkToplevel):
 
 	def change_frame(self, frame_id):
 		logger.info("button pressed")
-		logger.info(f"{frame_id=}")
+		logger.info("frame_id=%r", frame_id)
 
 		if App.current is not None:
 			App.frames[App.current].grid_forget() # Hide the current frame
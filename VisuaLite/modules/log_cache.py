@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow # Feather files, cache is disabled if not installed
+except ImportError:
+    pyarrow = None
+
+from modules.logging_cfg import setup_logger
+logger = setup_logger()
+logger.info("log_cache.py imported")
+
+# Cache folder in execution path, next to the log folder
+PATH = os.getcwd()
+CACHE_DIR = os.path.join(PATH, '__vl.cache')
+# Maximum size of the cache in bytes, older files are deleted first
+MAX_SIZE = 2 * 1024**3
+# Increase if the formatting of the DataFrames changes, old files are not loaded anymore
+FORMAT_VERSION = 3
+# Cache can be disabled with ENABLED = False
+ENABLED = pyarrow is not None
+
+def cache_key(Filename, mch_type):
+    # Key of a formatted log file: path + size + modification time + machine type
+    stat = os.stat(Filename)
+    fingerprint = f"{os.path.abspath(Filename)}|{stat.st_size}|{stat.st_mtime_ns}|{mch_type}|{FORMAT_VERSION}"
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+def cache_paths(key):
+    # Feather file with the DataFrame and json file with the machine info of the log file
+    return os.path.join(CACHE_DIR, key + '.feather'), os.path.join(CACHE_DIR, key + '.json')
+
+def load(key):
+    # Returns (mch_info, DataFrame) of a cached log file, None if not in cache
+    if not ENABLED:
+        return None
+
+    df_path, info_path = cache_paths(key)
+    if not (os.path.exists(df_path) and os.path.exists(info_path)):
+        return None
+
+    try:
+        with open(info_path, 'r') as info_file:
+            mch_info = json.load(info_file)['mch_info']
+        df = pd.read_feather(df_path)
+
+        # Update modification time, used to delete least recently used files first
+        os.utime(df_path)
+        return mch_info, df
+
+    except Exception as e:
+        logger.error("--- Error loading cached file, file will be parsed again")
+        logger.error(e, exc_info=True)
+        return None
+
+def save(key, mch_info, df):
+    # Save formatted DataFrame of a log file, errors only disable the cache for this file
+    if not ENABLED:
+        return
+
+    df_path, info_path = cache_paths(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        # Write to temporary files first, so a crashed import never leaves a half written file
+        df.reset_index(drop=True).to_feather(df_path + '.tmp')
+        with open(info_path + '.tmp', 'w') as info_file:
+            json.dump({'mch_info': mch_info}, info_file)
+
+        os.replace(df_path + '.tmp', df_path)
+        os.replace(info_path + '.tmp', info_path)
+
+    except Exception as e:
+        logger.error("--- Error saving file in cache")
+        logger.error(e, exc_info=True)
+
+def evict(max_size=None):
+    # Delete least recently used files until the cache is smaller than max_size
+    if not ENABLED or not os.path.exists(CACHE_DIR):
+        return
+
+    if max_size is None:
+        max_size = MAX_SIZE
+
+    files = []
+    total_size = 0
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith('.feather'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.name[:-len('.feather')]))
+            total_size += stat.st_size
+
+    if total_size <= max_size:
+        return
+
+    logger.debug("Cache size %s bytes > %s bytes, deleting old files", total_size, max_size)
+    for _, size, key in sorted(files):
+        for path in cache_paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total_size -= size
+        if total_size <= max_size:
+            break
+
+def clear():
+    # Delete all files of the cache
+    evict(max_size=0)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow # Feather chunks, pickle is used if not installed
+except ImportError:
+    pyarrow = None
+
+from modules.logging_cfg import setup_logger
+logger = setup_logger()
+logger.info("log_store.py imported")
+
+# Store folder in execution path, one subfolder per imported folder of logs
+PATH = os.getcwd()
+STORE_DIR = os.path.join(PATH, '__vl.store')
+# Rows of each chunk kept in memory for the overview plot and the date limits
+OVERVIEW_ROWS = 500
+
+class LogStore:
+    # Standard logs written to disk in chunks sorted by DateTime, only the time windows needed are read
+    # Used like a DataFrame by the functions that slice it: empty, columns, len()
+
+    def __init__(self):
+        self.path = os.path.join(STORE_DIR, uuid.uuid4().hex)
+        os.makedirs(self.path, exist_ok=True)
+        logger.debug("LogStore created in %s", self.path)
+
+        self.chunks = [] # {'path', 'first', 'last', 'rows'}
+        self.columns = pd.Index([])
+        self.dtypes = None
+        self.overview_chunks = []
+        self.edges = pd.DataFrame() # rows where a changeover started/finished, filled by data_analysis
+        self.pyramid_parts = {} # {level: [aggregation of each chunk]}, filled by data_analysis
+        self.pyramid = None # aggregation levels of all chunks, computed by data_analysis when needed
+        self.nbytes = 0
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def __len__(self):
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    @property
+    def first(self):
+        return min(chunk['first'] for chunk in self.chunks) if self.chunks else None
+
+    @property
+    def last(self):
+        return max(chunk['last'] for chunk in self.chunks) if self.chunks else None
+
+    def write(self, df):
+        # Save a sorted DataFrame as a new chunk
+        if df.empty:
+            return
+
+        file_path = os.path.join(self.path, f"{len(self.chunks):06d}" + ('.feather' if pyarrow is not None else '.pkl'))
+        df = df.reset_index(drop=True)
+        if pyarrow is not None:
+            df.to_feather(file_path)
+        else:
+            df.to_pickle(file_path)
+
+        self.chunks.append({'path': file_path, 'first': df['DateTime'].iat[0], 'last': df['DateTime'].iat[-1], 'rows': len(df)})
+        self.columns = df.columns
+        self.dtypes = df.dtypes
+        self.overview_chunks.append(df.iloc[::max(1, len(df) // OVERVIEW_ROWS)])
+        self.nbytes += os.path.getsize(file_path)
+        self.pyramid = None
+
+        logger.debug("Chunk %s saved: %s rows, %s - %s", len(self.chunks), len(df), df['DateTime'].iat[0], df['DateTime'].iat[-1])
+
+    def read_chunk(self, chunk, columns=None):
+        if chunk['path'].endswith('.feather'):
+            return pd.read_feather(chunk['path'], columns=columns)
+        df = pd.read_pickle(chunk['path'])
+        return df if columns is None else df[columns]
+
+    def read(self, date1, date2, include_start=True, columns=None):
+        # Rows with date1 <= DateTime <= date2 (date1 < DateTime <= date2 if not include_start)
+        date1, date2 = pd.Timestamp(date1), pd.Timestamp(date2)
+        if columns is not None and 'DateTime' not in columns:
+            columns = ['DateTime'] + list(columns)
+
+        selected = [chunk for chunk in self.chunks if chunk['last'] >= date1 and chunk['first'] <= date2]
+        if not selected:
+            return pd.DataFrame(columns=self.columns if columns is None else columns)
+
+        df = pd.concat([self.read_chunk(chunk, columns) for chunk in selected], axis=0, ignore_index=True)
+        if len(selected) > 1 and not df['DateTime'].is_monotonic_increasing:
+            # Chunks appended over older ones
+            df = df.sort_values(by='DateTime', kind='stable').drop_duplicates().reset_index(drop=True)
+
+        dates = df['DateTime'].to_numpy()
+        start = dates.searchsorted(np.datetime64(date1), side='left' if include_start else 'right')
+        stop = dates.searchsorted(np.datetime64(date2), side='right')
+        return df.iloc[start:stop].reset_index(drop=True)
+
+    def tail(self, columns=None):
+        # Last row of the store
+        if not self.chunks:
+            return pd.DataFrame(columns=self.columns)
+        chunk = max(self.chunks, key=lambda chunk: chunk['last'])
+        return self.read_chunk(chunk, columns).iloc[[-1]]
+
+    def overview(self):
+        # Reduced DataFrame of the whole period (every n-th row of each chunk)
+        if not self.overview_chunks:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(self.overview_chunks, axis=0, ignore_index=True).sort_values(by='DateTime', kind='stable')
+
+    def truncate(self, n_chunks):
+        # Delete the chunks saved after the first n_chunks
+        for chunk in self.chunks[n_chunks:]:
+            self.nbytes -= os.path.getsize(chunk['path'])
+            os.remove(chunk['path'])
+        self.chunks = self.chunks[:n_chunks]
+        self.overview_chunks = self.overview_chunks[:n_chunks]
+        self.pyramid_parts = {level: parts[:n_chunks] for level, parts in self.pyramid_parts.items()}
+        self.pyramid = None
+
+    def close(self):
+        # Delete the files of the store
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.chunks = []
+        self.overview_chunks = []
+
+def clear():
+    # Delete stores of previous executions
+    shutil.rmtree(STORE_DIR, ignore_errors=True)
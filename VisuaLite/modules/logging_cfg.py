@@ -1,35 +1,129 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
 import os
-import shutil
+import threading
 
 # Create log folder in execution path
 PATH = os.getcwd()
 log_dir = os.path.join(PATH, '__vl.log')
 filename = 'visualite_debug.log'
 
-def backup_log():
-    # Save last execution log as visualite_backup.log
-    log_filename = os.path.join(log_dir, filename)
-    if os.path.exists(log_filename):
-        backup_filename = log_filename.replace("debug.log", "backup.log")
-        if os.path.exists(backup_filename):
-            os.remove(backup_filename)
-        shutil.move(log_filename, backup_filename)
+# Log level, can be changed while the App runs with set_level (also read by worker processes from the environment)
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+LEVEL_ENV = 'VISUALITE_LOG_LEVEL'
+DEFAULT_LEVEL = 'DEBUG'
+# Size of the log file before it is rotated and rotated files kept (visualite_debug.log.1 is the newest)
+MAX_BYTES = 10 * 1024**2
+BACKUP_COUNT = 5
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 
-def setup_logger():
-    # Create folder if it does not exits
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+# Queue of the records of the App and of its worker processes, written to the log file by LISTENER
+# only the App opens the log file: the rotation does not fail because a worker process has it open (Windows)
+LOG_QUEUE = None
+# Background thread of the App writing the records put in LOG_QUEUE to the log file
+LISTENER = None
+# Process where logging was configured (a forked worker process configures it again)
+CONFIGURED_PID = None
+LOCK = threading.Lock()
+
+def get_level():
+    level = os.environ.get(LEVEL_ENV, DEFAULT_LEVEL).upper()
+    return level if level in LEVELS else DEFAULT_LEVEL
+
+def set_level(level):
+    # Change the level of the App and of the worker processes started afterwards
+    level = level.upper()
+    if level not in LEVELS:
+        raise ValueError(f"Log level {level} not in {LEVELS}")
+    os.environ[LEVEL_ENV] = level
+    logging.getLogger().setLevel(level)
+    # Worker processes already running keep their level, their records are filtered by the file handler
+    if LISTENER is not None:
+        for handler in LISTENER.handlers:
+            handler.setLevel(level)
+    logging.getLogger().info("Log level set to %s", level)
 
+def file_handler():
+    # Handler of the log file, only used by the listener of the App
     file_path = os.path.join(log_dir, filename)
+    handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, delay=True)
+    # New log file for each execution of App, the previous ones are kept as .1, .2, ...
+    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        handler.doRollover()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.setLevel(get_level())
+    return handler
+
+def stop_listener():
+    # Write the records still in the queue, called when the process exits
+    global LISTENER
+    if LISTENER is not None:
+        LISTENER.stop()
+        for handler in LISTENER.handlers:
+            handler.close()
+        LISTENER = None
+
+def configure(app):
+    # App: records go through LOG_QUEUE to a listener thread, the file is written out of the threads that log
+    # worker processes: records are put in LOG_QUEUE of the App (inherited when forked, given by worker_init when spawned)
+    global LOG_QUEUE, LISTENER, CONFIGURED_PID
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    if app:
+        LOG_QUEUE = multiprocessing.Queue()
+        LISTENER = logging.handlers.QueueListener(LOG_QUEUE, file_handler(), respect_handler_level=True)
+        LISTENER.start()
+        atexit.register(stop_listener)
+        root.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
+    elif LOG_QUEUE is not None:
+        LISTENER = None
+        root.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
+    else:
+        # Spawned worker process before worker_init: records are kept until the queue is known
+        LISTENER = None
+        root.addHandler(logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.CRITICAL + 1))
+
+    root.setLevel(get_level())
+    CONFIGURED_PID = os.getpid()
+
+def is_worker():
+    # Process started by multiprocessing (a spawned process imports the main module before parent_process is set)
+    return multiprocessing.parent_process() is not None or getattr(multiprocessing.current_process(), '_inheriting', False)
+
+def setup_logger():
+    # Configure logging once per process, every module calls it when imported
+    with LOCK:
+        if CONFIGURED_PID != os.getpid():
+            # Create folder if it does not exits
+            os.makedirs(log_dir, exist_ok=True)
+            configure(app=not is_worker())
+    return logging.getLogger()
+
+def worker_init(log_queue):
+    # Initializer of the process pools (initializer=worker_init, initargs=(LOG_QUEUE,)):
+    # the records of a spawned worker process are sent to the listener of the App
+    global LOG_QUEUE
+    with LOCK:
+        root = logging.getLogger()
+        buffers = [handler for handler in root.handlers if isinstance(handler, logging.handlers.MemoryHandler)]
+        LOG_QUEUE = log_queue
+        configure(app=False)
+        # Records of the imports before the initializer
+        for handler in buffers:
+            handler.setTarget(root.handlers[0])
+            handler.close()
 
-    #Create and configure logger
-    LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
-    logging.basicConfig(filename= file_path,
-                        level= logging.DEBUG,
-                        format = LOG_FORMAT,
-                        filemode='w' #create new logger each execution of App
-                        )
+def after_fork():
+    # Forked worker processes do not have the listener thread of the App: put the records in the inherited queue
+    global LOCK, LISTENER
+    LOCK = threading.Lock()
+    if CONFIGURED_PID is not None:
+        LISTENER = None
+        configure(app=False)
 
-    logger = logging.getLogger()
-    return logger
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
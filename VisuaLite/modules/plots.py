@@ -1,14 +1,25 @@
 import pandas as pd
+import numpy as np
 from PIL import Image
 import datetime
 import os
 import json
+import html
+import base64
+from urllib.parse import quote
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+from matplotlib.ticker import MaxNLocator
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.express as px
+import plotly.offline
+import plotly.io as pio
 
 from modules import data_analysis as fcm
+from modules import profiling
 
 from modules.logging_cfg import setup_logger
 logger = setup_logger()
@@ -33,6 +44,22 @@ custom_dark_style = {
     'grid.color': '#333333',  # Color of grid lines / DEFAULT '#333333'
 }
 
+# Maximum points of each line trace, longer series are downsampled keeping their shape (None: all points)
+POINT_BUDGET = 5000
+# Trace rendering: 'svg' (go.Scatter), 'webgl' (go.Scattergl) or 'auto' (webgl if the figure has more than WEBGL_MIN_POINTS points
+# or at least WEBGL_MIN_TRACES scatter traces, e.g. changeover plots of all variables)
+# batch.py renders its reports as svg: index.html shows them in iframes and browsers keep about 16 WebGL contexts per page
+RENDER_MODE = 'auto'
+WEBGL_MIN_POINTS = 10000
+WEBGL_MIN_TRACES = 30
+# Plotly.js of saved html files: 'embed' (inside each file, the files of the GUI open on their own) or 'shared' (one plotly-<version>.min.js next to the files, used by batch.py)
+HTML_PLOTLYJS = 'embed'
+# Saved html files with binary trace data (base64 typed arrays): dates as epoch milliseconds, floats as float32
+HTML_COMPACT = True
+# Points of each trace in the preview image of custom plots, and its size in pixels
+PREVIEW_POINTS = 1000
+PREVIEW_SIZE = (700, 500)
+
 # Alfa Laval brand colors
 ALcolors = ['rgba(17, 56, 127, 1)', #AL blue
             'rgba(0, 0, 0, 1)', #AL white
@@ -52,6 +79,191 @@ def custom_callback(func):
             logger.error(e, exc_info=True)
     return wrapper
 
+#----------------------------------------------------------- DOWNSAMPLING
+def minmax_points(y, budget):
+    # Positions of the first, last, minimum and maximum value of budget//2 buckets, peaks of analog values are kept
+    n = len(y)
+    buckets = max(1, budget // 2)
+    size = -(-n // buckets) # ceil division
+
+    values = np.full(buckets * size, np.nan)
+    values[:n] = pd.to_numeric(pd.Series(y), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    values = values.reshape(buckets, size)
+
+    # Empty buckets (only NaN) give position 0 of the bucket
+    low = np.where(np.isnan(values), np.inf, values).argmin(axis=1)
+    high = np.where(np.isnan(values), -np.inf, values).argmax(axis=1)
+    offsets = np.arange(buckets) * size
+
+    points = np.concatenate(([0, n-1], offsets + low, offsets + high))
+    return np.unique(points[points < n])
+
+def change_points(y):
+    # Positions where a step signal changes, and the last position: same line with line_shape='hv'
+    values = pd.Series(y).to_numpy()
+    if len(values) == 0:
+        return np.arange(0)
+    changed = values[1:] != values[:-1]
+    return np.concatenate(([0], np.flatnonzero(changed) + 1, [len(values) - 1])).astype(int)
+
+def reduce_points(x, y, labels=None, step=False, budget=None):
+    # Downsample x, y (and hovertext labels) of a trace to the point budget
+    # step signals keep only their changes, analog values the min/max of each bucket
+    if budget is None:
+        budget = POINT_BUDGET
+    if budget is None or len(y) <= budget:
+        return x, y, labels
+
+    points = change_points(y) if step else minmax_points(y, budget)
+    if step and len(points) > budget:
+        # Noisy step signal
+        points = points[minmax_points(pd.Series(y).to_numpy()[points], budget)]
+    points = np.unique(points)
+
+    take = lambda values: values.iloc[points] if isinstance(values, (pd.Series, pd.Index)) else np.asarray(values)[points]
+    return take(x), take(y), (take(labels) if labels is not None else None)
+
+def webgl(fig):
+    # Draw the scatter traces of a big figure with WebGL (go.Scattergl): smooth pan and zoom with many traces
+    # hover labels, legend groups, fills and step shapes are kept, spline lines become straight lines
+    scatters = [trace for trace in fig.data if trace.type == 'scatter']
+    points = sum(len(trace.x) for trace in scatters if trace.x is not None)
+    if not scatters or RENDER_MODE == 'svg' or (RENDER_MODE == 'auto' and points <= WEBGL_MIN_POINTS and len(scatters) < WEBGL_MIN_TRACES):
+        return fig
+
+    traces = []
+    for trace in fig.data:
+        if trace.type == 'scatter':
+            props = trace.to_plotly_json()
+            props.pop('type')
+            if props.get('line', {}).get('shape') == 'spline':
+                props['line']['shape'] = 'linear'
+            trace = go.Scattergl(props)
+        traces.append(trace)
+
+    fig.data = []
+    fig.add_traces(traces)
+    logger.debug("WebGL traces: %s, %s points", len(scatters), points)
+    return fig
+
+#----------------------------------------------------------- HTML EXPORT
+def plotlyjs_file(dest_folder):
+    # Save the Plotly.js of the installed plotly version in dest_folder (once), returns its file name
+    name = "plotly-" + plotly.offline.get_plotlyjs_version() + ".min.js"
+    file_path = os.path.join(dest_folder, name)
+    if not os.path.exists(file_path):
+        # Temporary file first, html files saved at the same time never load a half written file
+        tmp_path = file_path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as js_file:
+            js_file.write(plotly.offline.get_plotlyjs())
+        os.replace(tmp_path, file_path)
+        logger.debug("Plotly.js saved: %s", file_path)
+    return name
+
+def typed_array(values, base=None):
+    # Numeric array as base64 typed array {'dtype', 'bdata'} (+ 'base' added to each value), decoded by DECODE_JS
+    return {'dtype': values.dtype.str[1:], 'bdata': base64.b64encode(np.ascontiguousarray(values).astype(values.dtype.newbyteorder('<')).tobytes()).decode('ascii'),
+            **({'base': base} if base is not None else {})}
+
+def compact_figure(fig):
+    # Figure dict with binary trace data instead of JSON text
+    # x dates: epoch milliseconds on date x axes, offsets from the first date if they fit in int32
+    # y floats: float32 (precision of the logs), y integers: smallest integer type, hover labels: categories + codes
+    fig_dict = fig.to_dict()
+    date_axes = set()
+    for trace in fig_dict['data']:
+        x = trace.get('x')
+        if x is not None and len(x):
+            x = np.asarray(x)
+            if x.dtype.kind == 'O' and isinstance(x[0], (datetime.datetime, np.datetime64)):
+                x = pd.to_datetime(x).to_numpy()
+            if x.dtype.kind == 'M' and not np.isnat(x).any():
+                ms = x.astype('datetime64[ms]').astype('int64')
+                base = int(ms.min())
+                offsets = ms - base
+                trace['x'] = typed_array(offsets.astype('int32'), base) if offsets.max() <= np.iinfo('int32').max else typed_array(ms.astype('float64'))
+                date_axes.add(trace.get('xaxis', 'x'))
+
+        y = trace.get('y')
+        if y is not None and len(y):
+            y = np.asarray(y)
+            if y.dtype.kind == 'f':
+                trace['y'] = typed_array(y.astype('float32'))
+            elif y.dtype.kind == 'b':
+                trace['y'] = typed_array(y.astype('uint8'))
+            elif y.dtype.kind in 'iu':
+                dtype = next((dtype for dtype in ['int8', 'int16', 'int32'] if np.iinfo(dtype).min <= y.min() and y.max() <= np.iinfo(dtype).max), 'float64')
+                trace['y'] = typed_array(y.astype(dtype))
+
+        labels = trace.get('hovertext')
+        if labels is not None and not isinstance(labels, str) and len(labels):
+            # Few different labels repeated in each point: categories + codes
+            codes, categories = pd.factorize(pd.Series(labels, dtype=object).fillna(''))
+            if len(categories) < 2**15:
+                trace['hovertext'] = {**typed_array(codes.astype('int16' if len(categories) > 127 else 'int8')), 'categories': list(categories)}
+
+    for axis in date_axes:
+        fig_dict['layout'].setdefault('xaxis' + axis[1:], {})['type'] = 'date'
+    return fig_dict
+
+# Decodes the typed arrays of compact_figure before the figure is created (plotly.js < 2.28 reads typed arrays, not base64)
+DECODE_JS = """var vlNewPlot = function(div, data, layout, config) {
+    var types = {f8: Float64Array, f4: Float32Array, i4: Int32Array, i2: Int16Array, i1: Int8Array, u1: Uint8Array};
+    var decode = function(value) {
+        if (value === null || typeof value !== 'object' || value.bdata === undefined) return value;
+        var text = atob(value.bdata), bytes = new Uint8Array(text.length);
+        for (var i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+        var array = new types[value.dtype](bytes.buffer);
+        if (value.categories !== undefined) return Array.from(array, function(code) { return value.categories[code]; });
+        if (value.base === undefined) return array;
+        var result = new Float64Array(array.length);
+        for (var j = 0; j < array.length; j++) result[j] = value.base + array[j];
+        return result;
+    };
+    data.forEach(function(trace) { trace.x = decode(trace.x); trace.y = decode(trace.y); trace.hovertext = decode(trace.hovertext); });
+    return Plotly.newPlot(div, data, layout, config);
+};
+"""
+
+@profiling.timed # stage of the profiling timeline
+def save_html(fig, file_path, plotlyjs=None):
+    # Save fig as html, Plotly.js shared with the other files of the folder or embedded (HTML_PLOTLYJS)
+    if plotlyjs is None:
+        plotlyjs = HTML_PLOTLYJS
+    if plotlyjs == 'shared':
+        include_plotlyjs = plotlyjs_file(os.path.dirname(os.path.abspath(file_path)))
+    else:
+        include_plotlyjs = True
+
+    if HTML_COMPACT:
+        # Trace data already validated when the figure was created
+        page = pio.to_html(compact_figure(fig), include_plotlyjs=include_plotlyjs, config={'displaylogo': False}, validate=False)
+        # Last call: embedded Plotly.js contains the same text
+        head, tail = page.rsplit("Plotly.newPlot(", 1)
+        page = head + DECODE_JS + "vlNewPlot(" + tail
+        with open(file_path, 'w', encoding='utf-8') as html_file:
+            html_file.write(page)
+    else:
+        fig.write_html(file_path, include_plotlyjs=include_plotlyjs, config={'displaylogo': False})
+    return file_path
+
+def write_index(dest_folder, files, title="VisuaLite"):
+    # index.html of dest_folder: link and lazy loaded view of each html file (paths relative to dest_folder)
+    items = []
+    for file in files:
+        name = os.path.relpath(file, dest_folder).replace(os.sep, '/')
+        items.append(f'<h2><a href="{quote(name)}">{html.escape(name)}</a></h2>\n'
+                     f'<iframe src="{quote(name)}" loading="lazy" style="width:100%;height:800px;border:none"></iframe>')
+
+    title = html.escape(title)
+    file_path = os.path.join(dest_folder, "index.html")
+    with open(file_path, 'w', encoding='utf-8') as index_file:
+        index_file.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>' + title + '</title></head>\n'
+                         '<body style="font-family:sans-serif">\n<h1>' + title + '</h1>\n'
+                         + '\n'.join(items) + '\n</body>\n</html>\n')
+    logger.debug("Index saved: %s, %s files", file_path, len(files))
+    return file_path
+
 #----------------------------------------------------------- PLOTLY Functions
 def plot_alarms(x,y,labels,cat):
     trace = go.Scatter(x=x, y=y.astype(str),
@@ -74,6 +286,7 @@ def plot_events(x,y,labels):
     return trace
 
 def line_trace(x,y,name,cat,color=None):
+    x, y, _ = reduce_points(x, y)
     if color is not None:
         trace = go.Scatter(x=x, y=y,
                            name = name,
@@ -87,6 +300,11 @@ def line_trace(x,y,name,cat,color=None):
     return trace
 
 def square_line_trace(x,y,name,cat,color=None,labels=None):
+    # Hover labels of each point (Series, array or list) are reduced with the same points as y, a single label is kept as is
+    if pd.api.types.is_list_like(labels):
+        x, y, labels = reduce_points(x, y, labels, step=True)
+    else:
+        x, y, _ = reduce_points(x, y, step=True)
     if color is not None:
         trace = go.Scatter(x=x, y=y,
                            name = name,
@@ -97,19 +315,42 @@ def square_line_trace(x,y,name,cat,color=None,labels=None):
                    name = name, line_shape='hv',
                    legendgroup=cat, legendgrouptitle_text=cat)
 
-    if isinstance(labels, pd.Series):
+    if labels is not None:
         trace.hovertext = labels
     
     return trace
 
+def step_series(dfs, col, level, label_col=None):
+    # x, y (and hover labels) of a step column: raw logs, or the changes kept by the aggregation level
+    if level is None or col + '_t1' not in dfs.columns:
+        return dfs['DateTime'], dfs[col], (dfs[label_col] if label_col is not None else None)
+    x, y = fcm.level_steps(dfs, col)
+    labels = None
+    if label_col is not None:
+        # Label of each value, from the last value of the buckets
+        pairs = dfs[[col, label_col]].dropna().drop_duplicates(subset=col)
+        labels = y.map(dict(zip(pairs[col], pairs[label_col].astype(str))))
+    return x, y, labels
+
 def square_disc_line_trace(x,y,name,color,cat):
+    x, y, _ = reduce_points(x, y, step=True)
     trace = go.Scatter(x=x, y=y,
                        name = name,
                        line=dict(color = color, dash='dot'), line_shape='hv',
                        legendgroup=cat, legendgrouptitle_text=cat)
     return trace
 
+def band_trace(x,ymin,ymax,name,cat):
+    # Area between minimum and maximum of aggregated values (pyramid levels, already within POINT_BUDGET)
+    upper = go.Scatter(x=x, y=ymax, name=name + ' max', mode='lines', line=dict(width=0),
+                       showlegend=False, hoverinfo='skip', legendgroup=cat)
+    lower = go.Scatter(x=x, y=ymin, name=name + ' min/max', mode='lines', line=dict(width=0),
+                       fill='tonexty', fillcolor='rgba(128, 128, 128, 0.25)',
+                       hoverinfo='skip', legendgroup=cat)
+    return [upper, lower]
+
 def filled_trace(x,y,name,color,cat):
+    x, y, _ = reduce_points(x, y, step=True)
     trace = go.Scatter(x=x,y=y,
                        name= name,
                        fill='tozeroy', mode='none', 
@@ -122,6 +363,7 @@ def filled_trace(x,y,name,color,cat):
     return trace
 
 @custom_callback # wrapper to catch errors
+@profiling.timed # stage of the profiling timeline
 def change_over_overlap(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     logger.debug("change_over_overlap started ---")
 
@@ -132,16 +374,16 @@ def change_over_overlap(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     alarm_cats = fcm.DATA['alarm_cats']
 
     # dates of Standard logs to filter Events and Alarms
-    mindate = LogsStandard['DateTime'].min()
-    maxdate = LogsStandard['DateTime'].max()
+    mindate = LogsStandard['DateTime'].iloc[0]
+    maxdate = LogsStandard['DateTime'].iloc[-1]
 
     if not LogsAlarms.empty:
-        alm = LogsAlarms[(LogsAlarms['DateTime'] > mindate) & (LogsAlarms['DateTime'] <= maxdate)]
+        alm = fcm.time_slice(LogsAlarms, mindate, maxdate, include_start=False)
     else:
         alm = pd.DataFrame()
 
     if not LogsEvents.empty:
-        eve = LogsEvents[(LogsEvents['DateTime'] > mindate) & (LogsEvents['DateTime'] <= maxdate)]
+        eve = fcm.time_slice(LogsEvents, mindate, maxdate, include_start=False)
     else:
         eve = pd.DataFrame()
 
@@ -443,9 +685,10 @@ def change_over_overlap(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     )
 
     logger.debug("fig done")
-    return (fig)
+    return webgl(fig)
 
 @custom_callback # wrapper to catch errors
+@profiling.timed # stage of the profiling timeline
 def change_over_divided(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     logger.debug("change_over_divided started ---")
 
@@ -456,16 +699,16 @@ def change_over_divided(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     alarm_cats = fcm.DATA['alarm_cats']
 
     # dates of Standard logs to filter Events and Alarms
-    mindate = LogsStandard['DateTime'].min()
-    maxdate = LogsStandard['DateTime'].max()
+    mindate = LogsStandard['DateTime'].iloc[0]
+    maxdate = LogsStandard['DateTime'].iloc[-1]
 
     if not LogsAlarms.empty:
-        alm = LogsAlarms[(LogsAlarms['DateTime'] > mindate) & (LogsAlarms['DateTime'] <= maxdate)]
+        alm = fcm.time_slice(LogsAlarms, mindate, maxdate, include_start=False)
     else:
         alm = pd.DataFrame()
 
     if not LogsEvents.empty:
-        eve = LogsEvents[(LogsEvents['DateTime'] > mindate) & (LogsEvents['DateTime'] <= maxdate)]
+        eve = fcm.time_slice(LogsEvents, mindate, maxdate, include_start=False)
     else:
         eve = pd.DataFrame()
 
@@ -530,7 +773,7 @@ def change_over_divided(LogsStandard, LogsAlarms, LogsEvents, mch_info):
         fig.update_yaxes(title_text="Alarms",
                         row=8, secondary_y=True)
     
-    logger.debug(f"{chart_type=}")
+    logger.debug("chart_type=%r", chart_type)
 
     # Iterate change_over_vars, to plot each category of variables
     for i, (category, variables) in enumerate(change_over_vars.items()):
@@ -798,9 +1041,10 @@ def change_over_divided(LogsStandard, LogsAlarms, LogsEvents, mch_info):
     )
 
     logger.debug('fig done')
-    return fig
+    return webgl(fig)
 
 @custom_callback # wrapper to catch errors
+@profiling.timed # stage of the profiling timeline
 def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, one for each unit
     logger.debug("custom_plot1 started ---")
 
@@ -812,23 +1056,27 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
     alarm_cats = fcm.DATA['alarm_cats']
 
     logger.debug("date limits:")
-    logger.debug(f"{date1=},{date2=}")
+    logger.debug("date1=%r,date2=%r", date1, date2)
     
     # filter dataframes for date interval selected
+    # long intervals: aggregated Standard Logs (mean, min, max) with at most POINT_BUDGET rows
+    level = None
     if not dfs.empty:
-        dfs = dfs[(dfs['DateTime'] >= date1) & (dfs['DateTime'] <= date2)]
+        level, dfs = fcm.plot_level(dfs, date1, date2, POINT_BUDGET if POINT_BUDGET is not None else float('inf'))
+        if level is not None:
+            tittle = tittle + " (" + level + " mean, min and max)"
     else:
         dfs = pd.DataFrame()
         logger.debug("Standard Logs empty in date range selected")
 
     if not dfa.empty:
-        dfa = dfa[(dfa['DateTime'] >= date1) & (dfa['DateTime'] <= date2)]
+        dfa = fcm.time_slice(dfa, date1, date2)
     else:
         dfa = pd.DataFrame()
         logger.debug("Alarm Logs empty in date range selected")
 
     if not dfe.empty:
-        dfe = dfe[(dfe['DateTime'] >= date1) & (dfe['DateTime'] <= date2)]
+        dfe = fcm.time_slice(dfe, date1, date2)
     else:
         dfe = pd.DataFrame()
         logger.debug("Event Logs empty in date range selected")
@@ -850,12 +1098,12 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
 
     # Iterate classified cols and create traces
     for i, (unit, cols) in enumerate(cols2.items()):
-        logger.debug(f"{i=}, {unit=}, {cols=}")
+        logger.debug("i=%r, unit=%r, cols=%r", i, unit, cols)
 
         fig.update_yaxes(title_text=unit,row=i+1)
 
         for col in cols:
-            logger.debug(f"{col=}")
+            logger.debug("col=%r", col)
 
             if col == 'AlarmNumber':
                 for cat, limits in alarm_cats.items():
@@ -880,10 +1128,11 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
                     fig.add_trace(trace, row=i+1, col=1)
 
             elif col == 'MachineStatus':
+                x, y, labels = step_series(dfs, 'MachineStatus', level, 'STS_Label')
                 trace = square_line_trace(
-                    x=dfs['DateTime'],
-                    y=dfs['MachineStatus'],
-                    labels=dfs['STS_Label'],
+                    x=x,
+                    y=y,
+                    labels=labels,
                     name='MachineStatus',
                     color=ALcolors[5],
                     cat='Events')
@@ -891,19 +1140,21 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
                 fig.add_trace(trace, row=i+1, col=1)
 
             elif 'CV' in col:
+                x, y, labels = step_series(dfs, col, level, col.split('_')[0]+'_Label')
                 trace = square_line_trace(
-                    x=dfs['DateTime'],
-                    y=dfs[col],
-                    labels=dfs[col.split('_')[0]+'_Label'],
+                    x=x,
+                    y=y,
+                    labels=labels,
                     name=col,
                     cat=unit)
                 fig.add_trace(trace, row=i+1, col=1)
 
             elif (col == 'ControlType') or (col == 'CurrentControl'):
+                x, y, labels = step_series(dfs, col, level, 'CC_Label')
                 trace = square_line_trace(
-                    x=dfs['DateTime'],
-                    y=dfs[col],
-                    labels=dfs['CC_Label'],
+                    x=x,
+                    y=y,
+                    labels=labels,
                     name=col,
                     cat=unit)
                 fig.add_trace(trace, row=i+1, col=1)
@@ -912,12 +1163,17 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
                 if not dfs.empty:
                     # If unit is a bool, int or valve_pos(int), create a square line trace instead of spline
                     if unit in ['bool', 'int', 'valve_pos']:
+                        x, y, _ = step_series(dfs, col, level)
                         trace = square_line_trace(
-                            x=dfs['DateTime'],
-                            y=dfs[col],
+                            x=x,
+                            y=y,
                             name=col,
                             cat=unit)
                     else:
+                        if level is not None and col + '_min' in dfs.columns:
+                            for band in band_trace(dfs['DateTime'], dfs[col + '_min'], dfs[col + '_max'], name=col, cat=unit):
+                                fig.add_trace(band, row=i+1, col=1)
+
                         trace = line_trace(
                             x=dfs['DateTime'],
                             y=dfs[col],
@@ -947,7 +1203,7 @@ def custom_plot_divided(dfs, dfa, dfe, cols, date1, date2, tittle): # n rows, on
     )
     
     logger.debug("fig done")
-    return fig
+    return webgl(fig)
 
 #----------------------------------------------------------- MATPLOTLIB
 def create_aux_plot(LogsStandard, LogsAlarms, LogsEvents):
@@ -1087,6 +1343,7 @@ def create_aux_plot(LogsStandard, LogsAlarms, LogsEvents):
     logger.debug("fig done")
     return fig
 
+@profiling.timed # stage of the profiling timeline
 def change_over_preview(df):
     logger.debug("change_over_preview started ---")
 
@@ -1139,3 +1396,97 @@ def change_over_preview(df):
     logger.debug("fig done")
     return fig
 
+def mpl_color(color):
+    # Plotly color ('rgba(r, g, b, a)', 'rgb(r, g, b)', named or hex) as matplotlib color, None for the default colors
+    if not isinstance(color, str):
+        return None
+    if color.startswith('rgb'):
+        values = [float(value) for value in color[color.index('(') + 1:color.index(')')].split(',')]
+        return tuple(value / 255 for value in values[:3]) + (tuple(values[3:4]) if len(values) > 3 else ())
+    return color
+
+@profiling.timed # stage of the profiling timeline
+def preview_image(fig):
+    # Downsampled image of a plotly figure with subplots (custom_plot_divided) drawn with matplotlib Agg in memory
+    # same rows, traces, colors and step shapes, without the browser used by fig.write_image
+    logger.debug("preview_image started ---")
+    width, height = PREVIEW_SIZE
+
+    # Subplots from top to bottom, by vertical position of their y axis
+    layout = fig.layout
+    axes_names = sorted((name for name in layout if name.startswith('yaxis') and layout[name].domain is not None),
+                        key=lambda name: -layout[name].domain[1])
+    if not axes_names:
+        axes_names = ['yaxis']
+
+    with plt.style.context('default'):
+        mpl_fig = Figure(figsize=(width / 100, height / 100), dpi=100)
+        FigureCanvasAgg(mpl_fig)
+        axes = mpl_fig.subplots(nrows=len(axes_names), ncols=1, sharex=True, squeeze=False)[:, 0]
+        axes = dict(zip(axes_names, axes))
+
+        # Traces without color get the next color of the plotly template, as in the html figure
+        colorway = list(layout.template.layout.colorway or px.colors.qualitative.Plotly)
+        n_default = 0
+        previous = {}
+        for trace in fig.data:
+            if trace.x is None or trace.y is None or len(trace.x) == 0:
+                continue
+            ax = axes.get('yaxis' + (trace.yaxis or 'y')[1:], axes[axes_names[0]])
+            x, y = np.asarray(trace.x), np.asarray(trace.y)
+            if y.dtype.kind in 'OU':
+                # Alarm numbers as text (categories in plotly)
+                y = pd.to_numeric(y, errors='coerce')
+            if trace.fill == 'tonexty' and ax in previous and len(previous[ax]) == len(y):
+                # Band between two traces: both at the same points
+                lower, y = y, previous[ax]
+                if len(y) > PREVIEW_POINTS:
+                    points = minmax_points(lower, PREVIEW_POINTS)
+                    x, lower, y = x[points], lower[points], y[points]
+                ax.fill_between(x, lower, y, color=mpl_color(trace.fillcolor), linewidth=0)
+                continue
+            previous[ax] = y
+            if len(y) > PREVIEW_POINTS and y.dtype.kind in 'fiub':
+                points = minmax_points(y, PREVIEW_POINTS)
+                x, y = x[points], y[points]
+
+            line = trace.line
+            color = mpl_color(line.color if line is not None else None)
+            if color is None and trace.mode != 'markers' and trace.fill is None:
+                color = colorway[n_default % len(colorway)]
+                n_default += 1
+            step = 'post' if line is not None and line.shape == 'hv' else None
+
+            if trace.mode == 'markers':
+                marker = trace.marker
+                ax.plot(x, y, linestyle='none', marker='x' if marker.symbol == 'x' else '*', markersize=4,
+                        color=mpl_color(marker.color), label=trace.name)
+            elif trace.fill == 'tozeroy':
+                ax.fill_between(x, y, step=step, color=mpl_color(trace.fillcolor), linewidth=0, label=trace.name)
+            elif line is None or line.width != 0:
+                linestyle = ':' if line is not None and line.dash == 'dot' else '-'
+                if step:
+                    ax.step(x, y, where='post', color=color, linestyle=linestyle, linewidth=1, label=trace.name)
+                else:
+                    ax.plot(x, y, color=color, linestyle=linestyle, linewidth=1, label=trace.name)
+
+        # Few ticks: most of the drawing time is spent creating them
+        locator = mdates.AutoDateLocator(minticks=3, maxticks=6)
+        axes[axes_names[-1]].xaxis.set_major_locator(locator)
+        axes[axes_names[-1]].xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        for name, ax in axes.items():
+            ax.set_ylabel(layout[name].title.text or '', fontsize=8)
+            ax.yaxis.set_major_locator(MaxNLocator(nbins=3))
+            ax.tick_params(labelsize=7)
+            ax.grid(linestyle='--', linewidth=0.5, alpha=0.5)
+            if ax.get_legend_handles_labels()[0]:
+                ax.legend(fontsize=6, loc='upper left', bbox_to_anchor=(1.0, 1.0), frameon=False)
+        mpl_fig.suptitle(layout.title.text or '', fontsize=10)
+        # Space for the legends on the right
+        mpl_fig.subplots_adjust(left=0.1, right=0.75, top=0.92, bottom=0.08, hspace=0.15)
+
+        mpl_fig.canvas.draw()
+        image = Image.frombuffer('RGBA', mpl_fig.canvas.get_width_height(), mpl_fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).copy()
+
+    logger.debug("--- preview_image finished")
+    return image
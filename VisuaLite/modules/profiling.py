@@ -0,0 +1,232 @@
+import collections
+import contextlib
+import ctypes
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from modules.logging_cfg import setup_logger, log_dir
+logger = setup_logger()
+logger.info("profiling.py imported")
+
+# Record stages (False: decorated functions are only called)
+ENABLED = True
+# JSON timeline of the stages, one JSON object per line, written when the outermost stage of a thread finishes
+# only written by the process that called start() (the App), worker processes return their stages with run_in_worker
+TIMELINE_FILE = os.path.join(log_dir, 'visualite_timeline.jsonl')
+# Process writing TIMELINE_FILE, None until start() is called
+TIMELINE_PID = None
+# Last runs (outermost stage and its nested stages) kept for the GUI
+HISTORY = collections.deque(maxlen=20)
+
+# Stages in progress of each thread
+LOCAL = threading.local()
+# Number of runs of this process
+RUNS = 0
+LOCK = threading.Lock()
+
+if sys.platform == 'win32':
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+def start():
+    # New timeline for this execution, called by the App (batch.py and the benchmarks only keep the runs in HISTORY)
+    global TIMELINE_PID
+    os.makedirs(log_dir, exist_ok=True)
+    open(TIMELINE_FILE, 'w').close()
+    TIMELINE_PID = os.getpid()
+
+def process_memory():
+    # (resident memory, peak resident memory) of the process in bytes, None if not available
+    try:
+        if sys.platform == 'win32':
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        with open('/proc/self/status', 'r') as status:
+            values = dict(line.split(':', 1) for line in status if line.startswith(('VmRSS', 'VmHWM')))
+        return int(values['VmRSS'].split()[0]) * 1024, int(values['VmHWM'].split()[0]) * 1024
+    except Exception:
+        return None
+
+def reset_peak():
+    # Linux: the peak resident memory starts again from the resident memory now
+    # (Windows can not reset it, the peak of a stage is then the peak of the process until the end of the stage)
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+
+def memory_start():
+    # Peak of the process until now added to the stages in progress, then a new peak for the stage starting
+    memory = process_memory()
+    if memory is None:
+        return None
+    for peak in LOCAL.peaks:
+        if peak is not None:
+            peak[0] = max(peak[0], memory[1])
+    reset_peak()
+    return [memory[0]]
+
+def memory_peak():
+    # Peak resident memory of the process during the innermost stage in MB, also counted for the stage containing it
+    # (stages of other threads running at the same time are counted too)
+    peak = LOCAL.peaks.pop()
+    memory = process_memory()
+    if peak is None or memory is None:
+        return None
+    peak = max(peak[0], memory[1])
+    if LOCAL.peaks and LOCAL.peaks[-1] is not None:
+        LOCAL.peaks[-1][0] = max(LOCAL.peaks[-1][0], peak)
+    reset_peak()
+    return round(peak / 1024**2, 1)
+
+def rows_of(obj):
+    # Rows of a DataFrame or LogStore, None for other objects
+    if hasattr(obj, 'columns') and hasattr(obj, '__len__'):
+        return len(obj)
+    return None
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    # Record wall time, CPU time, rows and peak memory of the code inside the with block
+    # stages inside other stages of the same thread are nested, the outermost one is a run
+    if not ENABLED:
+        yield {}
+        return
+
+    stack = getattr(LOCAL, 'stack', None)
+    if stack is None:
+        stack = LOCAL.stack = []
+    if not stack:
+        LOCAL.records = []
+        LOCAL.peaks = []
+        LOCAL.run_start = time.perf_counter()
+
+    record = {'stage': name, 'parent': stack[-1]['stage'] if stack else None, 'depth': len(stack),
+              'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+              'start_s': round(time.perf_counter() - LOCAL.run_start, 4), 'rows': rows}
+    LOCAL.records.append(record)
+    stack.append(record)
+    LOCAL.peaks.append(memory_start())
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    except BaseException:
+        record['error'] = True
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        record['peak_mb'] = memory_peak()
+        stack.pop()
+        if not stack:
+            finish_run(LOCAL.records)
+
+def timed(func):
+    # Decorator: record each call of func as a stage named as the function
+    # rows: rows of the first argument if it is a DataFrame/LogStore, else of the DataFrame returned
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        rows = rows_of(args[0]) if args else None
+        with stage(func.__name__, rows) as record:
+            result = func(*args, **kwargs)
+            if record.get('rows') is None:
+                record['rows'] = rows_of(result)
+            return result
+    return wrapper
+
+def add_rows(rows):
+    # Add rows processed to the innermost stage of the thread
+    stack = getattr(LOCAL, 'stack', None)
+    if ENABLED and stack:
+        stack[-1]['rows'] = (stack[-1]['rows'] or 0) + rows
+
+def run_in_worker(func, *args):
+    # Executed in the worker processes: call func and return its result and the stages recorded during the call
+    # the App adds them to its current stage with add_worker_stages
+    # (a forked worker process inherits the stages in progress of the thread that started it)
+    LOCAL.stack = []
+    LOCAL.collected = []
+    try:
+        result = func(*args)
+        return result, LOCAL.collected
+    finally:
+        LOCAL.collected = None
+
+def add_worker_stages(records):
+    # Add the stages returned by run_in_worker as nested stages of the innermost stage of the thread
+    stack = getattr(LOCAL, 'stack', None)
+    if not ENABLED or not stack:
+        return
+    for record in records:
+        LOCAL.records.append(dict(record, depth=record['depth'] + len(stack), parent=record['parent'] or stack[-1]['stage']))
+
+def finish_run(records):
+    # Keep the run for the GUI and append its stages to the timeline
+    # in a worker process called by run_in_worker: the stages are returned to the App
+    global RUNS
+    collected = getattr(LOCAL, 'collected', None)
+    if collected is not None:
+        pid = os.getpid()
+        collected.extend(dict(record, pid=pid) for record in records)
+        return
+
+    with LOCK:
+        RUNS += 1
+        run = f"{os.getpid()}-{RUNS}"
+        HISTORY.append({'run': run, 'stage': records[0]['stage'], 'records': records})
+        if TIMELINE_PID != os.getpid():
+            return
+        try:
+            with open(TIMELINE_FILE, 'a') as timeline:
+                timeline.write(''.join(json.dumps(dict({'pid': os.getpid()}, **record, run=run, thread=threading.current_thread().name)) + '\n'
+                                       for record in records))
+        except OSError as e:
+            logger.error("--- Error writing profiling timeline")
+            logger.error(e, exc_info=True)
+
+def last_run(stages):
+    # Last run whose outermost stage is one of stages, None if there is none
+    for run in reversed(HISTORY):
+        if run['stage'] in stages:
+            return run
+    return None
+
+def summary(run):
+    # Text with one line per stage of a run, repeated stages with the same parent are added up
+    lines = {}
+    for record in run['records']:
+        key = (record['depth'], record['parent'], record['stage'])
+        if key not in lines:
+            lines[key] = dict(record, calls=0, wall_s=0, cpu_s=0, rows=None, peak_mb=None)
+        line = lines[key]
+        line['calls'] += 1
+        line['wall_s'] += record.get('wall_s', 0)
+        line['cpu_s'] += record.get('cpu_s', 0)
+        if record['rows'] is not None:
+            line['rows'] = (line['rows'] or 0) + record['rows']
+        if record.get('peak_mb') is not None:
+            line['peak_mb'] = max(line['peak_mb'] or 0, record['peak_mb'])
+
+    text = []
+    for (depth, parent, name), line in lines.items():
+        calls = f" x{line['calls']}" if line['calls'] > 1 else ''
+        rows = f", {line['rows']} rows" if line['rows'] is not None else ''
+        peak = f", peak {line['peak_mb']:.0f} MB" if line['peak_mb'] is not None else ''
+        text.append(f"{'    ' * depth}{name}{calls}: {line['wall_s']:.2f} s (CPU {line['cpu_s']:.2f} s{rows}{peak})")
+    return '\n'.join(text)
@@ -0,0 +1,59 @@
+import importlib
+import threading
+import time
+
+from modules.logging_cfg import setup_logger
+logger = setup_logger()
+logger.info("startup.py imported")
+
+# Start of the application (time.perf_counter), set by main.py before the other imports
+START = time.perf_counter()
+# Startup steps: [(step, seconds since START)]
+MARKS = []
+
+def mark(step):
+    # Save the time of a startup step
+    MARKS.append((step, time.perf_counter() - START))
+
+def report():
+    # Log the time of each startup step since START, returns {step: seconds}
+    times = dict(MARKS)
+    logger.info("Startup times: " + ", ".join(f"{step} {seconds:.2f} s" for step, seconds in MARKS))
+    return times
+
+class LazyModule:
+    # Module imported on the first use of one of its attributes, heavy packages (pandas, plotly, matplotlib) do not delay the window
+    # PyInstaller does not see these imports: add the module to hiddenimports of main.spec
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        # Import the module, a use from another thread during the import waits for it
+        with self.lock:
+            if self.module is None:
+                start = time.perf_counter()
+                self.module = importlib.import_module(self.name)
+                logger.debug("%s loaded in %.2f s", self.name, time.perf_counter() - start)
+        return self.module
+
+    def is_loaded(self):
+        return self.module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+def preload(modules):
+    # Import LazyModules in a background thread once the window is shown, so they are ready for the first import or plot
+    def worker():
+        try:
+            for module in modules:
+                module.load()
+            mark("modules preloaded")
+            report()
+        except Exception as e:
+            logger.error("--- Error preloading modules")
+            logger.error(e, exc_info=True)
+
+    threading.Thread(target=worker, daemon=True).start()
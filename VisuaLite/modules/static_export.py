@@ -0,0 +1,153 @@
+import importlib.util
+import multiprocessing
+import os
+
+import plotly
+
+from modules import logging_cfg
+from modules.logging_cfg import setup_logger
+logger = setup_logger()
+logger.info("static_export.py imported")
+
+# Static image formats written by kaleido
+FORMATS = ['png', 'svg', 'pdf']
+# Size of the images in pixels (pdf and svg: same proportions)
+IMAGE_SIZE = (1600, 1000)
+# Renderer processes, each one keeps its own kaleido (Chromium) running between exports
+WORKERS = max(1, min(4, os.cpu_count() or 1))
+# Seconds to render one image before the renderers are restarted, and times a figure is tried again
+# (images not saved yet when the renderers are restarted also count one try)
+TIMEOUT = 120
+RETRIES = 1
+# Seconds to start the renderers and render a tiny figure before an export
+PROBE_TIMEOUT = 60
+# Renderer processes, started with the first export
+POOL = None
+POOL_WORKERS = None
+
+# Kaleido scope of a renderer process, and the error if kaleido could not be started
+SCOPE = None
+INIT_ERROR = None
+
+def available():
+    # Static export needs the kaleido package
+    return importlib.util.find_spec('kaleido') is not None
+
+def init_renderer(log_queue):
+    # Executed once in each renderer process: start kaleido and render an empty figure, so the first export is not slower
+    # errors are not raised: the pool would start new renderer processes failing again, probe and render return INIT_ERROR
+    global SCOPE, INIT_ERROR
+    logging_cfg.worker_init(log_queue)
+    try:
+        from kaleido.scopes.plotly import PlotlyScope
+        SCOPE = PlotlyScope(plotlyjs=os.path.join(os.path.dirname(os.path.abspath(plotly.__file__)), 'package_data', 'plotly.min.js'))
+        SCOPE.transform({'data': [], 'layout': {}}, format='png', width=10, height=10)
+    except Exception as e:
+        SCOPE = None
+        INIT_ERROR = f"kaleido could not be started: {e!r}"
+        logger.error("--- %s", INIT_ERROR)
+
+def probe():
+    # Executed in a renderer process: kaleido started by init_renderer renders a tiny figure
+    if SCOPE is None:
+        raise RuntimeError(INIT_ERROR)
+    SCOPE.transform({'data': [], 'layout': {}}, format='png', width=10, height=10)
+    return True
+
+def render(fig_dict, file_path, format):
+    # Executed in the renderer processes: save one image, through a temporary file so failed exports leave no files
+    if SCOPE is None:
+        raise RuntimeError(INIT_ERROR)
+    width, height = IMAGE_SIZE
+    image = SCOPE.transform(fig_dict, format=format, width=width, height=height)
+    with open(file_path + '.tmp', 'wb') as image_file:
+        image_file.write(image)
+    os.replace(file_path + '.tmp', file_path)
+    return file_path
+
+def get_pool(workers=None):
+    # Return the renderer processes, started again if the number of workers changed
+    global POOL, POOL_WORKERS
+    if workers is None:
+        workers = WORKERS
+    if POOL is not None and POOL_WORKERS != workers:
+        shutdown()
+    if POOL is None:
+        logger.debug("Renderer processes started with workers=%r", workers)
+        POOL = multiprocessing.Pool(processes=workers, initializer=init_renderer, initargs=(logging_cfg.LOG_QUEUE,))
+        POOL_WORKERS = workers
+        # A tiny figure must be rendered before the jobs are sent: kaleido not working fails at once, not after TIMEOUT for each job
+        try:
+            POOL.apply_async(probe).get(PROBE_TIMEOUT)
+        except Exception as e:
+            shutdown()
+            raise RuntimeError(str(e) if str(e) else f"renderers not ready after {PROBE_TIMEOUT} s")
+    return POOL
+
+def shutdown():
+    # Kill the renderer processes (also the ones blocked in an export)
+    global POOL, POOL_WORKERS
+    if POOL is not None:
+        POOL.terminate()
+        POOL.join()
+        POOL = None
+        POOL_WORKERS = None
+
+def export(jobs, workers=None):
+    # Save static images of figures in parallel, jobs: list of (fig or fig dict, file path, format)
+    # returns one (file path or None, error message or None) per job, in the order of jobs
+    # an image taking more than TIMEOUT seconds restarts the renderers, its job is tried again RETRIES times
+    logger.debug("export started --- %s images", len(jobs))
+    results = [None] * len(jobs)
+    pending = []
+    for index, (fig, file_path, format) in enumerate(jobs):
+        if format not in FORMATS:
+            results[index] = (None, f"format {format} not in {FORMATS}")
+            continue
+        fig_dict = fig if isinstance(fig, dict) else fig.to_dict()
+        # WebGL traces (plots.webgl) are drawn as vector traces: sharp pdf/svg and no WebGL needed in headless Chromium
+        for trace in fig_dict['data']:
+            if trace.get('type') == 'scattergl':
+                trace['type'] = 'scatter'
+        pending.append((index, (fig_dict, file_path, format), 0))
+
+    while pending:
+        try:
+            pool = get_pool(workers)
+        except RuntimeError as e:
+            logger.error("--- Renderers could not be started: %s", e)
+            for index, job, tries in pending:
+                results[index] = (None, str(e))
+            break
+
+        submitted = [(index, job, tries, pool.apply_async(render, job)) for index, job, tries in pending]
+        pending = []
+
+        for n, (index, job, tries, result) in enumerate(submitted):
+            try:
+                results[index] = (result.get(TIMEOUT), None)
+
+            except multiprocessing.TimeoutError:
+                logger.error("--- Export of %s timed out after %s s, restarting renderers", job[1], TIMEOUT)
+                shutdown()
+                # Images not saved yet were lost with the renderers, each one counts one try (started or not)
+                # so the renderers are restarted at most RETRIES times; the image that timed out is tried again last
+                for index, job, tries, result in submitted[n+1:] + submitted[n:n+1]:
+                    if result.ready():
+                        try:
+                            results[index] = (result.get(), None)
+                        except Exception as e:
+                            results[index] = (None, str(e))
+                    elif tries < RETRIES:
+                        pending.append((index, job, tries + 1))
+                    else:
+                        results[index] = (None, f"not saved, renderers restarted after a timeout of {TIMEOUT} s")
+                break
+
+            except Exception as e:
+                logger.error("--- Error exporting %s", job[1])
+                logger.error(e, exc_info=True)
+                results[index] = (None, str(e))
+
+    logger.debug("--- export finished")
+    return results
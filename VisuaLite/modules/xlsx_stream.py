@@ -0,0 +1,160 @@
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from modules.logging_cfg import setup_logger
+logger = setup_logger()
+logger.info("xlsx_stream.py imported")
+
+# Rows converted to xml and written to the file at once
+CHUNK_ROWS = 20000
+# Rows of an Excel sheet (header included), longer DataFrames are continued in the sheets <name>_2, <name>_3...
+MAX_ROWS = 1048576
+# Characters of a sheet name
+MAX_NAME = 31
+# Number format of datetime columns (style 1 of styles.xml)
+DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+# Excel day 0
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+# Characters not allowed in xml (control characters except tab and new lines), Excel does not open a workbook with one of them
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                 '<Default Extension="xml" ContentType="application/xml"/>'
+                 '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                 '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                 '{sheets}</Types>')
+SHEET_TYPE = '<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+ROOT_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+             '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+             '</Relationships>')
+WORKBOOK = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>{sheets}</sheets></workbook>')
+WORKBOOK_SHEET = '<sheet name="{name}" sheetId="{n}" r:id="rId{n}"/>'
+WORKBOOK_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{sheets}'
+                 '<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+                 '</Relationships>')
+WORKBOOK_SHEET_REL = '<Relationship Id="rId{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{n}.xml"/>'
+STYLES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+          '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+          '<numFmts count="1"><numFmt numFmtId="164" formatCode="{date_format}"/></numFmts>'
+          '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+          '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+          '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+          '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+          '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+          '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+          '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+          '</styleSheet>')
+SHEET_START = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+               '<cols><col min="{date_col}" max="{date_col}" width="20" customWidth="1"/></cols><sheetData>')
+SHEET_END = '</sheetData></worksheet>'
+
+def column_letter(n):
+    # 0 -> A, 26 -> AA
+    letters = ''
+    n += 1
+    while n:
+        n, rest = divmod(n - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+def xml_text(value):
+    # Text of a cell or sheet name without invalid characters, escaped
+    return escape(INVALID_XML.sub('', str(value)))
+
+def text_cells(values, refs):
+    # Inline string cells, empty cells for missing values
+    values = pd.Series(values, dtype=object)
+    missing = values.isna().to_numpy()
+    text = values.astype(str).str.replace(INVALID_XML, '', regex=True).map(escape).to_numpy(dtype=object)
+    cells = '<c r="' + refs + '" t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>'
+    cells[missing] = ''
+    return cells
+
+def number_cells(values, refs, style=''):
+    # Number cells (shortest text of each float), empty cells for NaN
+    values = np.asarray(values, dtype=np.float64)
+    missing = ~np.isfinite(values)
+    cells = '<c r="' + refs + '"' + style + '><v>' + values.astype(str).astype(object) + '</v></c>'
+    cells[missing] = ''
+    return cells
+
+def column_cells(col, refs):
+    # xml of the cells of one column: dates as Excel serial numbers with date format, numbers, booleans and text
+    if col.dtype.kind == 'M':
+        serials = ((col - EXCEL_EPOCH) / pd.Timedelta(days=1)).to_numpy(dtype=np.float64, na_value=np.nan)
+        return number_cells(serials, refs, ' s="1"')
+    if col.dtype.kind == 'b':
+        return '<c r="' + refs + '" t="b"><v>' + col.to_numpy().astype(np.int8).astype(str).astype(object) + '</v></c>'
+    if col.dtype.kind in 'iuf':
+        return number_cells(col.to_numpy(dtype=np.float64, na_value=np.nan), refs)
+    return text_cells(col, refs)
+
+def sheet_rows(df, first_row):
+    # xml of the rows of df, first_row: Excel row number of the first row
+    rows = np.arange(first_row, first_row + len(df)).astype(str).astype(object)
+    xml = '<row r="' + rows + '">'
+    for n, name in enumerate(df.columns):
+        xml = xml + column_cells(df[name], column_letter(n) + rows)
+    xml = xml + '</row>'
+    return ''.join(xml.tolist())
+
+def sheet_parts(name, df):
+    # (sheet name, rows) of the sheets of one DataFrame, at most MAX_ROWS - 1 rows below the header of each sheet
+    for n, start in enumerate(range(0, max(len(df), 1), MAX_ROWS - 1), start=1):
+        suffix = '' if n == 1 else '_' + str(n)
+        yield str(name)[:MAX_NAME - len(suffix)] + suffix, df.iloc[start:start + MAX_ROWS - 1]
+
+def write_sheet(sheet, df, convert=None):
+    # Stream the header and the rows of df to the open sheet file, in chunks of CHUNK_ROWS rows
+    dates = [n + 1 for n, col in enumerate(df.columns) if df[col].dtype.kind == 'M'] or [1]
+    sheet.write(SHEET_START.format(date_col=dates[0]).encode('utf-8'))
+    header = '<row r="1">' + ''.join(f'<c r="{column_letter(n)}1" t="inlineStr"><is><t>{xml_text(col)}</t></is></c>'
+                                     for n, col in enumerate(df.columns)) + '</row>'
+    sheet.write(header.encode('utf-8'))
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS]
+        if convert is not None:
+            chunk = convert(chunk)
+        sheet.write(sheet_rows(chunk, start + 2).encode('utf-8'))
+    sheet.write(SHEET_END.encode('utf-8'))
+
+def write_xlsx(file_path, sheets, convert=None):
+    # Save (sheet name, DataFrame) pairs as an Excel workbook, each sheet streamed to the file in chunks of CHUNK_ROWS rows
+    # DataFrames with more rows than an Excel sheet are split in several sheets (sheet_parts)
+    # convert: function applied to each chunk before it is written (only one converted chunk in memory)
+    logger.debug("write_xlsx started ---")
+    names = []
+    with zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as xlsx:
+        for name, df in sheets:
+            for part_name, part in sheet_parts(name, df):
+                names.append(part_name)
+                with xlsx.open(f"xl/worksheets/sheet{len(names)}.xml", 'w', force_zip64=True) as sheet:
+                    write_sheet(sheet, part, convert)
+                logger.debug("Sheet %s: %s rows", part_name, len(part))
+
+        if not names:
+            # A workbook needs at least one sheet
+            names.append('Sheet1')
+            xlsx.writestr("xl/worksheets/sheet1.xml", SHEET_START.format(date_col=1) + SHEET_END)
+
+        numbers = range(1, len(names) + 1)
+        xlsx.writestr("[Content_Types].xml", CONTENT_TYPES.format(sheets=''.join(SHEET_TYPE.format(n=n) for n in numbers)))
+        xlsx.writestr("_rels/.rels", ROOT_RELS)
+        xlsx.writestr("xl/workbook.xml", WORKBOOK.format(sheets=''.join(WORKBOOK_SHEET.format(name=xml_text(name).replace('"', '&quot;'), n=n)
+                                                                         for n, name in zip(numbers, names))))
+        xlsx.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS.format(sheets=''.join(WORKBOOK_SHEET_REL.format(n=n) for n in numbers)))
+        xlsx.writestr("xl/styles.xml", STYLES.format(date_format=DATE_FORMAT))
+
+    logger.debug("--- write_xlsx finished")
+    return file_path
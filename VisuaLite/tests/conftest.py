@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Modules of VisuaLite and the log generator of the benchmarks, from any folder
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# The modules write __vl.log in the working folder: a temporary folder, not the repository
+os.chdir(tempfile.mkdtemp(prefix='visualite_tests_'))
+
+@pytest.fixture(scope='session')
+def one_logs(tmp_path_factory):
+    # Folder of generated FCM One logs (2 days) and its description
+    import generate
+    return generate.get_folder(str(tmp_path_factory.mktemp('logs')), 'FCM One | 1.5')
+
+@pytest.fixture(scope='session')
+def one_import(one_logs):
+    # import_data result of the generated FCM One logs, formatted files not cached
+    from modules import data_analysis as fcm_da
+    from modules import log_cache
+    log_cache.ENABLED = False
+    folder, description = one_logs
+    return fcm_da.import_data(folder, description['files'], 'FCM One | 1.5')
@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+RUN = os.path.join(ROOT, 'benchmarks', 'run.py')
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+def test_run_saves_results(tmp_path):
+    # Smallest folder of generated logs, one call of each benchmark: results as in the committed baseline (times are not compared)
+    output = tmp_path / 'results.json'
+    process = subprocess.run([sys.executable, RUN, '-m', 'FCM One | 1.5', '-s', '1', '-r', '1', '--data', str(tmp_path / 'data'),
+                              '--baseline', str(tmp_path / 'no_baseline.json'), '-o', str(output)], capture_output=True, text=True)
+    assert process.returncode == 0, process.stdout + process.stderr
+
+    with open(output, 'r') as output_file:
+        results = json.load(output_file)
+    with open(BASELINE, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+
+    assert results['machine']['python']
+    assert set(results['one_1x_seed0']) == set(baseline['one_1x_seed0'])
+    for name, result in results['one_1x_seed0'].items():
+        assert result['seconds'] >= 0
+        assert result['result'] == baseline['one_1x_seed0'][name]['result'], name
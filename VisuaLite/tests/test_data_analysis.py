@@ -0,0 +1,13 @@
+import pandas as pd
+
+from modules import data_analysis as fcm_da
+
+def test_compact_dtypes_keeps_fractional_values():
+    fcm_da.load_data('FCM One | 1.5')
+    col = next(col for col, unit in fcm_da.DATA['units'].items() if unit in fcm_da.INT_UNITS)
+
+    df = fcm_da.compact_dtypes(pd.DataFrame({col: [0.0, 0.5, 1.0]}))
+    assert df[col].dtype == 'float32'
+    assert df[col].tolist() == [0.0, 0.5, 1.0]
+
+    assert fcm_da.compact_dtypes(pd.DataFrame({col: [0.0, 1.0, 2.0]}))[col].dtype == 'int8'
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from modules import data_analysis as fcm_da
+from modules import plots as fcm_plt
+
+def changeover_figure(variables=45, points=200):
+    # Figure like change_over_divided of all variables: step traces with hover labels in legend groups, below WEBGL_MIN_POINTS
+    x = pd.Series(pd.date_range('2023-01-02', periods=points, freq='10s'))
+    fig = fcm_plt.go.Figure()
+    for i in range(variables):
+        y = pd.Series(np.arange(points) // 50 % 3)
+        labels = y.map({0: 'Off', 1: 'Standby', 2: 'Running'})
+        fig.add_trace(fcm_plt.square_line_trace(x, y, 'var' + str(i), 'cat' + str(i % 5), labels=labels))
+    return fig
+
+def test_webgl_changeover_of_45_variables(monkeypatch):
+    monkeypatch.setattr(fcm_plt, 'RENDER_MODE', 'auto')
+    fig = changeover_figure()
+    assert sum(len(trace.x) for trace in fig.data) <= fcm_plt.WEBGL_MIN_POINTS
+
+    fig = fcm_plt.webgl(fig)
+    assert len(fig.data) == 45
+    for i, trace in enumerate(fig.data):
+        assert trace.type == 'scattergl'
+        assert trace.line.shape == 'hv'
+        assert trace.legendgroup == 'cat' + str(i % 5)
+        assert list(trace.hovertext[:3]) == ['Off', 'Off', 'Off']
+
+def test_webgl_few_traces_stay_svg(monkeypatch):
+    monkeypatch.setattr(fcm_plt, 'RENDER_MODE', 'auto')
+    fig = fcm_plt.webgl(changeover_figure(variables=5))
+    assert {trace.type for trace in fig.data} == {'scatter'}
+
+def test_webgl_generated_changeover(one_import, monkeypatch):
+    monkeypatch.setattr(fcm_plt, 'RENDER_MODE', 'auto')
+    _, mch_info, COs, LogsStandard, LogsAlarms, LogsEvents = one_import
+    fig = fcm_plt.change_over_divided(fcm_da.ChangeOverToDF(COs[0], LogsStandard), LogsAlarms, LogsEvents, mch_info)
+    scatters = [trace for trace in fig.data if trace.type.startswith('scatter')]
+    assert {trace.type for trace in scatters} == {'scattergl'}
+    assert any(trace.line.shape == 'hv' for trace in scatters)
+    assert any(trace.hovertext is not None for trace in scatters)
+
+def test_square_line_labels_survive_downsampling(monkeypatch):
+    monkeypatch.setattr(fcm_plt, 'POINT_BUDGET', 100)
+    x = pd.Series(pd.date_range('2023-01-02', periods=5000, freq='10s'))
+    y = pd.Series(np.arange(5000) // 500 % 3)
+    names = np.array(['Off', 'Standby', 'Running'])
+
+    for labels in (pd.Series(names[y]), names[y], names[y].tolist()):
+        trace = fcm_plt.square_line_trace(x, y, 'MachineStatus', 'Events', labels=labels)
+        assert len(trace.x) < 100
+        assert len(trace.hovertext) == len(trace.y)
+        assert list(trace.hovertext) == [names[value] for value in trace.y]
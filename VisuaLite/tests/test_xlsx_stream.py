@@ -0,0 +1,18 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from modules import xlsx_stream
+
+def test_long_sheet_continues_in_more_sheets(tmp_path, monkeypatch):
+    monkeypatch.setattr(xlsx_stream, 'MAX_ROWS', 11)
+    df = pd.DataFrame({'DateTime': pd.date_range('2023-01-02', periods=25, freq='10s'), 'Value': np.arange(25.0)})
+    file_path = str(tmp_path / 'export.xlsx')
+    xlsx_stream.write_xlsx(file_path, [('Standard', df), ('Alarms', df.iloc[:3])])
+
+    workbook = openpyxl.load_workbook(file_path)
+    assert workbook.sheetnames == ['Standard', 'Standard_2', 'Standard_3', 'Alarms']
+    values = [row[1] for sheet in workbook.worksheets[:3] for row in sheet.iter_rows(min_row=2, values_only=True)]
+    assert values == df['Value'].tolist()
+    assert all(sheet.max_row <= 11 and sheet['A1'].value == 'DateTime' for sheet in workbook.worksheets)
+    assert workbook['Standard_2']['A2'].value == df['DateTime'].iat[10]